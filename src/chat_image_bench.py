@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""
+聊天圖產生效能量測（離線）
+
+    cd src
+    python -m chat_image_bench                          # 每種商品 × 方向各 20 筆
+    python -m chat_image_bench --count 50 --backend processes --format jpeg --json
+    python -m chat_image_bench --save-baseline bench_baseline.json
+    python -m chat_image_bench --baseline bench_baseline.json --max-regression 0.15
+
+以固定的合成記錄（三種商品 × 入帳 / 出帳，seeded 產圖）量測：
+- sequential：單執行緒逐張產圖，images/sec 與各階段每張耗時
+  （layout / canvas / shadow / bubble / text / emoji / encode）
+- batch：generate_images_from_records（指定 backend / workers）的 images/sec
+- peak RSS（本行程與子行程）
+
+預設不經 Pilmoji 抓 emoji 圖源（只用 emoji 圖集 cache/emoji_atlas，沒有則以字型繪製），可完全離線執行；
+--online 才允許 Pilmoji。與 baseline 相比 images/sec 下降超過 --max-regression（或低於 --min-ips）時結束碼 1；
+baseline 的筆數 / 格式 / Pilmoji / 後端 / worker 數與本次不同時不比較，結束碼 2。
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+from pathlib import Path
+
+from modules.resources import project_root
+from modules.task_stages import ALL_PRODUCT_CODES
+
+DIRECTIONS = ("in", "out")
+PHASES = ("layout", "canvas", "shadow", "bubble", "text", "emoji", "encode")
+_NAMES = ("小明", "Amy Chen", "阿凱😊", "玩家_007", "🐱貓貓", "Lee Wang", "老王🔥", "若水")
+
+
+def synthetic_records(count: int):
+    """每個 (商品, 方向) 各 count 筆；內容固定，重跑結果可比較。"""
+    recs = []
+    n = 0
+    for ptype in ALL_PRODUCT_CODES:
+        for direction in DIRECTIONS:
+            for i in range(count):
+                n += 1
+                recs.append({
+                    "product_type": ptype,
+                    "direction": direction,
+                    "order_no": f"BENCH{n:05d}",
+                    "customer_name": _NAMES[n % len(_NAMES)],
+                    "amount": str(300 + (n * 137) % 48000),
+                    "apply_time": f"2024-03-{1 + n % 28:02d} {8 + n % 14:02d}:{n % 60:02d}:00",
+                    "item_name": "傳說之劍" if n % 2 else "稀有坐騎",
+                    "goods_name": "二手手機" if n % 3 else "遊戲主機",
+                })
+    return recs
+
+
+def peak_rss_mb():
+    """回傳 (本行程, 子行程) 的 peak RSS（MB）；平台不支援時為 None。"""
+    try:
+        import resource
+    except ImportError:
+        return None, None
+    scale = 1 / (1024 * 1024) if sys.platform == "darwin" else 1 / 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale
+    return round(own, 1), round(children, 1)
+
+
+def run_bench(count: int, backend: str, workers, encoding, out_dir: str, online: bool):
+    from modules import chat_image_generator as g
+
+    if not online:
+        # 本行程（sequential / threads）；processes 的 worker 另由 make_render_pool(offline=True) 設定
+        g._PILMOJI_AVAILABLE = False
+    atlas = Path(project_root()) / "cache" / "emoji_atlas"
+    g.set_emoji_atlas_dir(str(atlas) if atlas.is_dir() else None)
+    records = synthetic_records(count)
+    template = g.DEFAULT_TEMPLATE_PATH
+    force = os.path.isfile(template)
+
+    # 暖身：每種組合一張，載入模板 / 字型 / 對話模板與各快取
+    warm_dir = os.path.join(out_dir, "warmup")
+    for r in records[::count]:
+        g.generate_image_from_record_template(r, os.path.join(warm_dir, r["order_no"] + ".png"),
+                                              force_template=force, seeded=True, encoding=encoding)
+
+    seq_dir = os.path.join(out_dir, "sequential")
+    totals = {}
+    t0 = time.perf_counter()
+    for r in records:
+        st = {}
+        g.generate_image_from_record_template(r, os.path.join(seq_dir, r["order_no"]), force_template=force,
+                                              seeded=True, encoding=encoding, stats=st)
+        for k, v in st.items():
+            totals[k] = totals.get(k, 0) + v
+    seq_s = time.perf_counter() - t0
+    n = len(records)
+
+    if backend == "processes" and n < g.PROCESS_MIN_RECORDS:
+        backend = "threads"   # 與 generate_images_from_records 相同的退回規則，報告記錄實際使用的後端
+    workers = g.render_pool_workers(backend, workers)
+    batch_stats = {}
+    t0 = time.perf_counter()
+    pool = g.make_render_pool(backend, workers, offline=not online)
+    try:
+        done = g.generate_images_from_records(records, os.path.join(out_dir, "batch"), template_path=template,
+                                              force_template=force, pool=pool, max_workers=workers,
+                                              encoding=encoding, stats=batch_stats, seeded=True)
+    finally:
+        pool.shutdown(wait=True)
+    batch_s = time.perf_counter() - t0
+    rss_self, rss_children = peak_rss_mb()
+    return {
+        "records": n,
+        "combinations": len(ALL_PRODUCT_CODES) * len(DIRECTIONS),
+        "format": g.normalize_encoding(encoding)["format"],
+        "font": g.locate_main_font() or "PIL 內建字型",
+        "template": template if force else None,
+        "pilmoji": bool(online and g._PILMOJI_AVAILABLE),
+        "sequential": {
+            "images_per_sec": round(n / seq_s, 2),
+            "ms_per_image": round(seq_s * 1000 / n, 1),
+            "phases_ms_per_image": {p: round(totals.get(f"{p}_ms", 0) / n, 2) for p in PHASES},
+            "kb_per_image": round(totals.get("bytes", 0) / n / 1024, 1),
+        },
+        "batch": {
+            "backend": backend,
+            "workers": workers,
+            "images": len(done),
+            "images_per_sec": round(len(done) / batch_s, 2) if batch_s else 0,
+        },
+        "peak_rss_mb": rss_self,
+        "peak_rss_children_mb": rss_children,
+    }
+
+
+# 這些設定不同時 images/sec 不可比
+COMPARABLE_FIELDS = (("records", lambda r: r.get("records")),
+                     ("format", lambda r: r.get("format")),
+                     ("pilmoji", lambda r: r.get("pilmoji")),
+                     ("backend", lambda r: r.get("batch", {}).get("backend")),
+                     ("workers", lambda r: r.get("batch", {}).get("workers")))
+
+
+def baseline_mismatch(rep, baseline):
+    """回傳與 baseline 不同的量測設定（空 = 可比較）。"""
+    out = []
+    for name, get in COMPARABLE_FIELDS:
+        if get(rep) != get(baseline):
+            out.append(f"{name}: 本次 {get(rep)} / baseline {get(baseline)}")
+    return out
+
+
+def check_regression(rep, baseline, max_regression: float, min_ips):
+    """回傳未達標原因列表（空 = 通過）；baseline 需先經 baseline_mismatch 確認可比較。"""
+    problems = []
+    for key in ("sequential", "batch"):
+        cur = rep[key]["images_per_sec"]
+        if min_ips is not None and cur < min_ips:
+            problems.append(f"{key} {cur} img/s 低於下限 {min_ips}")
+        if baseline and baseline.get(key, {}).get("images_per_sec"):
+            ref = baseline[key]["images_per_sec"]
+            if cur < ref * (1 - max_regression):
+                problems.append(f"{key} {cur} img/s 較 baseline {ref} 下降超過 {max_regression:.0%}")
+    return problems
+
+
+def format_report(rep) -> str:
+    seq, bat = rep["sequential"], rep["batch"]
+    lines = [
+        f"聊天圖效能（{rep['records']} 張 = {rep['combinations']} 種組合，格式 {rep['format']}）",
+        f"  字型: {rep['font']}   模板: {rep['template'] or '無（純色底）'}   Pilmoji: {'是' if rep['pilmoji'] else '否（離線）'}",
+        f"  sequential: {seq['images_per_sec']} img/s（{seq['ms_per_image']} ms/張，{seq['kb_per_image']} KB/張）",
+        f"  batch[{bat['backend']} x{bat['workers']}]: {bat['images_per_sec']} img/s（{bat['images']} 張）",
+        f"  peak RSS: {rep['peak_rss_mb']} MB（子行程 {rep['peak_rss_children_mb']} MB）",
+        "",
+        f"{'phase':>8} {'ms/張':>8}",
+    ]
+    for p, v in seq["phases_ms_per_image"].items():
+        lines.append(f"{p:>8} {v:>8.2f}")
+    if rep.get("regressions"):
+        lines.append("")
+        lines.extend(f"  未達標: {p}" for p in rep["regressions"])
+    return "\n".join(lines)
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m chat_image_bench", description="聊天圖產生效能量測（離線）")
+    ap.add_argument("--count", type=int, default=20, help="每種 商品×方向 的筆數")
+    ap.add_argument("--backend", choices=("threads", "processes"), default="threads")
+    ap.add_argument("--workers", type=int, help="batch 的 worker 數（預設 threads 4 / processes CPU 核心數）")
+    ap.add_argument("--format", default="png", help="png / jpeg / webp")
+    ap.add_argument("--quality", type=int)
+    ap.add_argument("--compress-level", type=int)
+    ap.add_argument("--out", help="輸出資料夾（預設暫存，結束後刪除）")
+    ap.add_argument("--online", action="store_true", help="允許 Pilmoji 抓取 emoji 圖源")
+    ap.add_argument("--baseline", help="比較用的先前結果（--json 輸出或 --save-baseline 檔）")
+    ap.add_argument("--save-baseline", help="將本次結果寫成 baseline")
+    ap.add_argument("--max-regression", type=float, default=0.2, help="容許的 images/sec 下降比例（預設 0.2）")
+    ap.add_argument("--min-ips", type=float, help="images/sec 絕對下限")
+    ap.add_argument("--json", action="store_true", help="輸出 JSON")
+    args = ap.parse_args(argv)
+
+    encoding = {"format": args.format, "quality": args.quality, "compress_level": args.compress_level}
+    out_dir = args.out or tempfile.mkdtemp(prefix="chat_image_bench_")
+    try:
+        from contextlib import redirect_stdout
+        # 產圖模組的 print 不混入報告（--json 時 stdout 只留一行 JSON）
+        with redirect_stdout(sys.stderr):
+            rep = run_bench(max(1, args.count), args.backend, args.workers, encoding, out_dir, args.online)
+    except ValueError as e:
+        print(str(e), file=sys.stderr)
+        return 2
+    finally:
+        if not args.out:
+            shutil.rmtree(out_dir, ignore_errors=True)
+
+    baseline = None
+    if args.baseline:
+        try:
+            with open(args.baseline, "r", encoding="utf-8") as f:
+                baseline = json.load(f)
+        except Exception as e:
+            print(f"baseline 讀取失敗: {e}", file=sys.stderr)
+            return 2
+        diff = baseline_mismatch(rep, baseline)
+        if diff:
+            print("baseline 的量測設定與本次不同，不比較（請用相同參數重跑或重新 --save-baseline）:", file=sys.stderr)
+            for d in diff:
+                print(f"  {d}", file=sys.stderr)
+            return 2
+    rep["regressions"] = check_regression(rep, baseline, args.max_regression, args.min_ips)
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(rep, f, ensure_ascii=False, indent=2)
+    print(json.dumps(rep, ensure_ascii=False) if args.json else format_report(rep))
+    return 1 if rep["regressions"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+下載引擎自我檢查（本機 HTTP 伺服器模擬斷線，不連外網）
+
+    cd src
+    python -m download_selftest                 # 8 MB 測試檔，每條連線傳 1.5 MB 後中斷
+    python -m download_selftest --size-mb 32 --drop-kb 4096 --parallel 6
+
+依序驗證：單線續傳、多段並行、伺服器不支援 Range、中途終止後（單線 / 多段）以 .part 續傳、SHA-256 不符時拒絕。
+全部通過結束碼 0，否則 1。
+"""
+
+import os
+import sys
+import time
+import shutil
+import hashlib
+import argparse
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from modules.download_engine import Downloader, DownloadError
+
+
+class FlakyServer:
+    """
+    提供單一檔案 /pkg.zip：支援 HEAD / Range / ETag；每條連線送出 drop_bytes 後直接斷線（0 = 不斷）。
+    ranges=False 時忽略 Range（一律回 200 整檔）。
+    """
+
+    def __init__(self, payload: bytes, drop_bytes: int = 0, ranges: bool = True):
+        self.payload = payload
+        self.drop_bytes = drop_bytes
+        self.ranges = ranges
+        self.etag = '"' + hashlib.sha256(payload).hexdigest()[:16] + '"'
+        self.requests = 0
+        srv = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _headers(self, status, length, extra=None):
+                self.send_response(status)
+                self.send_header("Content-Length", str(length))
+                self.send_header("ETag", srv.etag)
+                if srv.ranges:
+                    self.send_header("Accept-Ranges", "bytes")
+                for k, v in (extra or {}).items():
+                    self.send_header(k, v)
+                self.end_headers()
+
+            def do_HEAD(self):
+                self._headers(200, len(srv.payload))
+
+            def do_GET(self):
+                srv.requests += 1
+                data = srv.payload
+                start, end = 0, len(data) - 1
+                rng = self.headers.get("Range")
+                if_range = self.headers.get("If-Range")
+                partial = srv.ranges and rng and (not if_range or if_range == srv.etag)
+                if partial:
+                    a, _, b = rng.split("=", 1)[1].partition("-")
+                    start = int(a)
+                    end = int(b) if b else len(data) - 1
+                    if start >= len(data):
+                        self._headers(416, 0, {"Content-Range": f"bytes */{len(data)}"})
+                        return
+                    self._headers(206, end - start + 1, {"Content-Range": f"bytes {start}-{end}/{len(data)}"})
+                else:
+                    self._headers(200, len(data))
+                body = data[start:end + 1]
+                limit = srv.drop_bytes or len(body)
+                try:
+                    self.wfile.write(body[:limit])
+                    self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+                if limit < len(body):
+                    self.close_connection = True
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}/pkg.zip"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m download_selftest", description="下載引擎斷線 / 續傳自我檢查")
+    ap.add_argument("--size-mb", type=float, default=8)
+    ap.add_argument("--drop-kb", type=int, default=1536, help="每條連線傳送多少 KB 後中斷")
+    ap.add_argument("--parallel", type=int, default=4)
+    args = ap.parse_args(argv)
+
+    import modules.download_engine as de
+    de.RETRY_BACKOFF = 0.05
+    payload = os.urandom(int(args.size_mb * 1024 * 1024))
+    sha = hashlib.sha256(payload).hexdigest()
+    drop = args.drop_kb * 1024
+    work = tempfile.mkdtemp(prefix="dl_selftest_")
+    results = []
+
+    def check(name, fn):
+        t0 = time.perf_counter()
+        try:
+            detail = fn()
+            results.append((name, True, detail, time.perf_counter() - t0))
+        except Exception as e:
+            results.append((name, False, repr(e), time.perf_counter() - t0))
+
+    def run(srv, parallel, dest, max_retries=50, expect=sha):
+        d = Downloader(parallel=parallel, max_retries=max_retries, timeout=10)
+        res = d.download(srv.url, os.path.join(work, dest), expect)
+        with open(res["path"], "rb") as f:
+            assert f.read() == payload, "內容不符"
+        return f"{res['parts']} 段，{srv.requests} 次請求，續傳起點 {res['resumed_from']}"
+
+    try:
+        srv = FlakyServer(payload, drop)
+        check("單線 + 斷線續傳", lambda: run(srv, 1, "single.zip"))
+        srv.close()
+
+        srv = FlakyServer(payload, drop)
+        check("多段並行 + 斷線續傳", lambda: run(srv, args.parallel, "parallel.zip"))
+        srv.close()
+
+        srv = FlakyServer(payload, 0, ranges=False)
+        check("伺服器不支援 Range", lambda: run(srv, args.parallel, "norange.zip"))
+        srv.close()
+
+        def interrupted(parallel, dest):
+            # 斷點需落在每一段之內，第一次才一定會中斷
+            s = FlakyServer(payload, min(drop, len(payload) // parallel // 2))
+            try:
+                try:
+                    run(s, parallel, dest, max_retries=1)
+                    raise AssertionError("應於第一次斷線時失敗")
+                except DownloadError:
+                    pass
+                assert os.path.exists(os.path.join(work, dest + ".part.json")), "沒有留下續傳進度"
+                return run(s, parallel, dest)
+            finally:
+                s.close()
+        check("中止後單線續傳", lambda: interrupted(1, "resume.zip"))
+        check("中止後多段續傳", lambda: interrupted(args.parallel, "resume_parallel.zip"))
+
+        def bad_sha():
+            s = FlakyServer(payload, 0)
+            try:
+                try:
+                    run(s, 1, "bad.zip", expect="0" * 64)
+                except DownloadError:
+                    assert not os.path.exists(os.path.join(work, "bad.zip")), "不應留下目的檔"
+                    return "已拒絕"
+                raise AssertionError("SHA256 不符卻未失敗")
+            finally:
+                s.close()
+        check("SHA-256 不符", bad_sha)
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+    for name, ok, detail, secs in results:
+        print(f"{'OK ' if ok else 'NG '} {name:<20} {secs:6.2f}s  {detail}")
+    return 0 if all(ok for _n, ok, _d, _s in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
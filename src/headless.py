@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+無介面執行入口（不載入 Qt），供伺服器 / 排程使用：
+
+    cd src
+    python -m headless input/*.xlsx --tasks report,woo_format
+    python -m headless --tasks woo_upload --live --product game_item
+
+結束時於 stdout 輸出一行 JSON 統計；日誌與各模組的 print 一律寫到 stderr。
+結束碼：0 全部成功、1 有步驟失敗或訂單失敗、2 參數錯誤、130 中斷。
+"""
+
+import os
+import sys
+import json
+import time
+import signal
+import multiprocessing
+import argparse
+import contextlib
+from pathlib import Path
+
+from version import __version__
+from modules.resources import project_root, get_config_path
+from modules.config_manager import ConfigManager
+from modules.db_manager import DBManager, clear_all_transactions
+from modules.task_pipeline import CancelToken
+from modules.task_stages import ALL_TASKS, ALL_PRODUCT_CODES, build_task_pipeline, build_woo_client
+
+INPUT_EXTS = (".csv", ".xlsx", ".xls")
+
+
+class _StderrLogger:
+    """WooClient 用的簡易 logger（info / warn / error）。"""
+
+    def __init__(self, quiet: bool = False):
+        self.quiet = quiet
+
+    def _write(self, level: str, msg: str):
+        if not self.quiet or level != "INFO":
+            print(f"[{time.strftime('%H:%M:%S')}] {level} {msg}", file=sys.stderr, flush=True)
+
+    def info(self, msg): self._write("INFO", msg)
+    def warn(self, msg): self._write("WARN", msg)
+    def error(self, msg, exc=None): self._write("ERROR", msg)
+
+
+def collect_inputs(paths, root: Path):
+    """檔案直接採用；資料夾取其中的 csv / xlsx / xls；未指定時掃描 <root>/input。"""
+    if not paths:
+        paths = [str(root / "input")]
+    files = []
+    for p in paths:
+        if os.path.isdir(p):
+            for fn in sorted(os.listdir(p)):
+                fp = os.path.join(p, fn)
+                if os.path.isfile(fp) and fn.lower().endswith(INPUT_EXTS):
+                    files.append(fp)
+        elif os.path.isfile(p) and p.lower().endswith(INPUT_EXTS):
+            files.append(p)
+    return files
+
+
+def build_arg_parser():
+    ap = argparse.ArgumentParser(prog="python -m headless", description=f"Excel 自動處理（無介面） v{__version__}")
+    ap.add_argument("inputs", nargs="*", help="輸入檔或資料夾（預設 <專案>/input）")
+    ap.add_argument("--tasks", default="report,woo_format",
+                    help=f"逗號分隔：{','.join(ALL_TASKS)}，或 all（預設 report,woo_format）")
+    ap.add_argument("--config", help="config.json 路徑（預設專案根目錄）")
+    ap.add_argument("--product", choices=ALL_PRODUCT_CODES, help="單一商品代碼；未指定則逐筆隨機")
+    ap.add_argument("--db", help="覆寫 db_path")
+    ap.add_argument("--keep-db", action="store_true", help="不依 discard_db_each_start 清空交易資料")
+    mode = ap.add_mutually_exclusive_group()
+    mode.add_argument("--test-mode", dest="test_mode", action="store_true", default=None, help="Woo 測試模式（不實際建單）")
+    mode.add_argument("--live", dest="test_mode", action="store_false", help="Woo 正式建單")
+    ap.add_argument("--skip-unchanged-images", action="store_true",
+                    help="聊天圖依 manifest 沿用未變更記錄的舊圖、不重繪（同 config chat_image_skip_unchanged）")
+    ap.add_argument("--workers", type=int, help="可並行的步驟數（預設 config pipeline_workers）")
+    ap.add_argument("--quiet", action="store_true", help="只輸出警告 / 錯誤日誌")
+    return ap
+
+
+def main(argv=None) -> int:
+    args = build_arg_parser().parse_args(argv)
+    t0 = time.perf_counter()
+    root = project_root()
+    logger = _StderrLogger(args.quiet)
+
+    tasks = list(ALL_TASKS) if args.tasks.strip() == "all" else [t.strip() for t in args.tasks.split(",") if t.strip()]
+    unknown = [t for t in tasks if t not in ALL_TASKS]
+    if unknown or not tasks:
+        print(json.dumps({"ok": False, "error": f"未知任務: {unknown}" if unknown else "未指定任務"},
+                         ensure_ascii=False))
+        return 2
+
+    files = collect_inputs(args.inputs, root)
+    if not files:
+        print(json.dumps({"ok": False, "error": "沒有可處理的檔案"}, ensure_ascii=False))
+        return 2
+
+    config = ConfigManager(args.config or str(get_config_path()))
+    if args.skip_unchanged_images:
+        config.set("chat_image_skip_unchanged", True, autosave=False)
+    db_path = args.db or str(root / config.get("db_path", "db/transactions.db"))
+    if config.get("use_memory_db", False) and not args.db:
+        db_path = ":memory:"
+    if config.get("discard_db_each_start", True) and not args.keep_db:
+        err = clear_all_transactions(db_path)
+        if err:
+            logger.warn(err)
+    db = DBManager(db_path)
+
+    client = outbox = fp_index = None
+    if "woo_upload" in tasks:
+        if config.get("woo_fingerprint_index", True):
+            from modules.woo_fingerprint_index import FingerprintIndex
+            fp_index = FingerprintIndex(str(root / config.get("woo_fingerprint_index_path", "db/woo_fingerprints.db")))
+        overrides = {} if args.test_mode is None else {"test_mode": args.test_mode}
+        client = build_woo_client(config, logger=logger, fingerprint_index=fp_index, **overrides)
+        if config.get("woo_durable_outbox", True):
+            from modules.woo_outbox import WooOutbox
+            outbox = WooOutbox(str(root / config.get("woo_outbox_path", "db/woo_outbox.db")))
+
+    pipeline = build_task_pipeline(
+        files, tasks, config=config, db=db, db_path=db_path, root_dir=root,
+        single_code=args.product, client=client, outbox=outbox, max_workers=args.workers
+    )
+    token = CancelToken()
+    signal.signal(signal.SIGINT, lambda *_: token.cancel())
+    if hasattr(signal, "SIGTERM"):
+        signal.signal(signal.SIGTERM, lambda *_: token.cancel())
+
+    ctx = {}
+    # 各模組的 print 改寫到 stderr，stdout 只留最後的 JSON
+    with contextlib.redirect_stdout(sys.stderr):
+        res = pipeline.run(ctx, token, on_log=logger.info)
+
+    upload = ctx.get("upload_result") or {}
+    stats = {
+        "ok": res["ok"],
+        "cancelled": res["cancelled"],
+        "version": __version__,
+        "tasks": tasks,
+        "files": len(files),
+        "records": len(ctx.get("records") or []),
+        "inserted": ctx.get("inserted"),
+        "stages": res["status"],
+        "timings": res["timings"],
+        "errors": res["errors"],
+        "elapsed": round(time.perf_counter() - t0, 3),
+        "outputs": {k: ctx[k] for k in ("report_paths", "images_dir", "woo_dir") if ctx.get(k)},
+    }
+    if "image_count" in ctx:
+        stats["images"] = ctx["image_count"]   # 本次資料夾內張數 = images_rendered + images_reused
+        stats["images_rendered"] = ctx.get("image_rendered")
+        stats["images_reused"] = ctx.get("image_reused")
+        stats["image_stats"] = ctx.get("image_stats")
+    if "woo_csv_count" in ctx:
+        stats["woo_csv"] = ctx["woo_csv_count"]
+    if upload:
+        stats["upload"] = {k: upload.get(k) for k in ("success", "fail", "skip_remote", "transport")}
+        stats["upload"]["test_mode"] = client.test_mode
+        stats["upload"]["failures"] = upload.get("failures", [])[:20]
+    print(json.dumps(stats, ensure_ascii=False, default=str))
+
+    for h in (fp_index, outbox):
+        if h is not None:
+            h.close()
+    if res["cancelled"]:
+        return 130
+    if not res["ok"] or upload.get("fail"):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
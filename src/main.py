@@ -1,56 +1,49 @@
+import time
+_T_START = time.perf_counter()
 import sys
 import os
 import traceback
-import sqlite3
-import random
-import time
 import json
 import platform
+import multiprocessing
 from datetime import datetime
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor, as_completed
 from PyQt6 import QtWidgets, QtGui, QtCore
 
 from version import __version__
 from ui_main_py import Ui_MainWindow
 from modules.resources import project_root, get_config_path
 from modules.config_manager import ConfigManager
-from modules.db_manager import DBManager
-from modules.excel_parser import ExcelParser
-from modules.bank_excel_converter import process_file as bank_convert
-from modules.chat_image_generator import generate_images_from_records
-from modules.match_report import generate_match_reports
+from modules.db_manager import DBManager, clear_all_transactions
 from modules.theme_styles import ENHANCED_QSS
 from output_paths import (
     output_root, chat_images_product_dir, woo_export_dir,
     match_report_dir, logs_dir
 )
-from modules.woo_client import WooClient
+from modules.woo_fingerprint_index import FingerprintIndex
+from modules.woo_outbox import WooOutbox
+from modules.task_pipeline import Pipeline
+from modules.task_stages import (
+    PRODUCT_CODE_MAP, ALL_PRODUCT_CODES, assign_product_types,
+    build_woo_client, build_task_pipeline
+)
+from modules.pipeline_worker import PipelineWorker
 from single_instance import acquire_lock, release_lock
 
-# 更新檢查模組（GitHub Raw manifest）
+# 更新檢查模組（GitHub Raw manifest）；UpdateManager 依賴 requests，按下檢查更新時才載入
 try:
-    from modules.update_check import UpdateManager
     from modules.update_worker import UpdateWorker
 except ImportError:
-    UpdateManager = None
     UpdateWorker = None
 
+# 啟動量測：設定後顯示視窗、跑完第一輪事件迴圈即輸出耗時並結束（供 startup_report 使用）
+STARTUP_PROBE_ENV = "EXCEL_AUTO_STARTUP_PROBE"
+
+_T_IMPORTED = time.perf_counter()
+
 APP_NAME = f"Y.J v{__version__}"
 ROOT_DIR = project_root()
 
-PRODUCT_CODE_MAP = {
-    "遊戲幣": "game_currency",
-    "遊戲寶物": "game_item",
-    "二手商品": "used_goods"
-}
-ALL_PRODUCT_CODES = list(PRODUCT_CODE_MAP.values())
-PRODUCT_CN_MAP = {
-    "game_currency": "遊戲幣",
-    "game_item": "遊戲寶物",
-    "used_goods": "二手商品"
-}
-
 
 def is_frozen():
     return getattr(sys, "frozen", False) and hasattr(sys, "_MEIPASS")
@@ -120,23 +113,6 @@ def ensure_base_dirs():
     logs_dir(base)
 
 
-def clear_all_transactions(db_path):
-    if db_path == ":memory:":
-        return
-    if not os.path.exists(db_path):
-        return
-    conn = sqlite3.connect(db_path)
-    cur = conn.cursor()
-    try:
-        cur.execute("CREATE TABLE IF NOT EXISTS transactions (id INTEGER PRIMARY KEY AUTOINCREMENT)")
-        cur.execute("DELETE FROM transactions")
-        conn.commit()
-    except Exception as e:
-        print("[CLEAR ERROR]", e)
-    finally:
-        conn.close()
-
-
 def open_dir(path: str):
     try:
         if os.path.isdir(path):
@@ -169,12 +145,18 @@ class MainWindow(QtWidgets.QMainWindow):
         use_memory = self.config.get("use_memory_db", False)
         self.db_path = ":memory:" if use_memory else str(ROOT_DIR / self.config.get("db_path", "db/transactions.db"))
         if self.config.get("discard_db_each_start", True):
-            clear_all_transactions(self.db_path)
-            self.run_logger.info("DB cleared at start")
+            err = clear_all_transactions(self.db_path)
+            if err:
+                self.run_logger.warn(err)
+            else:
+                self.run_logger.info("DB cleared at start")
 
         self.db = DBManager(self.db_path)
-        self.parser = ExcelParser(self.db)
+        self._parser = None
         self.enable_woo = self.config.get("enable_woo_sync", True)
+        self.fp_index = None
+        self.woo_outbox = None
+        self.pipeline_worker = None
 
         # 主頁按鈕 / 訊號
         self.ui.btnRunAll.clicked.connect(self.run_selected_tasks)
@@ -197,7 +179,7 @@ class MainWindow(QtWidgets.QMainWindow):
         self.ui.spinFeeRate.setValue(self.config.get("platform_fee_rate", 0.07) * 100)
 
         # 檢查更新（主頁工具區）
-        if hasattr(self.ui, "btnCheckUpdate") and UpdateManager and UpdateWorker:
+        if hasattr(self.ui, "btnCheckUpdate") and UpdateWorker:
             self.ui.btnCheckUpdate.clicked.connect(self.on_check_update)
 
         # 勾選式第四任務：chkTaskUploadOrders
@@ -228,27 +210,52 @@ class MainWindow(QtWidgets.QMainWindow):
         self.ui.editWooCK.setText(self.config.get("woo_consumer_key", ""))
         self.ui.editWooCS.setText(self.config.get("woo_consumer_secret", ""))
         self.ui.spinWooFeeProduct.setValue(int(self.config.get("woo_fee_product_id", 30977)))
-        self.ui.spinWooBatch.setValue(int(self.config.get("woo_batch_size", 200)))
+        self.ui.spinWooBatch.setValue(min(int(self.config.get("woo_batch_size", 100)), 100))
         self.ui.spinWooTimeout.setValue(int(self.config.get("woo_timeout", 15)))
         self.ui.spinWooRemoteScan.setValue(int(self.config.get("woo_remote_dup_scan_limit", 200)))
         self.ui.spinWooWorkers.setValue(int(self.config.get("woo_parallel_workers", 6)))
         self.ui.chkWooTestMode.setChecked(self.config.get("woo_test_mode", True))
         self.ui.chkWooSetCreated.setChecked(self.config.get("woo_set_created_time", True))
 
-    def build_woo_client(self) -> WooClient:
-        return WooClient(
-            base_url=self.config.get("woo_url", "").strip(),
-            consumer_key=self.config.get("woo_consumer_key", "").strip(),
-            consumer_secret=self.config.get("woo_consumer_secret", "").strip(),
-            timeout=int(self.config.get("woo_timeout", 15)),
-            test_mode=bool(self.config.get("woo_test_mode", True)),
+    def get_fingerprint_index(self):
+        if not self.config.get("woo_fingerprint_index", True):
+            return None
+        if self.fp_index is None:
+            path = str(ROOT_DIR / self.config.get("woo_fingerprint_index_path", "db/woo_fingerprints.db"))
+            self.fp_index = FingerprintIndex(path)
+        return self.fp_index
+
+    def get_woo_outbox(self):
+        if not self.config.get("woo_durable_outbox", True):
+            return None
+        if self.woo_outbox is None:
+            path = str(ROOT_DIR / self.config.get("woo_outbox_path", "db/woo_outbox.db"))
+            self.woo_outbox = WooOutbox(path)
+        return self.woo_outbox
+
+    @property
+    def parser(self):
+        # pandas 於第一次預覽 / 解析時才載入
+        if self._parser is None:
+            from modules.excel_parser import ExcelParser
+            self._parser = ExcelParser(self.db)
+        return self._parser
+
+    def build_woo_client(self):
+        return build_woo_client(
+            self.config,
             logger=self.run_logger,
+            fingerprint_index=self.get_fingerprint_index(),
             remote_dup_scan_limit=int(self.ui.spinWooRemoteScan.value()),
             set_created_time=self.ui.chkWooSetCreated.isChecked()
         )
 
     # --- 更新流程 ---
     def on_check_update(self):
+        try:
+            from modules.update_check import UpdateManager
+        except ImportError:
+            UpdateManager = None
         if not UpdateManager or not UpdateWorker:
             QtWidgets.QMessageBox.warning(self, "更新", "缺少更新模組 (update_check / update_worker)")
             return
@@ -257,7 +264,8 @@ class MainWindow(QtWidgets.QMainWindow):
             QtWidgets.QMessageBox.warning(self, "更新", "config.json 缺少 update_manifest_url")
             return
         app_dir = os.path.abspath(os.path.dirname(sys.argv[0]))
-        mgr = UpdateManager(manifest_url, __version__, app_dir)
+        mgr = UpdateManager(manifest_url, __version__, app_dir,
+                            download_workers=self.config.get("update_download_workers", 4))
         self.append_log("開始檢查更新...")
         self.progressBar.setValue(0)
         self.ui.lblSummary.setText("更新檢查中...")
@@ -293,7 +301,11 @@ class MainWindow(QtWidgets.QMainWindow):
             return
         latest = res.get("latest_version", "?")
         count = res.get("count", 0)
-        self.append_log(f"更新完成 覆蓋 {count} 檔 -> {latest}")
+        if res.get("mode") == "delta":
+            self.append_log(f"增量更新完成 覆蓋 {count} 檔（未變更 {res.get('unchanged', 0)}，"
+                            f"下載 {res.get('bytes', 0) / 1024:.0f} KB） -> {latest}")
+        else:
+            self.append_log(f"更新完成 覆蓋 {count} 檔 -> {latest}")
         self.progressBar.setValue(100)
         self.ui.lblSummary.setText(f"更新完成 (覆蓋 {count})")
         if QtWidgets.QMessageBox.question(
@@ -338,100 +350,17 @@ class MainWindow(QtWidgets.QMainWindow):
         self.append_log(f"Woo 測試:{r}")
 
     # --- 上傳並建立訂單（由勾選觸發） ---
-    def _task_upload_orders(self, all_records):
-        client = self.build_woo_client()
-        if not client.base_url or not client.ck or not client.cs:
-            QtWidgets.QMessageBox.warning(self, "設定缺失", "URL 或 Key/Secret 未填")
-            return
-
-        client.preload_remote_fingerprints()
-        fee_rate = self.config.get("platform_fee_rate", 0.07)
-        fee_product_id = int(self.config.get("woo_fee_product_id", 30977))
-
-        to_upload = []
-        skip_remote = 0
-        for rec in all_records:
-            fp = client._fingerprint(rec)
-            if fp in client.remote_fingerprints:
-                skip_remote += 1
-                self.db.update_woo_result(
-                    rec.get("id"),
-                    status="test" if client.test_mode else "success",
-                    order_id=None,
-                    error="remote_dup",
-                    payload={},
-                    fingerprint=fp,
-                    attempts=0
-                )
-                continue
-            to_upload.append(rec)
-
-        self.append_log(f"[建立訂單] 待上傳:{len(to_upload)} 遠端跳過:{skip_remote}")
-        if not to_upload:
-            QtWidgets.QMessageBox.information(self, "結果", "全部遠端已存在，無需建立。")
-            return
-
-        workers = max(1, int(self.config.get("woo_parallel_workers", 6)))
-        self.append_log(f"[建立訂單] 開始並行 workers={workers} test_mode={client.test_mode}")
-
-        success = fail = 0
-        failures = []
-        total = len(to_upload)
-        self.progressBar.setValue(0)
-
-        def task_fn(rec):
-            return client.create_order_full(
-                rec,
-                fee_rate=fee_rate,
-                fee_product_id=fee_product_id,
-                product_display=PRODUCT_CN_MAP.get(rec.get("product_type", "game_currency"), "遊戲幣")
-            )
-
-        with ThreadPoolExecutor(max_workers=workers) as ex:
-            future_map = {ex.submit(task_fn, rec): rec for rec in to_upload}
-            completed = 0
-            for fut in as_completed(future_map):
-                result = fut.result()
-                rec = future_map[fut]
-                fp = result.get("fingerprint")
-                if result["ok"]:
-                    status = "test" if client.test_mode else "success"
-                    self.db.update_woo_result(
-                        rec.get("id"), status=status,
-                        order_id=str(result.get("order_id")),
-                        error=None, payload=result.get("payload"),
-                        fingerprint=fp, attempts=result.get("attempts", 1)
-                    )
-                    success += 1
-                    client.remote_fingerprints.add(fp)
-                else:
-                    self.db.update_woo_result(
-                        rec.get("id"), status="error",
-                        order_id=None, error=result.get("error"),
-                        payload=result.get("payload"),
-                        fingerprint=fp, attempts=result.get("attempts", 1)
-                    )
-                    fail += 1
-                    failures.append(f"ID:{rec.get('id')} err:{result.get('error')}")
-                completed += 1
-                pct = int(completed / total * 100)
-                self.progressBar.setValue(pct)
-                self.ui.lblSummary.setText(
-                    f"[訂單建立] {completed}/{total} 成:{success} 失:{fail} 跳遠:{skip_remote}"
-                )
-                QtWidgets.QApplication.processEvents()
-
-        self.progressBar.setValue(100)
-        summary = f"[訂單建立] 完成 成功:{success} 失敗:{fail} 跳遠:{skip_remote}"
-        self.append_log(summary)
-        if fail > 0:
-            msg = summary + "\n前幾筆錯誤:\n" + "\n".join(failures[:10])
+    def _show_upload_result(self, res: dict):
+        if res.get("nothing_to_do"):
+            QtWidgets.QMessageBox.information(self, "結果", res["summary"])
+        elif res["fail"] > 0:
+            msg = res["summary"] + "\n前幾筆錯誤:\n" + "\n".join(res["failures"][:10])
             QtWidgets.QMessageBox.warning(self, "訂單建立完成(含失敗)", msg)
         else:
             extra = ""
-            if skip_remote > 0:
-                extra = f"\n{skip_remote} 筆遠端已存在未重複建立。"
-            QtWidgets.QMessageBox.information(self, "訂單建立完成", summary + extra)
+            if res["skip_remote"] > 0:
+                extra = f"\n{res['skip_remote']} 筆遠端已存在未重複建立。"
+            QtWidgets.QMessageBox.information(self, "訂單建立完成", res["summary"] + extra)
 
     # --- 手續費設定 ---
     def on_save_settings(self):
@@ -509,9 +438,9 @@ class MainWindow(QtWidgets.QMainWindow):
             "立即清空交易紀錄？",
             QtWidgets.QMessageBox.StandardButton.Yes | QtWidgets.QMessageBox.StandardButton.No
         ) == QtWidgets.QMessageBox.StandardButton.Yes:
-            clear_all_transactions(self.db_path)
+            err = clear_all_transactions(self.db_path)
             self.update_status()
-            self.append_log("資料庫已清空")
+            self.append_log(err or "資料庫已清空")
 
     def show_list_context_menu(self, pos):
         menu = QtWidgets.QMenu(self)
@@ -588,17 +517,22 @@ class MainWindow(QtWidgets.QMainWindow):
                 self.ui.tablePreview.setItem(r, c, item)
         self.ui.tablePreview.resizeColumnsToContents()
 
-    def assign_product_types(self, records):
-        mode = self.ui.cbProductMode.currentText()
-        if mode == "單一商品":
-            code = PRODUCT_CODE_MAP[self.ui.cbSingleProduct.currentText()]
-            for r in records:
-                r["product_type"] = code
-        else:
-            for r in records:
-                r["product_type"] = random.choice(ALL_PRODUCT_CODES)
+    def current_single_product(self):
+        """單一商品模式回傳商品代碼；隨機模式回傳 None。"""
+        if self.ui.cbProductMode.currentText() == "單一商品":
+            return PRODUCT_CODE_MAP[self.ui.cbSingleProduct.currentText()]
+        return None
+
+    def assign_product_types(self, records, single_code=None):
+        assign_product_types(records, single_code)
 
     def run_selected_tasks(self):
+        if self.pipeline_worker is not None:
+            self.pipeline_worker.cancel()
+            self.ui.btnRunAll.setEnabled(False)
+            self.append_log("取消中…（執行中的步驟完成目前項目後停止）")
+            return
+
         files = self.collect_files()
         if not files:
             QtWidgets.QMessageBox.information(self, "沒有檔案", "請先加入檔案")
@@ -618,91 +552,77 @@ class MainWindow(QtWidgets.QMainWindow):
             QtWidgets.QMessageBox.information(self, "未選任務", "請勾選任務")
             return
 
-        fee_rate = self.config.get("platform_fee_rate", 0.07)
-        all_records = []
-        for f in files:
-            try:
-                recs = self.parser.parse_file(f)
-                all_records.extend(recs)
-            except Exception as e:
-                self.append_log(f"{os.path.basename(f)} 解析失敗:{e}")
-        if not all_records:
-            QtWidgets.QMessageBox.information(self, "無資料", "解析為空")
-            return
+        client = None
+        if "woo_upload" in tasks:
+            # WooClient 讀取 UI 欄位，必須在 UI 執行緒建立
+            client = self.build_woo_client()
+            if not client.base_url or not client.ck or not client.cs:
+                QtWidgets.QMessageBox.warning(self, "設定缺失", "URL 或 Key/Secret 未填")
+                return
 
-        self.assign_product_types(all_records)
-        self.append_log("商品指派完成")
-        self.progressBar.setValue(10)
+        pipeline = self.build_task_pipeline(files, tasks, self.current_single_product(), client)
+        self.progressBar.setValue(0)
+        self.pipeline_worker = PipelineWorker(pipeline, {"tasks": tasks})
+        self.pipeline_worker.progressChanged.connect(self._on_pipeline_progress)
+        self.pipeline_worker.logMessage.connect(self.append_log)
+        self.pipeline_worker.finishedWithResult.connect(self._on_pipeline_finished)
+        self.ui.btnRunAll.setText("取消執行")
+        self.pipeline_worker.start()
+
+    def build_task_pipeline(self, files, tasks, single_code, client=None) -> Pipeline:
+        return build_task_pipeline(
+            files, tasks,
+            config=self.config, db=self.db, db_path=self.db_path, root_dir=ROOT_DIR,
+            parser=self.parser, single_code=single_code, client=client,
+            outbox=self.get_woo_outbox() if "woo_upload" in tasks else None
+        )
 
-        if "report" in tasks:
-            try:
-                ins, _dup = self.db.insert_records(all_records, dedup=True)
-                conn = sqlite3.connect(self.db_path)
-                rpt_dir = match_report_dir(output_root(ROOT_DIR))
-                paths = generate_match_reports(conn, str(rpt_dir), fee_rate=fee_rate)
-                conn.close()
-                self.append_log(f"媒合報表完成 (+{ins})")
-                QtWidgets.QMessageBox.information(
-                    self,
-                    "媒合報表",
-                    f"明細：{paths['detail_xlsx']}\n彙總：{paths['summary_xlsx']}"
-                )
-                open_dir(str(rpt_dir))
-            except Exception as e:
-                self.append_log(f"媒合報表失敗:{e}")
-                QtWidgets.QMessageBox.critical(self, "媒合報表失敗", str(e))
-            self.update_status()
-        self.progressBar.setValue(40)
-
-        if "images" in tasks:
-            grouped = {}
-            last_dir = None
-            for r in all_records:
-                grouped.setdefault(r.get("product_type", "game_currency"), []).append(r)
-            for ptype, recs in grouped.items():
-                base_dir = chat_images_product_dir(output_root(ROOT_DIR), ptype)
-                ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-                run_dir = os.path.join(base_dir, f"批次_{ts}")
-                os.makedirs(run_dir, exist_ok=True)
-                ins_records = [r for r in recs if r.get("direction") == "in"]
-                outs_records = [r for r in recs if r.get("direction") == "out"]
-                if ins_records:
-                    generate_images_from_records(ins_records, run_dir, "入帳")
-                if outs_records:
-                    generate_images_from_records(outs_records, run_dir, "出帳")
-                last_dir = run_dir
-            self.append_log("圖片生成完成")
-            if last_dir:
-                open_dir(last_dir)
-        self.progressBar.setValue(70)
-
-        if "woo_format" in tasks:
-            woo_dir = woo_export_dir(output_root(ROOT_DIR))
-            for f in files:
-                pcode = (
-                    PRODUCT_CODE_MAP[self.ui.cbSingleProduct.currentText()]
-                    if self.ui.cbProductMode.currentText() == "單一商品"
-                    else random.choice(ALL_PRODUCT_CODES)
-                )
-                base = os.path.splitext(os.path.basename(f))[0]
-                out_csv = str(woo_dir / f"{base}_{pcode}_woo.csv")
-                try:
-                    bank_convert(f, out_csv, fee_rate=fee_rate, product_type=pcode)
-                except Exception as e:
-                    self.append_log(f"{base} 匯出錯誤:{e}")
-            self.append_log("轉換成可匯入網站格式完成")
-            open_dir(str(woo_dir))
+    def _on_pipeline_progress(self, pct: int, text: str):
+        self.progressBar.setValue(pct)
+        self.ui.lblSummary.setText(text)
 
-        if "woo_upload" in tasks:
-            # 若未執行 report，仍需入庫確保有 id
-            if "report" not in tasks:
-                inserted, _dup = self.db.insert_records(all_records, dedup=True)
-                self.append_log(f"為訂單上傳先入庫 新增:{inserted}")
-            self._task_upload_orders(all_records)
+    def _on_pipeline_finished(self, res: dict):
+        self.pipeline_worker = None
+        self.ui.btnRunAll.setText("執行所選任務")
+        self.ui.btnRunAll.setEnabled(True)
+        ctx = res.get("ctx", {})
+        status = res.get("status", {})
+        errors = res.get("errors", {})
+        if "error" in res and not status:
+            errors = {"pipeline": res["error"]}
+        timing = " ".join(f"{k}={v:.2f}s" for k, v in res.get("timings", {}).items())
+        self.append_log(f"[流程] 耗時 {timing} 總計={res.get('elapsed', 0):.2f}s")
+
+        if errors.get("parse") == "解析為空":
+            QtWidgets.QMessageBox.information(self, "無資料", "解析為空")
+        if status.get("report") == "done":
+            paths = ctx["report_paths"]
+            QtWidgets.QMessageBox.information(
+                self,
+                "媒合報表",
+                f"明細：{paths['detail_xlsx']}\n彙總：{paths['summary_xlsx']}"
+            )
+            open_dir(ctx["report_dir"])
+        elif "report" in errors:
+            self.append_log(f"媒合報表失敗:{errors['report']}")
+            QtWidgets.QMessageBox.critical(self, "媒合報表失敗", errors["report"])
+        if ctx.get("images_dir"):
+            open_dir(ctx["images_dir"])
+        if ctx.get("woo_dir"):
+            open_dir(ctx["woo_dir"])
+        if ctx.get("upload_result"):
+            self._show_upload_result(ctx["upload_result"])
+        elif "woo_upload" in errors:
+            QtWidgets.QMessageBox.critical(self, "訂單建立失敗", errors["woo_upload"])
 
+        self.update_status()
         self.progressBar.setValue(100)
-        self.append_log("全部完成")
-        self.set_summary("完成")
+        if res.get("cancelled"):
+            self.append_log("已取消")
+            self.set_summary("已取消")
+        else:
+            self.append_log("全部完成")
+            self.set_summary("完成")
         self.write_log_file()
 
     def write_log_file(self):
@@ -735,7 +655,8 @@ def start_app():
         "single_instance_mutex_name": config.get("single_instance_mutex_name", "ExcelAutoAppSingletonMutex"),
         "single_instance_max_age_hours": config.get("single_instance_max_age_hours", 12)
     }
-    ok, reason = acquire_lock(lock_cfg)
+    probe = os.environ.get(STARTUP_PROBE_ENV) == "1"
+    ok, reason = (True, "probe") if probe else acquire_lock(lock_cfg)
     if not ok:
         app = QtWidgets.QApplication(sys.argv)
         QtWidgets.QMessageBox.warning(
@@ -761,10 +682,22 @@ def start_app():
 
     w = MainWindow(config)
     w.show()
+    if probe:
+        def _report_first_window():
+            import_ms = (_T_IMPORTED - _T_START) * 1000
+            window_ms = (time.perf_counter() - _T_START) * 1000
+            print(json.dumps({"startup_probe": True, "import_ms": round(import_ms, 1),
+                              "first_window_ms": round(window_ms, 1),
+                              "modules": len(sys.modules)}), flush=True)
+            app.quit()
+        QtCore.QTimer.singleShot(0, _report_first_window)
+        sys.exit(app.exec())
     code = app.exec()
     release_lock()
     sys.exit(code)
 
 
 if __name__ == "__main__":
+    # 打包後的執行檔啟動產圖行程池時需要
+    multiprocessing.freeze_support()
     start_app()
\ No newline at end of file
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""
+共用金額正規化
+- 單值 API：parse_amount()
+- 整欄 API：parse_amount_series()（pandas str accessor + 預編譯正則，無逐列 Python 迴圈）
+- 統一規則：(100) 視為負數；移除 NT$ / $ / ＄ / 元 / 半形與全形逗號 / 空白；
+  取第一個數字（可含負號與小數）
+"""
+
+import re
+from typing import Any, Optional
+
+# 需移除的雜訊（順序：先 NT$ 再 $，避免殘留 "NT"）
+_NOISE_PATTERN = r"NT\$|[$＄元,，\s]"
+_NOISE_RE = re.compile(_NOISE_PATTERN)
+_NUMBER_PATTERN = r"-?\d+(?:\.\d+)?"
+AMOUNT_RE = re.compile(_NUMBER_PATTERN)
+_NUMBER_GROUP = f"({_NUMBER_PATTERN})"
+
+
+def parse_amount(raw: Any) -> Optional[float]:
+    """單值正規化；空值或找不到數字回傳 None。"""
+    if raw is None:
+        return None
+    if isinstance(raw, (int, float)) and not isinstance(raw, bool):
+        return None if raw != raw else float(raw)  # NaN 檢查
+    s = str(raw).strip()
+    if not s or s in ("nan", "None"):
+        return None
+    neg = s.startswith("(") and s.endswith(")")
+    m = AMOUNT_RE.search(_NOISE_RE.sub("", s))
+    if not m:
+        return None
+    v = float(m.group(0))
+    return -v if neg else v
+
+
+def parse_amount_series(series):
+    """整欄正規化為 float Series；無法解析者為 NaN。"""
+    import pandas as pd
+
+    if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+        return series.astype(float)
+    s = series.where(series.notna(), "").astype(str).str.strip()
+    neg = s.str.startswith("(") & s.str.endswith(")")
+    nums = s.str.replace(_NOISE_PATTERN, "", regex=True).str.extract(_NUMBER_GROUP, expand=False)
+    vals = pd.to_numeric(nums, errors="coerce")
+    return vals.mask(neg, -vals)
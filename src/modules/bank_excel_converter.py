@@ -6,6 +6,9 @@ from typing import Dict, List, Optional, Tuple, Any
 
 import pandas as pd
 
+from modules.amount_normalizer import parse_amount, parse_amount_series
+from modules.datetime_normalizer import parse_one, format_series, template_key_for
+
 TARGET_COLUMNS = [
     "order_number","order_date","paid_date","status","shipping_total","shipping_tax_total",
     "fee_total","fee_tax_total","tax_total","cart_discount","order_discount","discount_total",
@@ -160,26 +163,24 @@ def build_mapping(df: pd.DataFrame, mode:str)->Dict[str,str]:
 def parse_dt(val):
     if val is None or str(val).strip()=="":
         return ""
+    dt=parse_one(val)
+    if dt is not None:
+        return dt.strftime("%Y-%m-%d %H:%M:%S")
     try:
         dt=pd.to_datetime(str(val))
         return dt.strftime("%Y-%m-%d %H:%M:%S")
     except Exception:
         return str(val).strip()
 
+def _dt_column(df: pd.DataFrame, col: Optional[str], tkey: str) -> Optional[pd.Series]:
+    # 整欄一次解析（格式依模板快取），取代逐列 parse_dt
+    if not col or col not in df.columns:
+        return None
+    return format_series(df[col], template_key=tkey)
+
 def normalize_amount(raw) -> float:
-    if raw is None: return 0.0
-    s = str(raw).strip()
-    if not s: return 0.0
-    neg=False
-    if s.startswith("(") and s.endswith(")"):
-        neg=True; s=s[1:-1]
-    s=(s.replace(",","").replace("，","").replace("$","")
-        .replace("NT$","").replace("元","").replace(" ",""))
-    import re
-    m=re.search(r"-?\d+(?:\.\d+)?",s)
-    if not m: return 0.0
-    v=float(m.group(0))
-    return -v if neg else v
+    v=parse_amount(raw)
+    return v if v is not None else 0.0
 
 def process_file(input_path: str, output_csv: str,
                  fee_rate: float = 0.07,
@@ -200,19 +201,21 @@ def process_file(input_path: str, output_csv: str,
     out_rows=[]
     percent_str=f"{fee_rate*100:.2f}%"
     prod_disp=PRODUCT_DISPLAY.get(product_type,"遊戲幣")
+    tkey=template_key_for(df.columns)
+    apply_dates=_dt_column(df,mapping.get("apply_time"),tkey)
+    paid_dates=_dt_column(df,mapping.get("paid_time"),tkey)
+    amounts=(parse_amount_series(df[mapping["amount"]]).fillna(0).abs()
+             if mapping.get("amount") else None)
 
     for idx,row in df.iterrows():
         if row.isna().all():
             continue
-        raw_amount=row.get(mapping.get("amount")) if mapping.get("amount") else None
-        amt=abs(normalize_amount(raw_amount))
+        amt=float(amounts.at[idx]) if amounts is not None else 0.0
         if amt==0:
             continue
 
-        apply_time=row.get(mapping.get("apply_time")) if mapping.get("apply_time") else ""
-        paid_time=row.get(mapping.get("paid_time")) if mapping.get("paid_time") else apply_time
-        order_date=parse_dt(apply_time)
-        paid_date=parse_dt(paid_time)
+        order_date=apply_dates.at[idx] if apply_dates is not None else ""
+        paid_date=paid_dates.at[idx] if paid_dates is not None else order_date
         txid=row.get(mapping.get("reference")) if mapping.get("reference") else ""
         name=row.get(mapping.get("name")) if mapping.get("name") else ""
         name=str(name).strip() if name and str(name).strip() not in ("nan","None") else ("買家" if mode=="in" else "賣家")
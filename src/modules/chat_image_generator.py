@@ -7,10 +7,13 @@
 - 若 Pilmoji 不可用或渲染失敗，emoji fallback 為文字字型
 """
 
-import os, random, datetime, re
-from typing import List, Dict, Any, Optional
+import os, random, datetime, threading, time, json, hashlib, shutil
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Callable
 from PIL import Image, ImageDraw, ImageFont, ImageOps
-from product_dialogues import get_templates
+from modules.dialogue_templates import (get_compiled_templates, compile_preset, expand_segments,
+                                        split_clusters, templates_digest)
+from modules.datetime_normalizer import parse_one
 
 # ====== 你的要求的三個參數 ======
 EMOJI_BASELINE_SHIFT = 3       # 正值向下
@@ -112,66 +115,14 @@ def locate_main_font()->str:
         if os.path.isfile(c): return c
     return ""
 
-# ===== Emoji Cluster Regex (含 VS-16 / ZWJ) =====
-EMOJI_CLUSTER_PATTERN = re.compile(
-    "("
-    "["
-    "\U0001F300-\U0001F6FF"
-    "\U0001F900-\U0001FAFF"
-    "\U0001F1E6-\U0001F1FF"
-    "\U00002700-\U000027BF"
-    "\U00002600-\U000026FF"
-    "\U00002300-\U0000237F"
-    "\U00002000-\U000020FF"
-    "]"
-    "(?:\uFE0F)?"
-    "(?:\u200D(?:["
-    "\U0001F300-\U0001F6FF"
-    "\U0001F900-\U0001FAFF"
-    "\U0001F1E6-\U0001F1FF"
-    "\U00002700-\U000027BF"
-    "\U00002600-\U000026FF"
-    "\U00002300-\U0000237F"
-    "\U00002000-\U000020FF"
-    "](?:\uFE0F)?))*"
-    ")"
-)
-
-def split_clusters(line:str)->List[tuple]:
-    """回傳 [(kind, text)] kind in {'text','emoji'}"""
-    parts=[]; last=0
-    for m in EMOJI_CLUSTER_PATTERN.finditer(line):
-        st,en=m.start(),m.end()
-        if st>last:
-            parts.append(("text", line[last:st]))
-        parts.append(("emoji", line[st:en]))
-        last=en
-    if last<len(line):
-        parts.append(("text", line[last:]))
-    return parts
-
 def text_has_emoji(line:str)->bool:
     return any(k=="emoji" for k,_ in split_clusters(line))
 
 # ===== 時間 =====
 def _parse_base_datetime(raw:str)->datetime.datetime:
     if not raw: return datetime.datetime.now()
-    fmts=["%Y-%m-%d %H:%M:%S","%Y/%m/%d %H:%M:%S","%Y-%m-%d %H:%M","%Y/%m/%d %H:%M",
-          "%Y-%m-%d","%Y/%m/%d","%H:%M:%S","%H:%M"]
-    for f in fmts:
-        try:
-            dt=datetime.datetime.strptime(raw,f)
-            if f in ("%H:%M:%S","%H:%M"):
-                today=datetime.date.today()
-                dt=datetime.datetime.combine(today, dt.time())
-            return dt
-        except: pass
-    m=re.search(r"([0-2]?\d):([0-5]\d)", raw or "")
-    if m:
-        h=int(m.group(1)); mi=int(m.group(2))
-        today=datetime.date.today()
-        return datetime.datetime(today.year,today.month,today.day,h,mi,0)
-    return datetime.datetime.now()
+    dt=parse_one(raw, allow_time_only=True)
+    return dt or datetime.datetime.now()
 
 def _format_time_ampm(dt:datetime.datetime)->str:
     h,m=dt.hour,dt.minute
@@ -181,42 +132,102 @@ def _format_time_ampm(dt:datetime.datetime)->str:
     elif disp>12: disp-=12
     return f"{period} {disp:02d}:{m:02d}"
 
-def _generate_time_series(count:int, base_dt:datetime.datetime)->List[datetime.datetime]:
+def _generate_time_series(count:int, base_dt:datetime.datetime, rng=random)->List[datetime.datetime]:
     if count<=0: return []
     if count==1: return [base_dt]
     offsets=[0]*count
     for i in range(count-2,-1,-1):
-        if random.random()<PROB_SAME_MINUTE:
+        if rng.random()<PROB_SAME_MINUTE:
             offsets[i]=offsets[i+1]
         else:
             max_extra=MAX_BACK_MINUTES-offsets[i+1]
             if max_extra<MIN_STEP_MINUTES:
                 offsets[i]=offsets[i+1]
             else:
-                step=random.randint(MIN_STEP_MINUTES,min(15,max_extra))
+                step=rng.randint(MIN_STEP_MINUTES,min(15,max_extra))
                 offsets[i]=offsets[i+1]+step
     if FORCE_SPREAD and len(set(offsets))==1:
         spread=0
         for i in range(count-2,-1,-1):
-            spread+=random.randint(MIN_STEP_MINUTES,3)
+            spread+=rng.randint(MIN_STEP_MINUTES,3)
             offsets[i]=spread
     times=[base_dt - datetime.timedelta(minutes=o) for o in offsets]
     return sorted(times)
 
+# ===== 量測快取 =====
+# 同樣的對話句在上千張圖中重複出現；textbbox 只取決於 (字型, 大小, 字串)，與畫布內容無關
+TEXT_MEASURE_CACHE_SIZE = 8192
+
+class _LRUCache:
+    """執行緒安全的有界 LRU（批次以多執行緒產圖）。"""
+    def __init__(self, maxsize:int):
+        self.maxsize=maxsize
+        self._data=OrderedDict()
+        self._lock=threading.Lock()
+        self.hits=0; self.misses=0
+    def get(self,key):
+        with self._lock:
+            try:
+                val=self._data[key]
+            except KeyError:
+                self.misses+=1
+                return None
+            self._data.move_to_end(key)
+            self.hits+=1
+            return val
+    def put(self,key,val):
+        with self._lock:
+            self._data[key]=val
+            self._data.move_to_end(key)
+            while len(self._data)>self.maxsize:
+                self._data.popitem(last=False)
+    def clear(self):
+        with self._lock:
+            self._data.clear(); self.hits=0; self.misses=0
+    def __len__(self):
+        return len(self._data)
+
+_MEASURE_CACHE=_LRUCache(TEXT_MEASURE_CACHE_SIZE)
+_MEASURE_DRAW=ImageDraw.Draw(Image.new("RGBA",(1,1)))
+
+def _font_key(font)->Optional[tuple]:
+    """
+    以 (檔案路徑, face index, 大小, 排版引擎) 識別字型；沒有檔案路徑的字型（load_default / 記憶體載入）回傳 None 不快取，
+    避免以 id() 為鍵時物件回收後位址被新字型重用而取到錯的量測值。
+    """
+    path=getattr(font,"path",None)
+    if not isinstance(path,(str,bytes,os.PathLike)):
+        return None
+    return (os.fspath(path), getattr(font,"index",0), getattr(font,"size",0), getattr(font,"layout_engine",None))
+
+def _text_bbox(font,text:str)->tuple:
+    """等同 draw.textbbox((0,0),text,font=font)（RGBA 畫布），以 (字型, 字串) 快取。"""
+    fk=_font_key(font)
+    if fk is None:
+        return _MEASURE_DRAW.textbbox((0,0),text,font=font)
+    key=(fk,text)
+    bb=_MEASURE_CACHE.get(key)
+    if bb is None:
+        bb=_MEASURE_DRAW.textbbox((0,0),text,font=font)
+        _MEASURE_CACHE.put(key,bb)
+    return bb
+
 # ===== 換行：以 cluster 為單位 =====
 def _measure_segment(draw,font,segment,is_emoji:bool)->int:
     if is_emoji:
         # 預估寬度：字體大小 * EMOJI_SCALE * （約略 0.9~1.05）可再微調
         return int(font.size * EMOJI_SCALE)
-    bbox=draw.textbbox((0,0),segment,font=font)
+    bbox=_text_bbox(font,segment)
     return bbox[2]-bbox[0]
 
-def _wrap_text_clusters(draw:ImageDraw.ImageDraw,text:str,font:ImageFont.FreeTypeFont,max_width:int)->List[List[tuple]]:
+def _wrap_text_clusters(draw:ImageDraw.ImageDraw,text,font:ImageFont.FreeTypeFont,max_width:int)->List[List[tuple]]:
     """
     回傳行列表；每行為 [(kind,segment),...]
     kind: 'text' or 'emoji'
+    text 可為字串，或已切好的 [(kind,segment)]（預編譯模板代入後的結果）
+    行寬以累加維護（片段間距 1px），每加入一段 O(1)
     """
-    clusters = split_clusters(text)
+    clusters = split_clusters(text) if isinstance(text,str) else text
     lines=[]
     current=[]
     current_width=0
@@ -224,85 +235,132 @@ def _wrap_text_clusters(draw:ImageDraw.ImageDraw,text:str,font:ImageFont.FreeTyp
         # 分割文本段再細分為“字詞” (僅在 text 中有空白或很長才拆；中文無空白按整段)
         if kind=="text":
             # 若含空白 → 依空白拆詞
-            tokens = seg.split(" ") if " " in seg else [seg]
-            for tk in tokens:
-                if tk=="":
-                    continue
-                width=_measure_segment(draw,font,tk,False)
-                tentative=current_width + (width if current_width==0 else width+1)
-                if tentative>max_width and current:
-                    lines.append(current)
-                    current=[]; current_width=0
-                current.append(("text", tk))
-                current_width = sum(_measure_segment(draw,font,s, k=="emoji")+(0 if i==0 else 1)
-                                    for i,(k,s) in enumerate(current))
+            tokens = [tk for tk in seg.split(" ") if tk] if " " in seg else [seg]
         else:  # emoji cluster
-            width=_measure_segment(draw,font,seg,True)
+            tokens = [seg]
+        for tk in tokens:
+            width=_measure_segment(draw,font,tk,kind=="emoji")
             tentative=current_width + (width if current_width==0 else width+1)
             if tentative>max_width and current:
                 lines.append(current)
                 current=[]; current_width=0
-            current.append(("emoji", seg))
-            current_width = sum(_measure_segment(draw,font,s, k=="emoji")+(0 if i==0 else 1)
-                                for i,(k,s) in enumerate(current))
+            current_width = width if not current else current_width+width+1
+            current.append((kind, tk))
     if current: lines.append(current)
     return lines
 
 def _get_line_height(draw:ImageDraw.ImageDraw,font:ImageFont.FreeTypeFont)->int:
-    bbox=draw.textbbox((0,0),"測",font=font)
+    bbox=_text_bbox(font,"測")
     return (bbox[3]-bbox[1]) + LINE_HEIGHT_EXTRA
 
-# ===== Emoji Cluster 渲染 =====
-def render_emoji_cluster(img:Image.Image,x:int,y:int,cluster:str,font:ImageFont.FreeTypeFont)->int:
-    ascent,_=font.getmetrics()
-    baseline_y=y+ascent
-    if _PILMOJI_AVAILABLE and FORCE_PILMOJI:
+# ===== Emoji Glyph 快取 =====
+# 每個 (cluster, 大小, 縮放) 只經 Pilmoji 點陣化一次：記憶體 LRU + 可選的磁碟圖集
+# 圖集填過一次後，離線（Pilmoji 抓不到 emoji 圖源）也能正確繪製
+EMOJI_GLYPH_CACHE_SIZE = 512
+EMOJI_FAIL_RETRY_SECONDS = 60.0         # 點陣化失敗（多半是暫時連不到 emoji 圖源）多久後再試
+EMOJI_ATLAS_DIR: Optional[str] = None   # set_emoji_atlas_dir() 設定；None 表示只用記憶體快取
+
+_EMOJI_CACHE=_LRUCache(EMOJI_GLYPH_CACHE_SIZE)
+
+def set_emoji_atlas_dir(path:Optional[str]):
+    global EMOJI_ATLAS_DIR
+    if path:
+        try:
+            os.makedirs(path,exist_ok=True)
+        except OSError as e:
+            print("[ChatGen] emoji 圖集資料夾無法建立", path, e)
+            path=None
+    EMOJI_ATLAS_DIR=path or None
+
+def _atlas_path(cluster:str,size:int,scale:float)->Optional[str]:
+    if not EMOJI_ATLAS_DIR: return None
+    cps="-".join(f"{ord(c):x}" for c in cluster)
+    return os.path.join(EMOJI_ATLAS_DIR,f"{size}_{int(round(scale*1000))}_{cps}.png")
+
+def _rasterize_emoji(cluster:str,font:ImageFont.FreeTypeFont)->Optional[Image.Image]:
+    box=font.size*3
+    tmp=Image.new("RGBA",(box,box),(0,0,0,0))
+    with Pilmoji(tmp) as pm:
+        pm.text((0,0),cluster,font=font,fill=(0,0,0,255))
+    bbox=tmp.getbbox()
+    if not bbox: return None
+    glyph=tmp.crop(bbox)
+    gh,gw=glyph.size[1],glyph.size[0]
+    target_h=int(font.size*EMOJI_SCALE)
+    ratio=target_h/gh
+    target_w=int(gw*ratio)
+    return glyph.resize((target_w,target_h),Image.LANCZOS)
+
+def get_emoji_glyph(cluster:str,font:ImageFont.FreeTypeFont)->Optional[Image.Image]:
+    """回傳已縮放好的 RGBA glyph（唯讀共用）；無法取得時回傳 None（改以字型繪製）。"""
+    key=(cluster,font.size,EMOJI_SCALE)
+    glyph=_EMOJI_CACHE.get(key)
+    if isinstance(glyph,float):
+        # 失敗記錄：未到重試時間前直接改用字型繪製
+        if time.monotonic()<glyph:
+            return None
+        glyph=None
+    if glyph is not None:
+        return glyph
+    atlas=_atlas_path(cluster,font.size,EMOJI_SCALE)
+    if atlas and os.path.isfile(atlas):
+        try:
+            with Image.open(atlas) as im:
+                glyph=im.convert("RGBA")
+        except Exception as e:
+            if EMOJI_DEBUG: print("[EmojiAtlasReadFail]",atlas,e)
+            glyph=None
+    if glyph is None and _PILMOJI_AVAILABLE:
         try:
-            box=font.size*3
-            tmp=Image.new("RGBA",(box,box),(0,0,0,0))
-            with Pilmoji(tmp) as pm:
-                pm.text((0,0),cluster,font=font,fill=(0,0,0,255))
-            bbox=tmp.getbbox()
-            if bbox:
-                glyph=tmp.crop(bbox)
-                gh,gw=glyph.size[1],glyph.size[0]
-                target_h=int(font.size*EMOJI_SCALE)
-                ratio=target_h/gh
-                target_w=int(gw*ratio)
-                glyph=glyph.resize((target_w,target_h),Image.LANCZOS)
-                paste_x=x+EMOJI_EXTRA_X_SHIFT
-                paste_y=baseline_y - target_h + EMOJI_BASELINE_SHIFT
-                img.paste(glyph,(paste_x,paste_y),glyph)
-                return target_w + EMOJI_EXTRA_X_SHIFT
+            glyph=_rasterize_emoji(cluster,font)
         except Exception as e:
             if EMOJI_DEBUG:
                 print("[EmojiClusterFail]",cluster,e)
+        if glyph is not None and atlas:
+            try:
+                tmp_path=f"{atlas}.{os.getpid()}.{threading.get_ident()}.tmp"
+                glyph.save(tmp_path,format="PNG")
+                os.replace(tmp_path,atlas)
+            except OSError as e:
+                if EMOJI_DEBUG: print("[EmojiAtlasWriteFail]",atlas,e)
+    # 失敗記下重試時間（monotonic 秒），期間不再重試 Pilmoji；過期後再點陣化一次
+    _EMOJI_CACHE.put(key,glyph if glyph is not None else time.monotonic()+EMOJI_FAIL_RETRY_SECONDS)
+    return glyph
+
+# ===== Emoji Cluster 渲染 =====
+def render_emoji_cluster(img:Image.Image,x:int,y:int,cluster:str,font:ImageFont.FreeTypeFont)->int:
+    if FORCE_PILMOJI:
+        glyph=get_emoji_glyph(cluster,font)
+        if glyph is not None:
+            ascent,_=font.getmetrics()
+            target_w,target_h=glyph.size
+            paste_x=x+EMOJI_EXTRA_X_SHIFT
+            paste_y=y+ascent - target_h + EMOJI_BASELINE_SHIFT
+            img.paste(glyph,(paste_x,paste_y),glyph)
+            return target_w + EMOJI_EXTRA_X_SHIFT
     # fallback regular font
     draw=ImageDraw.Draw(img)
     draw.text((x,y),cluster,font=font,fill=TEXT_COLOR)
-    bb=draw.textbbox((0,0),cluster,font=font)
+    bb=_text_bbox(font,cluster)
     return bb[2]-bb[0]
 
-def draw_line_clustered(img:Image.Image,x:int,y:int,line_clusters:List[tuple],font:ImageFont.FreeTypeFont,color:tuple):
+def draw_line_clustered(img:Image.Image,x:int,y:int,line_clusters:List[tuple],font:ImageFont.FreeTypeFont,color:tuple,
+                        timings:Optional[Dict[str,float]]=None):
+    """timings 指定時累加 text_ms / emoji_ms（效能量測用）。"""
     draw=ImageDraw.Draw(img)
     cx=x
     for kind,seg in line_clusters:
+        t=time.perf_counter() if timings is not None else 0
         if kind=="text":
             draw.text((cx,y),seg,font=font,fill=color)
-            bb=draw.textbbox((0,0),seg,font=font)
+            bb=_text_bbox(font,seg)
             cx+=bb[2]-bb[0]
         else:
             w=render_emoji_cluster(img,cx,y,seg,font)
             cx+=w
-
-def _format_placeholders(t:str,data:Dict[str,Any])->str:
-    try:
-        return t.format(**data)
-    except:
-        s=t
-        for k,v in data.items():
-            s=s.replace("{"+k+"}",str(v))
-        return s
+        if timings is not None:
+            k="text_ms" if kind=="text" else "emoji_ms"
+            timings[k]=timings.get(k,0)+(time.perf_counter()-t)*1000
 
 def _rounded_rect_dynamic(draw:ImageDraw.ImageDraw,box,bubble_h,fill):
     r=max(int(bubble_h/2),BUBBLE_OVAL_MIN_RADIUS)
@@ -311,17 +369,55 @@ def _rounded_rect_dynamic(draw:ImageDraw.ImageDraw,box,bubble_h,fill):
     except:
         draw.rectangle(box,fill=fill)
 
+# ===== 泡泡陰影 =====
+# 陰影只取決於泡泡尺寸：預先畫成小圖並快取，只與泡泡所在區域合成（不再每則訊息配置整張畫布）
+SHADOW_OFFSET = (3,6)     # 陰影左上相對泡泡
+SHADOW_GROW   = (3,2)     # 陰影比泡泡寬 / 高出的量
+SHADOW_FILL   = (0,0,0,26)
+
+_SHADOW_CACHE=_LRUCache(256)
+
+def _shadow_sprite(bw:int,bh:int)->Image.Image:
+    key=(bw,bh)
+    sp=_SHADOW_CACHE.get(key)
+    if sp is None:
+        w=bw+SHADOW_GROW[0]+1; h=bh+SHADOW_GROW[1]+1
+        sp=Image.new("RGBA",(w,h),(0,0,0,0))
+        ImageDraw.Draw(sp).rounded_rectangle((0,0,w-1,h-1),
+                                             radius=max(int(bh/2),BUBBLE_OVAL_MIN_RADIUS),
+                                             fill=SHADOW_FILL)
+        _SHADOW_CACHE.put(key,sp)
+    return sp
+
+def _composite_shadow(img:Image.Image,bx:int,by:int,bw:int,bh:int):
+    """就地合成泡泡陰影；超出畫布的部分裁掉。"""
+    try:
+        sp=_shadow_sprite(bw,bh)
+        x0=bx+SHADOW_OFFSET[0]; y0=by+SHADOW_OFFSET[1]
+        cl=max(0,-x0); ct=max(0,-y0)
+        cr=min(sp.width,img.width-x0); cb=min(sp.height,img.height-y0)
+        if cr<=cl or cb<=ct: return
+        if (cl,ct,cr,cb)!=(0,0,sp.width,sp.height):
+            sp=sp.crop((cl,ct,cr,cb))
+        img.alpha_composite(sp,dest=(x0+cl,y0+ct))
+    except Exception as e:
+        if EMOJI_DEBUG: print("[ShadowFail]",e)
+
 # ===== 頭像處理 =====
 _AVATAR_LIST=[]
 _AVATAR_CACHE={}
+def _avatar_files()->List[str]:
+    """assets/avatars 內的頭像檔（排序後）；無資源模組或資料夾時回傳空串列。"""
+    if not _USE_RESOURCES_MODULE: return []
+    avatar_dir=get_asset_path("avatars")
+    if not os.path.isdir(avatar_dir): return []
+    return [os.path.join(avatar_dir,f) for f in sorted(os.listdir(avatar_dir))
+            if f.lower().endswith((".png",".jpg",".jpeg",".webp",".gif"))]
+
 def _init_avatar_list():
     if _AVATAR_LIST or not _USE_RESOURCES_MODULE: return
     try:
-        avatar_dir=get_asset_path("avatars")
-        if os.path.isdir(avatar_dir):
-            for f in os.listdir(avatar_dir):
-                if f.lower().endswith((".png",".jpg",".jpeg",".webp",".gif")):
-                    _AVATAR_LIST.append(os.path.join(avatar_dir,f))
+        _AVATAR_LIST.extend(_avatar_files())
     except Exception as e:
         print("[ChatGen] 載入頭像失敗", e)
 
@@ -336,125 +432,263 @@ def _make_circle_avatar(path:str)->Optional[Image.Image]:
     except Exception:
         return None
 
-def get_avatar_image()->Optional[Image.Image]:
+def get_avatar_image(rng=random)->Optional[Image.Image]:
     if not _AVATAR_LIST: return None
-    p=random.choice(_AVATAR_LIST)
+    p=rng.choice(_AVATAR_LIST)
     if p in _AVATAR_CACHE: return _AVATAR_CACHE[p]
     av=_make_circle_avatar(p)
     if av: _AVATAR_CACHE[p]=av
     return av
 
-# ===== 單張生成 =====
-def generate_image_from_record_template(record:Dict[str,Any],out_path:str,preset:Optional[List[Dict[str,str]]]=None,
-                                        template_path:Optional[str]=None,avatar_path:Optional[str]=None,
-                                        force_template:bool=True)->str:
-    if template_path is None: template_path=DEFAULT_TEMPLATE_PATH
-    if force_template and not os.path.isfile(template_path):
-        raise FileNotFoundError(template_path)
+# ===== 行程內渲染環境 =====
+class RenderContext:
+    """
+    每個行程一份：已解碼的模板、解析好的字型、圓形頭像。
+    批次產圖時每張只 copy 模板，不再重複解碼 PNG 與探測字型檔案。
+    取得的模板 / 頭像為共用物件，呼叫端不可就地修改（模板請經 new_canvas）。
+    """
+    def __init__(self):
+        self._lock=threading.Lock()
+        self._templates:Dict[str,Optional[Image.Image]]={}
+        self._avatars:Dict[str,Optional[Image.Image]]={}
+        self.font_path=locate_main_font()
+        self.font_msg=_load_font(self.font_path, MSG_FONT_SIZE,"msg")
+        self.font_time=_load_font(self.font_path, TIME_FONT_SIZE,"time")
+        self.font_read=_load_font(self.font_path, READ_FONT_SIZE,"read")
+        self.font_name=_load_font(self.font_path, NAME_FONT_SIZE,"name")
+
+    def template(self,path:str)->Optional[Image.Image]:
+        """解碼後的 RGBA 模板；檔案不存在回傳 None（結果同樣快取）。"""
+        if path in self._templates:
+            return self._templates[path]
+        with self._lock:
+            if path not in self._templates:
+                im=None
+                if os.path.isfile(path):
+                    with Image.open(path) as f:
+                        im=f.convert("RGBA")
+                self._templates[path]=im
+            return self._templates[path]
+
+    def new_canvas(self,base:Image.Image,height:int)->Image.Image:
+        if height==base.height:
+            return base.copy()
+        img=Image.new("RGBA",(base.width,height),(0,0,0,0))
+        img.paste(base,(0,0))
+        return img
+
+    def avatar(self,path:str)->Optional[Image.Image]:
+        if path not in self._avatars:
+            av=_make_circle_avatar(path) if os.path.isfile(path) else None
+            with self._lock:
+                self._avatars[path]=av
+        return self._avatars[path]
+
+_RENDER_CONTEXT:Optional[RenderContext]=None
+_RENDER_CONTEXT_LOCK=threading.Lock()
+
+def get_render_context()->RenderContext:
+    global _RENDER_CONTEXT
+    if _RENDER_CONTEXT is None:
+        with _RENDER_CONTEXT_LOCK:
+            if _RENDER_CONTEXT is None:
+                _RENDER_CONTEXT=RenderContext()
+    return _RENDER_CONTEXT
+
+def reset_render_context():
+    """模板 / 字型 / 頭像檔案更換後呼叫，下次產圖重新載入（連同字型、頭像與文字量測快取）。"""
+    global _RENDER_CONTEXT
+    with _RENDER_CONTEXT_LOCK:
+        _RENDER_CONTEXT=None
+        _FONT_CACHE.clear()
+        _AVATAR_CACHE.clear()
+        del _AVATAR_LIST[:]
+        _MEASURE_CACHE.clear()
+
+def _file_sig(path:Optional[str])->list:
+    try:
+        st=os.stat(path)
+        return [path,st.st_mtime_ns,st.st_size]
+    except (OSError,TypeError,ValueError):
+        return [path,None,None]
 
-    base=Image.open(template_path).convert("RGBA") if os.path.isfile(template_path) else Image.new("RGBA",(BUBBLE_MAX_WIDTH+260,1400),(240,240,240,255))
-    cw,ch=base.size
-    img=Image.new("RGBA",(cw,ch),(0,0,0,0))
-    img.paste(base,(0,0))
-    draw=ImageDraw.Draw(img)
+def render_asset_signature(template_path:Optional[str]=None)->str:
+    """模板、主字型與頭像檔（路徑 / mtime / 大小）的雜湊；任一檔案更換或增減頭像時改變。"""
+    try:
+        avatars=[_file_sig(p) for p in _avatar_files()]
+    except OSError:
+        avatars=[]
+    sig=[_file_sig(template_path or DEFAULT_TEMPLATE_PATH),_file_sig(locate_main_font()),avatars]
+    return hashlib.sha256(json.dumps(sig,ensure_ascii=False).encode("utf-8")).hexdigest()[:16]
 
-    raw_amount=str(record.get("amount") or record.get("total") or "").replace(",","")
-    try: a_num=float(raw_amount) if raw_amount else 0
-    except: a_num=0
-    amount_str=f"{int(a_num):,}" if a_num else (record.get("amount") or "0")
+_ASSET_SIGNATURE:Optional[str]=None
 
-    direction=(record.get("direction") or "in").lower()
-    product_type=record.get("product_type","game_currency")
-    nickname=record.get("customer_name") or record.get("nickname") or ("賣家" if direction=="out" else "買家")
-    base_time=record.get("apply_time") or record.get("time") or record.get("date") or ""
-    base_dt=_parse_base_datetime(base_time)
+def refresh_render_context(template_path:Optional[str]=None)->bool:
+    """
+    產圖階段開始時呼叫：素材檔與上次不同時 reset_render_context，回傳是否重設。
+    GUI 長時間執行時，更換模板 / 字型 / 頭像後不需重開程式。
+    """
+    global _ASSET_SIGNATURE
+    sig=render_asset_signature(template_path)
+    changed=_ASSET_SIGNATURE is not None and sig!=_ASSET_SIGNATURE
+    if changed:
+        reset_render_context()
+    _ASSET_SIGNATURE=sig
+    return changed
+
+# ===== 記錄指紋 / 產圖 manifest =====
+# 影響圖面內容的欄位；seeded 模式以其雜湊播種，manifest 以其判斷記錄是否變更
+RENDER_VERSION = 1   # 版面 / 繪製邏輯變更時遞增，使舊 manifest 失效
+_FINGERPRINT_FIELDS = ("direction","product_type","order_no","order_number","單號","amount","total",
+                       "customer_name","nickname","apply_time","time","date","item_name","goods_name")
+
+def record_fingerprint(record:Dict[str,Any])->str:
+    base=json.dumps([str(record.get(k) or "") for k in _FINGERPRINT_FIELDS],ensure_ascii=False)
+    return hashlib.sha256(base.encode("utf-8")).hexdigest()
+
+class RenderManifest:
+    """
+    記錄指紋 → 已產出的圖片（JSON 檔）。指紋與 render_key（版本 / 模板 / 編碼設定）皆相同、
+    且檔案仍存在時視為未變更，可略過重繪（舊圖複製進本次輸出資料夾）。只在主行程讀寫。
+    """
+    def __init__(self,path:str):
+        self.path=path
+        self._lock=threading.Lock()
+        self._data:Dict[str,Dict[str,Any]]={}
+        if os.path.isfile(path):
+            try:
+                with open(path,"r",encoding="utf-8") as f:
+                    self._data=json.load(f).get("records",{})
+            except Exception as e:
+                print("[ChatGen] manifest 讀取失敗，將重建", path, e)
+
+    def lookup(self,fp:str,render_key:str)->Optional[str]:
+        ent=self._data.get(fp)
+        if ent and ent.get("key")==render_key and os.path.isfile(ent.get("path","")):
+            return ent["path"]
+        return None
 
-    item_name=record.get("item_name") or "寶物"
-    goods_name=record.get("goods_name") or "二手物品"
+    def record(self,fp:str,render_key:str,path:str,size:int=0):
+        with self._lock:
+            self._data[fp]={"key":render_key,"path":path,"bytes":size}
 
-    templates=get_templates(product_type,direction)
-    preset=random.choice(templates) if preset is None else preset
-    times=_generate_time_series(len(preset),base_dt)
-    time_strings=[_format_time_ampm(t) for t in times]
+    def save(self):
+        with self._lock:
+            d=os.path.dirname(self.path)
+            if d: os.makedirs(d,exist_ok=True)
+            tmp=self.path+".tmp"
+            with open(tmp,"w",encoding="utf-8") as f:
+                json.dump({"version":RENDER_VERSION,"records":self._data},f,ensure_ascii=False)
+            os.replace(tmp,self.path)
 
-    font_path=locate_main_font()
-    font_msg=_load_font(font_path, MSG_FONT_SIZE,"msg")
-    font_time=_load_font(font_path, TIME_FONT_SIZE,"time")
-    font_read=_load_font(font_path, READ_FONT_SIZE,"read")
-    font_name=_load_font(font_path, NAME_FONT_SIZE,"name")
+    def __len__(self):
+        return len(self._data)
 
-    draw.text((108+75,NAME_HEADER_Y),nickname,font=font_name,fill=(0,0,0))
+def _reuse_image(src:str,dst:str)->bool:
+    """
+    把先前產出的圖複製到本次輸出路徑。不用硬連結：兩個批次共用同一 inode 時，
+    就地覆寫或編輯其中一張會連帶改掉另一批的圖。
+    """
+    if os.path.abspath(src)==os.path.abspath(dst):
+        return True
+    try:
+        shutil.copy2(src,dst)
+        return True
+    except OSError as e:
+        print("[ChatGen] 沿用舊圖失敗，改為重繪", src, e)
+        return False
 
-    avatar_img=None
-    if avatar_path and os.path.isfile(avatar_path):
-        avatar_img=_make_circle_avatar(avatar_path)
+def _render_key(template_path:str,avatar_path:Optional[str],encoding:Optional[Dict[str,Any]])->str:
+    """
+    影響圖面的一切設定：版本、編碼、模板 / 字型 / 頭像檔（路徑、mtime、大小）與對話模板內容；
+    任一項改變，manifest 中的舊圖即視為過期而重繪。
+    """
+    return hashlib.sha256(json.dumps([RENDER_VERSION,template_path,_file_sig(avatar_path) if avatar_path else "",
+                                      encoding,render_asset_signature(template_path),templates_digest()],
+                                     sort_keys=True,ensure_ascii=False).encode("utf-8")).hexdigest()[:16]
+
+# ===== 輸出編碼 =====
+# format: png / jpeg / webp；png 的 quality 無效，改以 compress_level（0~9，越低越快、檔案越大）與 optimize 控制
+# quantize>0 時先轉為該色數的調色盤圖（png / webp 有效，jpeg 忽略）
+IMAGE_EXTS = {"png": ".png", "jpeg": ".jpg", "webp": ".webp"}
+DEFAULT_ENCODING = {"format": "png", "quality": 90, "compress_level": 3, "optimize": False, "quantize": 0}
+
+def normalize_encoding(enc:Optional[Dict[str,Any]])->Dict[str,Any]:
+    out=dict(DEFAULT_ENCODING)
+    out.update({k:v for k,v in (enc or {}).items() if v is not None})
+    fmt=str(out["format"]).lower()
+    fmt="jpeg" if fmt=="jpg" else fmt
+    if fmt not in IMAGE_EXTS:
+        raise ValueError(f"不支援的圖片格式: {out['format']}")
+    out["format"]=fmt
+    out["quality"]=max(1,min(100,int(out["quality"])))
+    out["compress_level"]=max(0,min(9,int(out["compress_level"])))
+    out["optimize"]=bool(out["optimize"])
+    out["quantize"]=max(0,min(256,int(out["quantize"] or 0)))
+    return out
+
+def encode_image(img:Image.Image,out_path:str,enc:Optional[Dict[str,Any]]=None)->int:
+    """依 enc 寫檔，回傳位元組數；enc 為 None 時維持舊行為（依副檔名、quality=96）。"""
+    rgb=img.convert("RGB")
+    if enc is None:
+        rgb.save(out_path,quality=96)
+        return os.path.getsize(out_path)
+    fmt=enc["format"]
+    if fmt=="jpeg":
+        rgb.save(out_path,format="JPEG",quality=enc["quality"],optimize=enc["optimize"])
     else:
-        _init_avatar_list()
-        avatar_img=get_avatar_image()
+        im=rgb.quantize(enc["quantize"]) if enc["quantize"] else rgb
+        if fmt=="png":
+            im.save(out_path,format="PNG",compress_level=enc["compress_level"],optimize=enc["optimize"])
+        else:
+            # method 0 最快；optimize 時用預設的 4（較小、較慢）
+            im.save(out_path,format="WEBP",quality=enc["quality"],method=4 if enc["optimize"] else 0)
+    return os.path.getsize(out_path)
 
-    y=TEMPLATE_PADDING_TOP
-    time_items=[]
-    read_items=[]
+# ===== 版面計算 =====
+CANVAS_BOTTOM_RESERVE = 180   # 內容底部距畫布底小於此值時加高
+CANVAS_GROW_STEP      = 900
 
-    for i,m in enumerate(preset):
-        role=m.get("role","left")
+def _layout_dialogue(preset:List[tuple],data:Dict[str,str],time_strings:List[str],cw:int,ch:int,
+                     font_msg,font_time,font_read)->Dict[str,Any]:
+    """
+    第一階段：只算版面不畫圖。回傳
+    {"bubbles": [(role,bx,by,bw,bh,line_clusters)], "times": [(x,y,text)], "reads": [(x,y,text)],
+     "line_height": lh, "height": 最終畫布高度}
+    畫布加高規則與舊版逐則加高相同（每則訊息後 y>ch-180 即 +900），但只在第二階段配置一次。
+    """
+    lh=_get_line_height(_MEASURE_DRAW,font_msg)
+    rb=_text_bbox(font_read,READ_TEXT)
+    r_w=rb[2]-rb[0]; r_h=rb[3]-rb[1]
+    bubbles=[]; time_items=[]; read_items=[]
+    y=TEMPLATE_PADDING_TOP
+    data=dict(data)
+    for i,(role,segments) in enumerate(preset):
         t_str=time_strings[i]
-        data={"buyer":nickname,"amount":amount_str,"time":t_str,"item_name":item_name,"goods_name":goods_name}
-        raw_text=_format_placeholders(m.get("text",""),data)
+        data["time"]=t_str
+        clusters=expand_segments(segments,data)
 
         # 以 cluster wrap
-        line_clusters = _wrap_text_clusters(draw, raw_text, font_msg, BUBBLE_MAX_WIDTH)
-        lh=_get_line_height(draw,font_msg)
+        line_clusters = _wrap_text_clusters(_MEASURE_DRAW, clusters, font_msg, BUBBLE_MAX_WIDTH)
         max_w=0
         for line in line_clusters:
-            line_w=sum(_measure_segment(draw,font_msg,seg,(k=='emoji')) for k,seg in line)
+            line_w=sum(_measure_segment(_MEASURE_DRAW,font_msg,seg,(k=='emoji')) for k,seg in line)
             max_w=max(max_w,line_w)
         bw=max_w + BUBBLE_PAD_X*2 + BUBBLE_EXTRA_W
         bh=lh*len(line_clusters) + BUBBLE_PAD_Y*2 + BUBBLE_EXTRA_H
+        tb=_text_bbox(font_time,t_str)
+        t_w=tb[2]-tb[0]; t_h=tb[3]-tb[1]
+        by=y
 
         if role=="left":
-            bx=18+AVATAR_SIZE+12; by=y
-            if avatar_img: img.paste(avatar_img,(AVATAR_OFFSET_X,by+AVATAR_OFFSET_Y),avatar_img)
-            try:
-                shadow=Image.new("RGBA",(cw,ch),(0,0,0,0))
-                sd=ImageDraw.Draw(shadow)
-                sd.rounded_rectangle((bx+3,by+6,bx+bw+6,by+bh+8),
-                                     radius=max(int(bh/2),BUBBLE_OVAL_MIN_RADIUS),
-                                     fill=(0,0,0,26))
-                img=Image.alpha_composite(img,shadow); draw=ImageDraw.Draw(img)
-            except: pass
-            _rounded_rect_dynamic(draw,(bx,by,bx+bw,by+bh),bh,BUBBLE_LEFT)
-            tx=bx+BUBBLE_PAD_X; ty=by+BUBBLE_PAD_Y
-            for line in line_clusters:
-                draw_line_clustered(img,tx,ty,line,font_msg,TEXT_COLOR)
-                ty+=lh
-            tb=draw.textbbox((0,0),t_str,font=font_time)
-            t_w=tb[2]-tb[0]; t_h=tb[3]-tb[1]
+            bx=18+AVATAR_SIZE+12
             time_x=bx+bw+TIME_OFFSET_X
             time_y=by+(bh-t_h)/2+TIME_OFFSET_Y
             if time_x+t_w>cw-6:
                 time_x=bx+bw-t_w; time_y=by-t_h-6
-            time_items.append((time_x,time_y,t_str,"left"))
-            y=by+bh+GAP_BETWEEN
+            time_items.append((time_x,time_y,t_str))
         else:
-            bx=cw-RIGHT_MARGIN-bw-12; by=y
-            try:
-                shadow=Image.new("RGBA",(cw,ch),(0,0,0,0))
-                sd=ImageDraw.Draw(shadow)
-                sd.rounded_rectangle((bx+3,by+6,bx+bw+6,by+bh+8),
-                                     radius=max(int(bh/2),BUBBLE_OVAL_MIN_RADIUS),
-                                     fill=(0,0,0,26))
-                img=Image.alpha_composite(img,shadow); draw=ImageDraw.Draw(img)
-            except: pass
-            _rounded_rect_dynamic(draw,(bx,by,bx+bw,by+bh),bh,BUBBLE_RIGHT)
-            tx=bx+BUBBLE_PAD_X; ty=by+BUBBLE_PAD_Y
-            for line in line_clusters:
-                draw_line_clustered(img,tx,ty,line,font_msg,TEXT_COLOR)
-                ty+=lh
-            tb=draw.textbbox((0,0),t_str,font=font_time)
-            t_w=tb[2]-tb[0]; t_h=tb[3]-tb[1]
-            rb=draw.textbbox((0,0),READ_TEXT,font=font_read)
-            r_w=rb[2]-rb[0]; r_h=rb[3]-rb[1]
+            bx=cw-RIGHT_MARGIN-bw-12
             block_right=bx-TIGHT_GAP
             read_x=block_right-r_w
             time_x=block_right-t_w
@@ -468,28 +702,173 @@ def generate_image_from_record_template(record:Dict[str,Any],out_path:str,preset
                     read_x=alt_x
                 else:
                     read_x=time_x; read_y=time_y+t_h+4
-            time_items.append((time_x,time_y,t_str,"right"))
+            time_items.append((time_x,time_y,t_str))
             read_items.append((read_x,read_y,READ_TEXT))
-            y=by+bh+GAP_BETWEEN
+        bubbles.append((role,bx,by,bw,bh,line_clusters))
+        y=by+bh+GAP_BETWEEN
+        if y>ch-CANVAS_BOTTOM_RESERVE:
+            ch+=CANVAS_GROW_STEP
+    return {"bubbles":bubbles,"times":time_items,"reads":read_items,"line_height":lh,"height":ch}
 
-        if y>ch-180:
-            extra=900
-            new_h=ch+extra
-            new_img=Image.new("RGBA",(cw,new_h),(0,0,0,0))
-            new_img.paste(img,(0,0))
-            img=new_img; draw=ImageDraw.Draw(img); ch=new_h
+# ===== 單張生成 =====
+def generate_image_from_record_template(record:Dict[str,Any],out_path:str,preset:Optional[List[Dict[str,str]]]=None,
+                                        template_path:Optional[str]=None,avatar_path:Optional[str]=None,
+                                        force_template:bool=True,ctx:Optional[RenderContext]=None,
+                                        encoding:Optional[Dict[str,Any]]=None,
+                                        stats:Optional[Dict[str,float]]=None,
+                                        seeded:bool=False)->str:
+    """
+    encoding 見 normalize_encoding（None = 舊行為）；
+    stats 指定時寫入 render_ms / encode_ms / bytes。
+    seeded=True 時對話、時間序列與頭像改由 record_fingerprint 播種，同一筆記錄每次產出相同圖片。
+    """
+    rng=random.Random(record_fingerprint(record)) if seeded else random
+    t0=time.perf_counter()
+    if template_path is None: template_path=DEFAULT_TEMPLATE_PATH
+    ctx=ctx or get_render_context()
+    base=ctx.template(template_path)
+    if base is None:
+        if force_template:
+            raise FileNotFoundError(template_path)
+        base=Image.new("RGBA",(BUBBLE_MAX_WIDTH+260,1400),(240,240,240,255))
+    cw,ch=base.size
+
+    raw_amount=str(record.get("amount") or record.get("total") or "").replace(",","")
+    try: a_num=float(raw_amount) if raw_amount else 0
+    except: a_num=0
+    amount_str=f"{int(a_num):,}" if a_num else (record.get("amount") or "0")
 
-    for (tx,ty,text,side) in time_items:
+    direction=(record.get("direction") or "in").lower()
+    product_type=record.get("product_type","game_currency")
+    nickname=record.get("customer_name") or record.get("nickname") or ("賣家" if direction=="out" else "買家")
+    base_time=record.get("apply_time") or record.get("time") or record.get("date") or ""
+    base_dt=_parse_base_datetime(base_time)
+
+    item_name=record.get("item_name") or "寶物"
+    goods_name=record.get("goods_name") or "二手物品"
+
+    templates=get_compiled_templates(product_type,direction)
+    preset=rng.choice(templates) if preset is None else compile_preset(preset)
+    times=_generate_time_series(len(preset),base_dt,rng)
+    time_strings=[_format_time_ampm(t) for t in times]
+
+    font_msg=ctx.font_msg; font_time=ctx.font_time
+    font_read=ctx.font_read; font_name=ctx.font_name
+
+    avatar_img=ctx.avatar(avatar_path) if avatar_path else None
+    if avatar_img is None:
+        _init_avatar_list()
+        avatar_img=get_avatar_image(rng)
+
+    # 各階段耗時（stats 指定時才量測）：layout / canvas / shadow / bubble / text / emoji / encode
+    phases:Optional[Dict[str,float]]={} if stats is not None else None
+    def _lap(key:str,since:float)->float:
+        now=time.perf_counter()
+        if phases is not None:
+            phases[key]=phases.get(key,0)+(now-since)*1000
+        return now
+
+    # 第一階段：版面
+    tp=time.perf_counter()
+    data={"buyer":nickname,"amount":amount_str,"item_name":item_name,"goods_name":goods_name}
+    layout=_layout_dialogue(preset,data,time_strings,cw,ch,font_msg,font_time,font_read)
+    tp=_lap("layout_ms",tp)
+
+    # 第二階段：一次配置最終畫布後依序繪製
+    img=ctx.new_canvas(base,layout["height"])
+    draw=ImageDraw.Draw(img)
+    tp=_lap("canvas_ms",tp)
+    draw.text((108+75,NAME_HEADER_Y),nickname,font=font_name,fill=(0,0,0))
+    tp=_lap("text_ms",tp)
+
+    lh=layout["line_height"]
+    for role,bx,by,bw,bh,line_clusters in layout["bubbles"]:
+        if role=="left" and avatar_img:
+            img.paste(avatar_img,(AVATAR_OFFSET_X,by+AVATAR_OFFSET_Y),avatar_img)
+        tp=_lap("canvas_ms",tp)
+        _composite_shadow(img,bx,by,bw,bh)
+        tp=_lap("shadow_ms",tp)
+        _rounded_rect_dynamic(draw,(bx,by,bx+bw,by+bh),bh,BUBBLE_LEFT if role=="left" else BUBBLE_RIGHT)
+        tp=_lap("bubble_ms",tp)
+        tx=bx+BUBBLE_PAD_X; ty=by+BUBBLE_PAD_Y
+        for line in line_clusters:
+            draw_line_clustered(img,tx,ty,line,font_msg,TEXT_COLOR,timings=phases)
+            ty+=lh
+        tp=time.perf_counter()
+
+    for (tx,ty,text) in layout["times"]:
         draw.text((tx,ty),text,font=font_time,fill=TIME_COLOR)
-    for (rx,ry,text) in read_items:
+    for (rx,ry,text) in layout["reads"]:
         draw.text((rx,ry),text,font=font_read,fill=TIME_COLOR)
+    tp=_lap("text_ms",tp)
 
     os.makedirs(os.path.dirname(out_path),exist_ok=True)
-    img.convert("RGB").save(out_path,quality=96)
+    t1=time.perf_counter()
+    size=encode_image(img,out_path,normalize_encoding(encoding) if encoding is not None else None)
+    if stats is not None:
+        t2=time.perf_counter()
+        stats.update(phases)
+        stats.update(render_ms=(t1-t0)*1000,encode_ms=(t2-t1)*1000,bytes=size)
     return out_path
 
 # ===== 批次並行 =====
-from concurrent.futures import ThreadPoolExecutor, as_completed
+# threads：同行程多執行緒（Pillow 繪圖多半受 GIL 限制，約只用到一核）
+# processes：行程池，每個 worker 初始化一次渲染環境（模板 / 字型 / 頭像 / emoji 快取），以分塊接收記錄
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Executor
+from concurrent.futures.process import BrokenProcessPool
+
+RENDER_BACKENDS = ("threads", "processes")
+PROCESS_MIN_RECORDS = 8       # 少於此筆數時行程啟動成本不划算，改用 threads
+CHUNKS_PER_WORKER   = 4
+
+def _pool_init(atlas_dir:Optional[str],offline:bool=False):
+    global _PILMOJI_AVAILABLE
+    # fork 出的 worker 會繼承相同的 random 狀態，需各自重新播種，否則各行程選到相同對話
+    random.seed()
+    if offline:
+        # spawn 的 worker 會重新 import 本模組，主行程改的旗標不會帶過來，需在此設定
+        _PILMOJI_AVAILABLE=False
+    set_emoji_atlas_dir(atlas_dir)
+    get_render_context()
+
+def render_pool_workers(backend:str="threads",max_workers:Optional[int]=None)->int:
+    """make_render_pool 實際使用的 worker 數（未指定時 processes = CPU 數，threads = 4）。"""
+    return max_workers or ((os.cpu_count() or 1) if backend=="processes" else 4)
+
+def make_render_pool(backend:str="threads",max_workers:Optional[int]=None,offline:bool=False)->Executor:
+    """
+    建立產圖用的執行器；可傳給 generate_images_from_records(pool=...) 於多次呼叫間共用，
+    共用時請一併傳 max_workers=render_pool_workers(backend, max_workers) 以決定分塊大小。
+    offline=True 時 processes 的 worker 不經 Pilmoji 抓 emoji 圖源（threads 與本行程共用設定）。
+    """
+    if backend not in RENDER_BACKENDS:
+        raise ValueError(f"未知的產圖後端: {backend}")
+    workers=render_pool_workers(backend,max_workers)
+    if backend=="processes":
+        return ProcessPoolExecutor(max_workers=workers,initializer=_pool_init,initargs=(EMOJI_ATLAS_DIR,offline))
+    return ThreadPoolExecutor(max_workers=workers)
+
+def _render_one(i:int,rec:Dict[str,Any],path:str,template_path:str,avatar_path:Optional[str],
+                force_template:bool,encoding:Optional[Dict[str,Any]],seeded:bool=False)->tuple:
+    """回傳 (i, (path, stats))；失敗時 (i, None)。編碼在 worker 內完成。"""
+    st={}
+    try:
+        generate_image_from_record_template(rec,path,template_path=template_path,
+                                            avatar_path=avatar_path,force_template=force_template,
+                                            encoding=encoding,stats=st,seeded=seeded)
+        return i,(path,st)
+    except Exception as e:
+        print("[ChatGen] 產生失敗", i, e)
+        return i,None
+
+def _render_chunk(jobs:List[tuple],template_path:str,avatar_path:Optional[str],
+                  force_template:bool,encoding:Optional[Dict[str,Any]]=None,seeded:bool=False)->List[tuple]:
+    return [_render_one(i,rec,path,template_path,avatar_path,force_template,encoding,seeded)
+            for i,rec,path in jobs]
+
+def _chunked(jobs:List[tuple],workers:int)->List[List[tuple]]:
+    size=max(1,-(-len(jobs)//(workers*CHUNKS_PER_WORKER)))
+    return [jobs[k:k+size] for k in range(0,len(jobs),size)]
 
 def generate_images_from_records(records:List[Dict[str,Any]],
                                  output_dir:str,
@@ -497,12 +876,33 @@ def generate_images_from_records(records:List[Dict[str,Any]],
                                  template_path:Optional[str]=None,
                                  avatar_path:Optional[str]=None,
                                  force_template:bool=True,
-                                 max_workers:int=4)->List[str]:
+                                 max_workers:Optional[int]=4,
+                                 backend:str="threads",
+                                 pool:Optional[Executor]=None,
+                                 encoding:Optional[Dict[str,Any]]=None,
+                                 stats:Optional[Dict[str,Any]]=None,
+                                 seeded:bool=False,
+                                 manifest:Optional[RenderManifest]=None,
+                                 cancel:Optional[Callable[[],None]]=None)->List[str]:
+    """
+    回傳成功的輸出路徑，順序與 records 相同（檔名序號 = records 順序，從 1 起）。
+    pool 指定時沿用（不關閉），max_workers 應為該 pool 的 worker 數（決定分塊大小）；
+    否則依 backend 建立並於結束時關閉。
+    cancel 指定時每收到一塊結果就呼叫一次；其拋出的例外（如 PipelineCancelled）會取消尚未開始的分塊後往外拋。
+    encoding 見 normalize_encoding（副檔名隨格式）；stats 指定時累加
+    images（實際繪製）/ bytes / reused 及各階段 *_ms（可跨多次呼叫累計，見 summarize_render_stats）。
+    manifest 指定時強制 seeded：指紋與設定未變、舊圖仍在的記錄不重繪，舊圖複製到
+    本次的檔名（output_dir 內仍是完整一批），manifest 改指向新路徑（manifest 由呼叫端 save）。
+    """
     os.makedirs(output_dir,exist_ok=True)
+    if encoding is not None:
+        encoding=normalize_encoding(encoding)
+    ext=IMAGE_EXTS[encoding["format"]] if encoding else ".png"
+    if stats is not None:
+        stats.setdefault("format",encoding["format"] if encoding else "png")
     if template_path is None:
         template_path=DEFAULT_TEMPLATE_PATH
     timestamp_suffix=datetime.datetime.now().strftime("%Y%m%d%H%M%S") if FILENAME_USE_TIMESTAMP_SUFFIX else ""
-    out_paths=[]
     def _fname(rec, idx):
         direction=(rec.get("direction") or "in").lower()
         pfx=prefix or ("入帳" if direction!="out" else "出帳")
@@ -512,19 +912,95 @@ def generate_images_from_records(records:List[Dict[str,Any]],
         safe=order_no.replace("/","_").replace("\\","_").replace(" ","_").replace(":","")
         name=f"{pfx}_{idx:03d}_{safe}"
         if timestamp_suffix: name+=f"_{timestamp_suffix}"
-        return os.path.join(output_dir,name+".png")
-    def _task(i, rec):
-        path=_fname(rec,i)
-        try:
-            generate_image_from_record_template(rec,path,template_path=template_path,
-                                                avatar_path=avatar_path,force_template=force_template)
-            return path
-        except Exception as e:
-            print("[ChatGen] 產生失敗", i, e)
-            return None
-    with ThreadPoolExecutor(max_workers=max_workers) as pool:
-        futures=[pool.submit(_task,i,r) for i,r in enumerate(records, start=1)]
-        for fut in as_completed(futures):
-            res=fut.result()
-            if res: out_paths.append(res)
-    return out_paths
\ No newline at end of file
+        return os.path.join(output_dir,name+ext)
+    jobs=[(i,rec,_fname(rec,i)) for i,rec in enumerate(records, start=1)]
+    if not jobs:
+        return []
+    results={}
+    fps={}
+    if manifest is not None:
+        seeded=True
+        rkey=_render_key(template_path,avatar_path,encoding)
+        todo=[]
+        for job in jobs:
+            fp=record_fingerprint(job[1])
+            old=manifest.lookup(fp,rkey)
+            if old and _reuse_image(old,job[2]):
+                results[job[0]]=(job[2],None)
+                manifest.record(fp,rkey,job[2],os.path.getsize(job[2]))
+            else:
+                fps[job[0]]=fp
+                todo.append(job)
+        if stats is not None:
+            stats["reused"]=stats.get("reused",0)+len(jobs)-len(todo)
+        if not todo:
+            return [results[i][0] for i,_r,_p in jobs]
+    else:
+        todo=jobs
+    if pool is None and backend=="processes" and len(todo)<PROCESS_MIN_RECORDS:
+        backend="threads"
+    own_pool=pool is None
+    if own_pool:
+        pool=make_render_pool(backend,max_workers)
+        workers=render_pool_workers(backend,max_workers)
+    else:
+        workers=max_workers or 4
+    futures=[]
+    try:
+        futures=[pool.submit(_render_chunk,chunk,template_path,avatar_path,force_template,encoding,seeded)
+                 for chunk in _chunked(todo,workers)]
+        for fut in futures:
+            results.update(fut.result())
+            if cancel: cancel()
+    except BrokenProcessPool as e:
+        # worker 被系統終止 / 無法啟動：剩餘的改在本行程以執行緒補做
+        print("[ChatGen] 行程池中斷，改用執行緒", e)
+        rest=[j for j in todo if j[0] not in results]
+        with ThreadPoolExecutor(max_workers=4) as tp:
+            futures=[tp.submit(_render_chunk,c,template_path,avatar_path,force_template,encoding,seeded)
+                     for c in _chunked(rest,4)]
+            try:
+                for fut in futures:
+                    results.update(fut.result())
+                    if cancel: cancel()
+            except BaseException:
+                for fut in futures: fut.cancel()
+                raise
+    except BaseException:
+        # 取消 / 其他錯誤：尚未開始的分塊不再執行（共用的 pool 不會被關閉，需自行取消）
+        for fut in futures: fut.cancel()
+        raise
+    finally:
+        if own_pool:
+            pool.shutdown(wait=True)
+    if manifest is not None:
+        for i,fp in fps.items():
+            res=results.get(i)
+            if res:
+                manifest.record(fp,rkey,res[0],res[1].get("bytes",0))
+    if stats is not None:
+        for res in results.values():
+            if res and res[1] is not None:
+                st=res[1]
+                stats["images"]=stats.get("images",0)+1
+                for k,v in st.items():
+                    if k=="bytes" or k.endswith("_ms"):
+                        stats[k]=stats.get(k,0)+v
+    return [results[i][0] for i,_r,_p in jobs if results.get(i)]
+
+def summarize_render_stats(stats:Dict[str,Any])->Dict[str,Any]:
+    """
+    累計值 → 每張平均：{"format","images","reused","kb_per_image","render_ms_per_image","encode_ms_per_image"}。
+    images 為實際繪製張數，reused 為沿用舊圖張數（平均值只計繪製者）。
+    """
+    n=stats.get("images",0)
+    if not n:
+        return {"format":stats.get("format"),"images":0,"reused":stats.get("reused",0)}
+    return {
+        "format":stats.get("format"),
+        "images":n,
+        "reused":stats.get("reused",0),
+        "kb_per_image":round(stats["bytes"]/n/1024,1),
+        "render_ms_per_image":round(stats["render_ms"]/n,1),
+        "encode_ms_per_image":round(stats["encode_ms"]/n,1),
+    }
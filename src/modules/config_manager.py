@@ -12,7 +12,8 @@ _DEFAULT_CONFIG = {
     "woo_consumer_secret": "",
     "woo_fee_product_id": 30977,
     "woo_test_mode": True,
-    "woo_batch_size": 200,
+    "woo_batch_size": 100,  # /orders/batch 單次上限 100
+    "woo_use_batch_endpoint": False,  # True: 以 /orders/batch 每次最多 100 筆建立
     "woo_timeout": 15,
 
     "disable_single_instance": False,
@@ -21,11 +22,38 @@ _DEFAULT_CONFIG = {
     "single_instance_max_age_hours": 12,
 
     "woo_remote_dup_scan_limit": 200,
+    # 遠端指紋本機索引（增量同步；關閉時退回只掃最新 woo_remote_dup_scan_limit 筆）
+    "woo_fingerprint_index": True,
+    "woo_fingerprint_index_path": "db/woo_fingerprints.db",
+    "woo_sync_workers": 4,
     "woo_set_created_time": True,
     "woo_parallel_workers": 6,
+    "woo_upload_engine": "threads",  # threads | async（AIMD 自適應併發）
+    "woo_async_max_concurrency": 32,
+    "woo_http2": False,          # 需安裝 httpx[http2]
+    "woo_gzip_requests": False,  # 站台需支援 Content-Encoding: gzip 請求
+    "woo_http_timing": True,
+    # 持久化 outbox：中斷後下次執行續傳，in_flight 項目先與遠端指紋對帳再決定是否重送
+    "woo_durable_outbox": True,
+    "woo_outbox_path": "db/woo_outbox.db",
+    "woo_outbox_max_attempts": 5,
+    "pipeline_workers": 3,  # run_selected_tasks 可並行的步驟數
+    "startup_target_ms": 1500,  # startup_report：main.py 開始到視窗出現的目標
+    "chat_image_backend": "processes",  # processes | threads（聊天圖產生的並行方式）
+    "chat_image_workers": 0,    # 0 = processes 用 CPU 核心數、threads 用 4
+    "chat_image_format": "png",  # png | jpeg | webp
+    "chat_image_quality": 90,    # jpeg / webp
+    "chat_image_png_compress_level": 3,  # 0~9，越低越快、檔案越大
+    "chat_image_optimize": False,
+    "chat_image_quantize_colors": 0,     # >0 時轉為該色數調色盤（png / webp）
+    "chat_image_seeded": True,   # 以記錄指紋播種：同一筆記錄每次產出相同圖片
+    "chat_image_skip_unchanged": False,  # 依 manifest 略過已產出且未變更的記錄
+    "chat_image_manifest_path": "cache/chat_image_manifest.json",
+    "emoji_atlas_dir": "cache/emoji_atlas",  # 聊天圖 emoji 點陣圖集；空字串表示只用記憶體快取
 
     # 新增：更新檢查的 manifest URL（請換成你實際 Raw 連結）
-    "update_manifest_url": "https://raw.githubusercontent.com/NooJDog/excel-auto-app-update/main/manifest.json"
+    "update_manifest_url": "https://raw.githubusercontent.com/NooJDog/excel-auto-app-update/main/manifest.json",
+    "update_download_workers": 4,  # 完整更新包分段並行數 / 增量更新同時下載的檔案數；1 = 單線（仍可續傳）
 }
 
 class ConfigManager:
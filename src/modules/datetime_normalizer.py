@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""
+共用日期時間正規化
+- 以正則判斷字串「形狀」決定格式，不靠 strptime 例外逐一嘗試
+- 整欄解析：每欄只推斷一次格式，之後以 pandas 向量化 to_datetime
+- 格式決定依來源模板 (template_key + 欄位名) 快取，下一個同模板檔案直接沿用
+- 只有推斷失敗的少數值才走逐筆 fallback
+"""
+
+import re
+import datetime
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+OUTPUT_FORMAT = "%Y-%m-%d %H:%M:%S"
+LOCAL_TZ = datetime.timezone(datetime.timedelta(hours=8))
+
+# (形狀正則, strptime 格式)；順序 = 優先權
+_FORMAT_SHAPES: List[Tuple[re.Pattern, str]] = [
+    (re.compile(r"^\d{4}-\d{1,2}-\d{1,2} \d{1,2}:\d{2}:\d{2}$"), "%Y-%m-%d %H:%M:%S"),
+    (re.compile(r"^\d{4}/\d{1,2}/\d{1,2} \d{1,2}:\d{2}:\d{2}$"), "%Y/%m/%d %H:%M:%S"),
+    (re.compile(r"^\d{4}-\d{1,2}-\d{1,2}T\d{1,2}:\d{2}:\d{2}$"), "%Y-%m-%dT%H:%M:%S"),
+    (re.compile(r"^\d{4}-\d{1,2}-\d{1,2} \d{1,2}:\d{2}:\d{2}\.\d{1,6}$"), "%Y-%m-%d %H:%M:%S.%f"),
+    (re.compile(r"^\d{4}-\d{1,2}-\d{1,2} \d{1,2}:\d{2}$"), "%Y-%m-%d %H:%M"),
+    (re.compile(r"^\d{4}/\d{1,2}/\d{1,2} \d{1,2}:\d{2}$"), "%Y/%m/%d %H:%M"),
+    (re.compile(r"^\d{4}-\d{1,2}-\d{1,2}$"), "%Y-%m-%d"),
+    (re.compile(r"^\d{4}/\d{1,2}/\d{1,2}$"), "%Y/%m/%d"),
+    (re.compile(r"^\d{1,2}:\d{2}:\d{2}$"), "%H:%M:%S"),
+    (re.compile(r"^\d{1,2}:\d{2}$"), "%H:%M"),
+]
+TIME_ONLY_FORMATS = {"%H:%M:%S", "%H:%M"}
+_LOOSE_TIME = re.compile(r"([0-2]?\d):([0-5]\d)")
+
+# 欄位推斷取樣數
+INFER_SAMPLE_SIZE = 20
+
+# {(template_key, column): fmt or None}
+_TEMPLATE_FORMAT_CACHE: Dict[Tuple[str, str], Optional[str]] = {}
+_CACHE_LOCK = threading.Lock()
+
+
+def clear_format_cache():
+    with _CACHE_LOCK:
+        _TEMPLATE_FORMAT_CACHE.clear()
+
+
+def template_key_for(columns: Iterable[Any]) -> str:
+    """同一種報表模板 → 同一組欄位 → 同一把 key。"""
+    return "|".join(str(c).strip() for c in columns)
+
+
+def detect_format(value: str) -> Optional[str]:
+    """依字串形狀回傳 strptime 格式；無法判斷回傳 None（不丟例外）。"""
+    for shape, fmt in _FORMAT_SHAPES:
+        if shape.match(value):
+            return fmt
+    return None
+
+
+def infer_format(samples: Iterable[Any]) -> Optional[str]:
+    """
+    取樣本推斷整欄格式：回傳最多樣本符合的格式；
+    樣本中超過一半無法判斷時回傳 None（交給 pandas 自動判斷）。
+    """
+    counts: Dict[str, int] = {}
+    total = 0
+    for v in samples:
+        s = "" if v is None else str(v).strip()
+        if not s or s in ("nan", "NaT", "None"):
+            continue
+        total += 1
+        fmt = detect_format(s)
+        if fmt:
+            counts[fmt] = counts.get(fmt, 0) + 1
+        if total >= INFER_SAMPLE_SIZE:
+            break
+    if not counts:
+        return None
+    fmt, hit = max(counts.items(), key=lambda kv: kv[1])
+    return fmt if hit * 2 >= total else None
+
+
+# ---------------- 單值 API ----------------
+def parse_one(raw: Any, allow_time_only: bool = False) -> Optional[datetime.datetime]:
+    """
+    單值解析；依形狀判斷格式後只做一次 strptime，最後才 fromisoformat。
+    allow_time_only=True 時，「HH:MM(:SS)」會接上今天日期。
+    失敗回傳 None。
+    """
+    if raw is None:
+        return None
+    if isinstance(raw, datetime.datetime):
+        return raw
+    s = str(raw).strip()
+    if not s:
+        return None
+    fmt = detect_format(s)
+    if fmt:
+        if fmt in TIME_ONLY_FORMATS and not allow_time_only:
+            return None
+        try:
+            dt = datetime.datetime.strptime(s, fmt)
+        except ValueError:
+            dt = None
+        if dt is not None:
+            if fmt in TIME_ONLY_FORMATS:
+                dt = datetime.datetime.combine(datetime.date.today(), dt.time())
+            return dt
+    # 罕見路徑
+    try:
+        return datetime.datetime.fromisoformat(s)
+    except ValueError:
+        pass
+    if allow_time_only:
+        m = _LOOSE_TIME.search(s)
+        if m:
+            today = datetime.date.today()
+            return datetime.datetime(today.year, today.month, today.day,
+                                     int(m.group(1)) % 24, int(m.group(2)), 0)
+    return None
+
+
+def to_local_iso(raw: Any) -> str:
+    """轉 +08:00 ISO 字串；無法解析時原樣回傳（由伺服端再解析）。"""
+    if raw is None:
+        return ""
+    s = str(raw).strip()
+    if not s:
+        return ""
+    dt = parse_one(s)
+    if dt is None:
+        return s
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=LOCAL_TZ)
+    return dt.isoformat()
+
+
+# ---------------- 整欄 API (pandas) ----------------
+def parse_series(series, template_key: Optional[str] = None):
+    """
+    整欄解析為 datetime64 Series（無法解析者為 NaT）。
+    template_key 相同的來源沿用已快取的格式決定。
+    """
+    import pandas as pd
+
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series
+    text = series.where(series.notna(), "").astype(str).str.strip()
+
+    cache_key = (template_key, str(series.name)) if template_key is not None else None
+    if cache_key is not None and cache_key in _TEMPLATE_FORMAT_CACHE:
+        fmt = _TEMPLATE_FORMAT_CACHE[cache_key]
+    else:
+        fmt = infer_format(text.head(INFER_SAMPLE_SIZE * 3))
+        if cache_key is not None:
+            with _CACHE_LOCK:
+                _TEMPLATE_FORMAT_CACHE[cache_key] = fmt
+
+    blank = text.isin(("", "nan", "NaT", "None"))
+    if fmt and fmt not in TIME_ONLY_FORMATS:
+        parsed = pd.to_datetime(text, format=fmt, errors="coerce")
+    else:
+        parsed = pd.Series(pd.NaT, index=text.index, dtype="datetime64[ns]")
+
+    # 少數不符推斷格式的值才走 fallback
+    missing = parsed.isna() & ~blank
+    if missing.any():
+        parsed.loc[missing] = pd.to_datetime(text[missing], errors="coerce", format="mixed")
+    return parsed
+
+
+def format_series(series, out_fmt: str = OUTPUT_FORMAT,
+                  template_key: Optional[str] = None):
+    """
+    整欄轉固定字串格式；空值 → ""，無法解析 → 原字串（去空白）。
+    """
+    parsed = parse_series(series, template_key=template_key)
+    text = series.where(series.notna(), "").astype(str).str.strip()
+    text = text.mask(text.isin(("nan", "NaT", "None")), "")
+    out = parsed.dt.strftime(out_fmt)
+    return out.where(parsed.notna(), text).astype(object)
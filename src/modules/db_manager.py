@@ -126,4 +126,23 @@ class DBManager:
                 woo_tx_fingerprint=COALESCE(woo_tx_fingerprint,?)
             WHERE id=?
         """,(status,order_id,error,ts,pj,attempts,fingerprint,record_id))
-        self.conn.commit()
\ No newline at end of file
+        self.conn.commit()
+
+
+def clear_all_transactions(db_path):
+    """清空 transactions；成功（或無檔案）回傳 None，失敗回傳錯誤訊息，由呼叫端寫入日誌。"""
+    if db_path == ":memory:":
+        return None
+    if not os.path.exists(db_path):
+        return None
+    conn = sqlite3.connect(db_path)
+    cur = conn.cursor()
+    try:
+        cur.execute("CREATE TABLE IF NOT EXISTS transactions (id INTEGER PRIMARY KEY AUTOINCREMENT)")
+        cur.execute("DELETE FROM transactions")
+        conn.commit()
+    except Exception as e:
+        return f"清空交易紀錄失敗: {e}"
+    finally:
+        conn.close()
+    return None
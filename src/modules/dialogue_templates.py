@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+對話模板延遲載入
+- product_dialogues（約 5,500 行的字面資料）在第一次產生圖片時才 import，
+  啟動 / 只跑報表或上傳時不付出解析與建構成本
+- import 寫在函式內（非 importlib 字串），PyInstaller 仍能靜態偵測並打包
+- 預編譯：每句模板只解析一次成片段 ("text", 字串) / ("emoji", cluster) / ("slot", 占位符)，
+  產圖時只代入占位值，不再逐句 str.format 與跑 emoji 正則
+"""
+
+import re
+import json
+import string
+import hashlib
+import threading
+from functools import lru_cache
+from typing import Dict, List, Tuple
+
+_lock = threading.Lock()
+_template_map = None
+_compiled: Dict[Tuple[str, str], List[List[Tuple[str, tuple]]]] = {}
+_digest = None
+
+SLOT_KEYS = ("buyer", "amount", "time", "item_name", "goods_name")
+_SLOT_RE = re.compile(r"\{(" + "|".join(SLOT_KEYS) + r")\}")
+
+# ===== Emoji Cluster Regex (含 VS-16 / ZWJ) =====
+EMOJI_CLUSTER_PATTERN = re.compile(
+    "("
+    "["
+    "\U0001F300-\U0001F6FF"
+    "\U0001F900-\U0001FAFF"
+    "\U0001F1E6-\U0001F1FF"
+    "\U00002700-\U000027BF"
+    "\U00002600-\U000026FF"
+    "\U00002300-\U0000237F"
+    "\U00002000-\U000020FF"
+    "]"
+    "(?:\uFE0F)?"
+    "(?:\u200D(?:["
+    "\U0001F300-\U0001F6FF"
+    "\U0001F900-\U0001FAFF"
+    "\U0001F1E6-\U0001F1FF"
+    "\U00002700-\U000027BF"
+    "\U00002600-\U000026FF"
+    "\U00002300-\U0000237F"
+    "\U00002000-\U000020FF"
+    "](?:\uFE0F)?))*"
+    ")"
+)
+
+
+def split_clusters(line: str) -> List[tuple]:
+    """回傳 [(kind, text)] kind in {'text','emoji'}"""
+    parts = []
+    last = 0
+    for m in EMOJI_CLUSTER_PATTERN.finditer(line):
+        st, en = m.start(), m.end()
+        if st > last:
+            parts.append(("text", line[last:st]))
+        parts.append(("emoji", line[st:en]))
+        last = en
+    if last < len(line):
+        parts.append(("text", line[last:]))
+    return parts
+
+
+def _load() -> Dict[str, Dict[str, List[List[dict]]]]:
+    global _template_map
+    if _template_map is None:
+        with _lock:
+            if _template_map is None:
+                import product_dialogues
+                _template_map = product_dialogues.TEMPLATE_MAP
+    return _template_map
+
+
+def is_loaded() -> bool:
+    return _template_map is not None
+
+
+def get_templates(product_type: str, direction: str):
+    """
+    product_type: game_currency / game_item / used_goods
+    direction: 'in' or 'out'
+    """
+    _load()
+    import product_dialogues
+    return product_dialogues.get_templates(product_type, direction)
+
+
+def _parse_slots(text: str) -> List[tuple]:
+    """
+    拆成 [("lit", 字串) / ("slot", key, 格式碼, 轉換)]，語意與舊的 str.format(**data) 相同：
+    能 format 時 {{ }} 視為跳脫；format 會失敗（未知 / 位置欄位、語法錯誤）時比照舊 fallback，
+    只替換已知的 {key}，其餘原樣保留。
+    """
+    try:
+        parsed = list(string.Formatter().parse(text))
+        if all(f is None or f in SLOT_KEYS for _lit, f, _spec, _conv in parsed):
+            out = []
+            for lit, field, spec, conv in parsed:
+                if lit:
+                    out.append(("lit", lit))
+                if field is not None:
+                    out.append(("slot", field, spec or "", conv))
+            return out
+    except ValueError:
+        pass
+    out = []
+    last = 0
+    for m in _SLOT_RE.finditer(text):
+        if m.start() > last:
+            out.append(("lit", text[last:m.start()]))
+        out.append(("slot", m.group(1), "", None))
+        last = m.end()
+    if last < len(text):
+        out.append(("lit", text[last:]))
+    return out
+
+
+@lru_cache(maxsize=8192)
+def compile_text(text: str) -> tuple:
+    """模板字串 → 片段 tuple；靜態文字已先切好 emoji cluster，占位符為 ("slot", key, 格式碼, 轉換)。"""
+    segs = []
+    for part in _parse_slots(text):
+        if part[0] == "slot":
+            segs.append(part)
+        else:
+            segs.extend(split_clusters(part[1]))
+    return tuple(segs)
+
+
+@lru_cache(maxsize=4096)
+def split_value(value: str) -> tuple:
+    """占位值（暱稱 / 金額 / 時間…）的 cluster 切分；同一值在批次中大量重複，快取即可。"""
+    return tuple(split_clusters(value))
+
+
+def compile_preset(preset: List[dict]) -> List[Tuple[str, tuple]]:
+    return [(m.get("role", "left"), compile_text(m.get("text", ""))) for m in preset]
+
+
+def get_compiled_templates(product_type: str, direction: str) -> List[List[Tuple[str, tuple]]]:
+    """與 get_templates 相同順序的預編譯版本：每組對話為 [(role, segments)]。"""
+    key = (product_type, direction)
+    comp = _compiled.get(key)
+    if comp is None:
+        comp = [compile_preset(p) for p in get_templates(product_type, direction)]
+        _compiled[key] = comp
+    return comp
+
+
+def templates_digest() -> str:
+    """全部預編譯模板的雜湊（產圖 manifest 用）：對話模板內容有任何更動即改變。同一行程內只計算一次。"""
+    global _digest
+    if _digest is None:
+        tm = _load()
+        comp = {f"{pt}/{d}": get_compiled_templates(pt, d) for pt in sorted(tm) for d in sorted(tm[pt])}
+        _digest = hashlib.sha256(json.dumps(comp, ensure_ascii=False, sort_keys=True)
+                                 .encode("utf-8")).hexdigest()[:16]
+    return _digest
+
+
+def _slot_value(seg: tuple, values: Dict[str, str]) -> str:
+    _kind, key, spec, conv = seg
+    if key not in values:
+        return "{" + key + "}"
+    v = values[key]
+    if conv == "r":
+        v = repr(v)
+    elif conv == "a":
+        v = ascii(v)
+    try:
+        return format(v, spec) if spec else str(v)
+    except (ValueError, TypeError):
+        # 格式碼不適用於該值：與舊 fallback 相同，保留原占位符
+        return "{" + key + ("!" + conv if conv else "") + (":" + spec if spec else "") + "}"
+
+
+def expand_segments(segments: tuple, values: Dict[str, str]) -> List[tuple]:
+    """
+    代入占位值，回傳與 split_clusters(格式化後字串) 相同的 [(kind, text)]；
+    相鄰文字片段合併，換行時的斷詞與逐句 format 的結果一致。
+    """
+    out = []
+    for seg in segments:
+        if seg[0] == "slot":
+            parts = split_value(_slot_value(seg, values))
+        else:
+            parts = (seg,)
+        for p in parts:
+            if p[0] == "text" and out and out[-1][0] == "text":
+                out[-1] = ("text", out[-1][1] + p[1])
+            else:
+                out.append(p)
+    return out
@@ -0,0 +1,365 @@
+# -*- coding: utf-8 -*-
+"""
+可續傳的下載引擎（更新包用）
+- 暫存為 <dest>.part，完成並校驗後才 os.replace 成 dest
+- 中斷後以 HTTP Range 續傳（If-Range 帶 ETag / Last-Modified，伺服器檔案變了就從頭）；
+  同一次呼叫內的斷線自動重試並從斷點接續
+- 伺服器支援 Range 且檔案夠大時，可分成多段並行下載；進度存在 <dest>.part.json，跨次執行也能續傳
+- SHA-256 邊下載邊計算：單線時直接累加收到的資料；多段時由一個執行緒依序讀取已連續完成的前段
+  （剛寫入的資料仍在快取中），下載結束即有雜湊，不必再整檔讀一遍
+- 讀取緩衝依速度自動調整（64 KB ~ 1 MB）
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+from typing import Callable, Dict, List, Optional
+
+import requests
+from urllib3.exceptions import HTTPError as _Urllib3Error
+
+MIN_BUFFER = 64 * 1024
+MAX_BUFFER = 1024 * 1024
+PARALLEL_MIN_SIZE = 4 * 1024 * 1024   # 小於此大小不分段
+MAX_RETRIES = 5
+RETRY_BACKOFF = 1.0                   # 秒，逐次加倍
+STATE_SAVE_INTERVAL = 0.5
+# 串流讀取 r.raw 時斷線拋的是 urllib3 例外，不會被包成 requests 例外
+_NET_ERRORS = (requests.RequestException, _Urllib3Error, OSError)
+
+
+class DownloadError(RuntimeError):
+    pass
+
+
+class _RangeUnsupported(DownloadError):
+    """分段請求沒有得到 206：改以單線從頭下載。"""
+
+
+class _AdaptiveBuffer:
+    """一次讀取很快就回來 → 加大緩衝；很慢 → 縮小，讓進度回報與斷線損失都維持合理。"""
+
+    def __init__(self):
+        self.size = MIN_BUFFER
+
+    def update(self, elapsed: float):
+        if elapsed < 0.05 and self.size < MAX_BUFFER:
+            self.size = min(self.size * 2, MAX_BUFFER)
+        elif elapsed > 0.5 and self.size > MIN_BUFFER:
+            self.size = max(self.size // 2, MIN_BUFFER)
+
+
+def _validator(headers) -> Dict[str, Optional[str]]:
+    return {"etag": headers.get("ETag"), "last_modified": headers.get("Last-Modified")}
+
+
+def _if_range(state: Dict) -> Optional[str]:
+    etag = state.get("etag")
+    if etag and not etag.startswith("W/"):
+        return etag
+    return state.get("last_modified")
+
+
+def _sha256_prefix(path: str, length: int, h) -> None:
+    with open(path, "rb") as f:
+        left = length
+        while left > 0:
+            buf = f.read(min(MAX_BUFFER, left))
+            if not buf:
+                raise DownloadError("暫存檔比記錄的進度短")
+            h.update(buf)
+            left -= len(buf)
+
+
+class Downloader:
+    def __init__(self, session: Optional[requests.Session] = None, timeout: float = 30,
+                 max_retries: int = MAX_RETRIES, parallel: int = 1):
+        self.session = session or requests.Session()
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.parallel = max(1, int(parallel))
+
+    # ---- 共用 ----
+    def _probe(self, url: str) -> Dict:
+        """HEAD 取得大小 / 是否支援 Range / 驗證標記；失敗時回傳空資訊（改走單線）。"""
+        try:
+            r = self.session.head(url, allow_redirects=True, timeout=self.timeout)
+            if r.status_code >= 400:
+                return {}
+            size = int(r.headers.get("Content-Length") or 0) or None
+            return {"size": size, "ranges": r.headers.get("Accept-Ranges", "").lower() == "bytes",
+                    **_validator(r.headers)}
+        except requests.RequestException:
+            return {}
+
+    def _load_state(self, state_path: str, url: str) -> Optional[Dict]:
+        try:
+            with open(state_path, "r", encoding="utf-8") as f:
+                st = json.load(f)
+            return st if st.get("url") == url else None
+        except (OSError, ValueError):
+            return None
+
+    def _save_state(self, state_path: str, state: Dict):
+        tmp = state_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp, state_path)
+
+    def _retry_wait(self, attempt: int, err: Exception):
+        if attempt >= self.max_retries:
+            raise DownloadError(f"下載失敗（已重試 {self.max_retries} 次）: {err}") from err
+        time.sleep(RETRY_BACKOFF * (2 ** (attempt - 1)))
+
+    # ---- 入口 ----
+    def download(self, url: str, dest: str, expect_sha256: Optional[str] = None,
+                 on_progress: Optional[Callable[[int, Optional[int]], None]] = None,
+                 probe: bool = True) -> Dict:
+        """
+        下載到 dest；on_progress(已下載位元組, 總位元組或 None)。
+        probe=False 時不送 HEAD（小檔省一次往返）：一律單線，續傳改靠 If-Range 與 SHA-256 把關。
+        回傳 {"path", "bytes", "sha256", "resumed_from", "parts"}；校驗失敗拋 DownloadError（暫存檔刪除）。
+        """
+        part = dest + ".part"
+        state_path = part + ".json"
+        os.makedirs(os.path.dirname(os.path.abspath(dest)), exist_ok=True)
+        info = self._probe(url) if probe else {}
+        state = self._load_state(state_path, url) if os.path.exists(part) else None
+        if state and info and (state.get("size") != info.get("size") or
+                               (info.get("etag") and state.get("etag") != info.get("etag"))):
+            state = None   # 伺服器上的檔案已換，從頭下載
+        if state is None:
+            for p in (part, state_path):
+                try: os.remove(p)
+                except OSError: pass
+
+        size = info.get("size")
+        use_parallel = (self.parallel > 1 and info.get("ranges") and size and size >= PARALLEL_MIN_SIZE)
+        if state and state.get("parts") and len(state["parts"]) > 1:
+            use_parallel = True
+        res = None
+        if use_parallel:
+            try:
+                res = self._download_parallel(url, part, state_path, info, state, on_progress)
+            except _RangeUnsupported:
+                for p in (part, state_path):
+                    try: os.remove(p)
+                    except OSError: pass
+                state = None
+        if res is None:
+            res = self._download_single(url, part, state_path, info, state, on_progress)
+
+        if expect_sha256 and res["sha256"] != expect_sha256.lower():
+            for p in (part, state_path):
+                try: os.remove(p)
+                except OSError: pass
+            raise DownloadError("SHA256 校驗失敗")
+        os.replace(part, dest)
+        try: os.remove(state_path)
+        except OSError: pass
+        res["path"] = dest
+        return res
+
+    # ---- 單線（可續傳）----
+    def _download_single(self, url, part, state_path, info, state, on_progress) -> Dict:
+        h = hashlib.sha256()
+        have = os.path.getsize(part) if (state and os.path.exists(part)) else 0
+        resumed_from = have
+        if have:
+            _sha256_prefix(part, have, h)
+        state = state or {"url": url, "size": info.get("size"), "etag": info.get("etag"),
+                          "last_modified": info.get("last_modified"), "parts": [[0, None, 0]]}
+        total = state.get("size")
+        buf = _AdaptiveBuffer()
+        attempt = 0
+        last_save = 0.0
+        while True:
+            headers = {"Accept-Encoding": "identity"}
+            if have:
+                headers["Range"] = f"bytes={have}-"
+                ir = _if_range(state)
+                if ir:
+                    headers["If-Range"] = ir
+            try:
+                with self.session.get(url, headers=headers, stream=True, timeout=self.timeout) as r:
+                    if r.status_code == 416 and total and have >= total:
+                        break
+                    r.raise_for_status()
+                    if have and r.status_code != 206:
+                        # 伺服器不接受續傳 / 檔案已變：從頭來
+                        have = 0
+                        h = hashlib.sha256()
+                        resumed_from = 0
+                    if not have:
+                        state.update(_validator(r.headers))
+                        cl = r.headers.get("Content-Length")
+                        total = state["size"] = int(cl) if cl and r.status_code == 200 else total
+                    with open(part, "r+b" if have else "wb") as f:
+                        f.seek(have)
+                        f.truncate()
+                        it = r.raw
+                        while True:
+                            t = time.perf_counter()
+                            chunk = it.read(buf.size, decode_content=False)
+                            buf.update(time.perf_counter() - t)
+                            if not chunk:
+                                break
+                            f.write(chunk)
+                            h.update(chunk)
+                            have += len(chunk)
+                            attempt = 0
+                            if on_progress:
+                                on_progress(have, total)
+                            now = time.monotonic()
+                            if now - last_save > STATE_SAVE_INTERVAL:
+                                f.flush()
+                                state["parts"] = [[0, None, have]]
+                                self._save_state(state_path, state)
+                                last_save = now
+                if total and have < total:
+                    raise DownloadError(f"連線中斷（{have}/{total}）")
+                break
+            except (DownloadError,) + _NET_ERRORS as e:
+                if isinstance(e, requests.HTTPError) and e.response is not None and e.response.status_code < 500:
+                    raise DownloadError(f"HTTP {e.response.status_code}: {url}") from e
+                state["parts"] = [[0, None, have]]
+                try: self._save_state(state_path, state)
+                except OSError: pass
+                attempt += 1
+                self._retry_wait(attempt, e)
+        return {"bytes": have, "sha256": h.hexdigest().lower(), "resumed_from": resumed_from, "parts": 1}
+
+    # ---- 多段並行 ----
+    def _download_parallel(self, url, part, state_path, info, state, on_progress) -> Dict:
+        size = (state or info)["size"]
+        if state is None:
+            n = self.parallel
+            step = -(-size // n)
+            parts = [[i * step, min(size, (i + 1) * step), 0] for i in range(n) if i * step < size]
+            state = {"url": url, "size": size, "etag": info.get("etag"),
+                     "last_modified": info.get("last_modified"), "parts": parts}
+            with open(part, "wb") as f:
+                f.truncate(size)
+            self._save_state(state_path, state)
+        parts: List[List[int]] = state["parts"]
+        resumed_from = sum(p[2] for p in parts)
+        lock = threading.Lock()
+        progressed = threading.Condition(lock)
+        errors: List[Exception] = []
+        finished = [False]
+
+        def downloaded() -> int:
+            return sum(p[2] for p in parts)
+
+        def contiguous() -> int:
+            pos = 0
+            for start, end, done in parts:
+                if start != pos:
+                    break
+                pos = start + done
+                if start + done < end:
+                    break
+            return pos
+
+        def worker(idx: int):
+            start, end, _ = parts[idx]
+            buf = _AdaptiveBuffer()
+            attempt = 0
+            with open(part, "r+b") as f:
+                while parts[idx][2] < end - start:
+                    if errors:
+                        return
+                    pos = start + parts[idx][2]
+                    headers = {"Range": f"bytes={pos}-{end - 1}", "Accept-Encoding": "identity"}
+                    ir = _if_range(state)
+                    if ir:
+                        headers["If-Range"] = ir
+                    try:
+                        with self.session.get(url, headers=headers, stream=True, timeout=self.timeout) as r:
+                            r.raise_for_status()
+                            if r.status_code != 206:
+                                raise _RangeUnsupported("伺服器不支援分段或檔案已變更")
+                            f.seek(pos)
+                            while pos < end:
+                                t = time.perf_counter()
+                                chunk = r.raw.read(min(buf.size, end - pos), decode_content=False)
+                                buf.update(time.perf_counter() - t)
+                                if not chunk:
+                                    break
+                                f.write(chunk)
+                                f.flush()   # 雜湊執行緒以另一個檔案物件讀取，進度更新前資料須已寫入
+                                pos += len(chunk)
+                                attempt = 0
+                                with lock:
+                                    parts[idx][2] = pos - start
+                                    progressed.notify_all()
+                        if pos < end:
+                            raise DownloadError(f"分段 {idx} 連線中斷")
+                    except _RangeUnsupported as e:
+                        errors.append(e)
+                        return
+                    except (DownloadError,) + _NET_ERRORS as e:
+                        attempt += 1
+                        try:
+                            self._retry_wait(attempt, e)
+                        except DownloadError as fatal:
+                            errors.append(fatal)
+                            return
+
+        h = hashlib.sha256()
+        hashed = [0]
+
+        def hasher():
+            # 不經緩衝：BufferedReader 的預讀會留住尚未寫入的區段（全為 0）
+            with open(part, "rb", buffering=0) as f:
+                while True:
+                    with lock:
+                        while contiguous() <= hashed[0] and not finished[0] and not errors:
+                            progressed.wait(0.5)
+                        limit = contiguous()
+                        if limit <= hashed[0] and (finished[0] or errors):
+                            return
+                    f.seek(hashed[0])
+                    while hashed[0] < limit:
+                        buf = f.read(min(MAX_BUFFER, limit - hashed[0]))
+                        if not buf:
+                            break
+                        h.update(buf)
+                        hashed[0] += len(buf)
+
+        threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(len(parts))]
+        hthread = threading.Thread(target=hasher, daemon=True)
+        for t in threads:
+            t.start()
+        hthread.start()
+        last_save = 0.0
+        while any(t.is_alive() for t in threads):
+            time.sleep(0.1)
+            if on_progress:
+                on_progress(downloaded(), size)
+            now = time.monotonic()
+            if now - last_save > STATE_SAVE_INTERVAL:
+                with lock:
+                    self._save_state(state_path, state)
+                last_save = now
+        with lock:
+            finished[0] = True
+            progressed.notify_all()
+            self._save_state(state_path, state)
+        hthread.join()
+        if errors:
+            raise errors[0]
+        if on_progress:
+            on_progress(downloaded(), size)
+        if hashed[0] != size:
+            raise DownloadError("分段下載未完成")
+        return {"bytes": size, "sha256": h.hexdigest().lower(), "resumed_from": resumed_from, "parts": len(parts)}
+
+
+def download_file(url: str, dest: str, expect_sha256: Optional[str] = None,
+                  on_progress: Optional[Callable[[int, Optional[int]], None]] = None,
+                  parallel: int = 1, timeout: float = 30, session: Optional[requests.Session] = None) -> Dict:
+    return Downloader(session=session, timeout=timeout, parallel=parallel).download(
+        url, dest, expect_sha256, on_progress)
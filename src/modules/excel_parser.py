@@ -6,6 +6,8 @@ from typing import List, Optional, Dict, Any
 
 import pandas as pd
 
+from modules.amount_normalizer import parse_amount, parse_amount_series
+
 try:
     import xlrd  # 需要 xlrd==1.2.0 以支援 .xls
 except ImportError:
@@ -44,22 +46,7 @@ AMOUNT_REGEX = re.compile(r"-?\d+(?:\.\d+)?")
 
 # ---------------- 工具函式 ----------------
 def _normalize_amount(val):
-    if pd.isna(val):
-        return None
-    s = str(val).strip()
-    if not s:
-        return None
-    neg = False
-    if s.startswith("(") and s.endswith(")"):
-        neg = True
-        s = s[1:-1]
-    s = (s.replace(",","").replace("，","").replace("$","")
-            .replace("NT$","").replace("元","").replace(" ",""))
-    m = re.search(r"-?\d+(?:\.\d+)?", s)
-    if not m:
-        return None
-    v = float(m.group(0))
-    return -v if neg else v
+    return parse_amount(val)
 
 def _find_first_col(cols: List[str], candidates: List[str]) -> Optional[str]:
     cols_norm = [c.strip() for c in cols]
@@ -337,8 +324,15 @@ class ExcelParser:
         apply_time_col = _find_first_col(cols, APPLY_TIME_CANDIDATES)
         finish_time_col= _find_first_col(cols, FINISH_TIME_CANDIDATES)
 
+        # 金額候選欄位整欄先正規化（向量化），逐列只取值
+        amount_cols = {
+            c: parse_amount_series(df[c])
+            for c in dict.fromkeys(IN_AMOUNT_CANDIDATES + OUT_AMOUNT_CANDIDATES)
+            if c in cols
+        }
+
         raw_rows = []
-        for _, row in df.iterrows():
+        for idx, row in df.iterrows():
             if not _is_effective_row(row):
                 continue
 
@@ -346,19 +340,19 @@ class ExcelParser:
             in_val = out_val = None
             if is_payout:
                 for c in OUT_AMOUNT_CANDIDATES:
-                    if c in cols:
-                        v = _normalize_amount(row.get(c))
+                    if c in amount_cols:
+                        v = amount_cols[c].at[idx]
                         if v and v > 0:
                             out_val = v; break
             else:
                 for c in IN_AMOUNT_CANDIDATES:
-                    if c in cols:
-                        v = _normalize_amount(row.get(c))
+                    if c in amount_cols:
+                        v = amount_cols[c].at[idx]
                         if v and v > 0:
                             in_val = v; break
                 for c in OUT_AMOUNT_CANDIDATES:
-                    if c in cols:
-                        v = _normalize_amount(row.get(c))
+                    if c in amount_cols:
+                        v = amount_cols[c].at[idx]
                         if v and v > 0:
                             out_val = v; break
 
@@ -2,6 +2,8 @@ import os
 import pandas as pd
 import datetime
 
+from modules.amount_normalizer import parse_amount_series
+
 # -------------------------------
 # 安全讀取：支援 .csv / .xlsx / .xls
 # .xls -> engine='xlrd'
@@ -87,12 +89,7 @@ def normalize_and_extract(df, mapping):
     income_col = mapping.get("收入金額")
     if not income_col:
         return pd.DataFrame()
-    s = (df[income_col].astype(str)
-         .str.replace(",", "")
-         .str.replace("$", "")
-         .str.replace("NT$", "")
-         .str.strip())
-    nums = pd.to_numeric(s, errors="coerce").fillna(0)
+    nums = parse_amount_series(df[income_col]).fillna(0)
     df["_收入數字"] = nums
     df_income = df[df["_收入數字"] > 0].copy()
     if df_income.empty:
@@ -0,0 +1,22 @@
+from typing import Dict, Any, Callable
+
+from modules.upload_worker import UploadWorker
+from modules.task_pipeline import Pipeline, CancelToken
+
+
+class PipelineWorker(UploadWorker):
+    """在背景執行緒跑 Pipeline；進度訊號沿用 UploadWorker 的節流。"""
+
+    def __init__(self, pipeline: Pipeline, ctx: Dict[str, Any]):
+        self.pipeline = pipeline
+        self.ctx = ctx
+        self.token = CancelToken()
+        super().__init__(self._run_pipeline)
+
+    def _run_pipeline(self, on_progress: Callable[[int, str], None], on_log: Callable[[str], None]):
+        res = self.pipeline.run(self.ctx, self.token, on_progress=on_progress, on_log=on_log)
+        res["ctx"] = self.ctx
+        return res
+
+    def cancel(self):
+        self.token.cancel()
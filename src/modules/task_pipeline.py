@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+任務流程執行器（不依賴 Qt）
+- 各階段以依賴圖排程：依賴全部完成者立即丟進執行緒池，互不相依的階段並行
+- 取消：CancelToken 設定後，尚未開始的階段標記 cancelled；執行中的階段於檢查點丟出 PipelineCancelled
+- 每階段計時、進度（0~100）回報；整體進度為各階段進度平均
+- 某階段失敗時，依賴它的階段標記 skipped，其餘照常執行
+"""
+
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+DONE = "done"
+FAILED = "failed"
+SKIPPED = "skipped"
+CANCELLED = "cancelled"
+
+
+class PipelineCancelled(Exception):
+    pass
+
+
+class CancelToken:
+    def __init__(self):
+        self.event = threading.Event()
+
+    def cancel(self):
+        self.event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self.event.is_set()
+
+    def check(self):
+        if self.event.is_set():
+            raise PipelineCancelled()
+
+
+class Stage:
+    """fn(ctx, progress, token)；progress(pct, text) 回報本階段進度。"""
+
+    def __init__(self, name: str, fn: Callable[[Dict[str, Any], Callable[[int, str], None], CancelToken], Any],
+                 deps: Iterable[str] = (), label: Optional[str] = None):
+        self.name = name
+        self.fn = fn
+        self.deps = tuple(deps)
+        self.label = label or name
+
+
+class Pipeline:
+    def __init__(self, stages: List[Stage], max_workers: int = 3):
+        names = {s.name for s in stages}
+        for s in stages:
+            missing = [d for d in s.deps if d not in names]
+            if missing:
+                raise ValueError(f"階段 {s.name} 依賴不存在: {missing}")
+        self.stages = {s.name: s for s in stages}
+        self.max_workers = max(1, max_workers)
+        self._check_acyclic()
+
+    def _check_acyclic(self):
+        state: Dict[str, int] = {}
+
+        def visit(n):
+            if state.get(n) == 1:
+                raise ValueError(f"階段依賴成環: {n}")
+            if state.get(n) == 2:
+                return
+            state[n] = 1
+            for d in self.stages[n].deps:
+                visit(d)
+            state[n] = 2
+        for n in self.stages:
+            visit(n)
+
+    def run(self, ctx: Dict[str, Any], token: Optional[CancelToken] = None,
+            on_progress: Optional[Callable[[int, str], None]] = None,
+            on_log: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+        """
+        回傳 {"ok", "cancelled", "status": {name: 狀態}, "timings": {name: 秒},
+              "errors": {name: 訊息}, "elapsed"}。
+        執行期間 ctx["log"] 指向 on_log，供各階段寫日誌。
+        """
+        token = token or CancelToken()
+        status: Dict[str, str] = {}
+        timings: Dict[str, float] = {}
+        errors: Dict[str, str] = {}
+        stage_pct: Dict[str, int] = {n: 0 for n in self.stages}
+        lock = threading.Lock()
+        t_start = time.perf_counter()
+
+        def log(msg):
+            if on_log:
+                on_log(msg)
+        ctx["log"] = log
+
+        def report(name, pct, text):
+            with lock:
+                stage_pct[name] = max(0, min(100, int(pct)))
+                overall = int(sum(stage_pct.values()) / len(stage_pct))
+            if on_progress:
+                on_progress(overall, f"[{self.stages[name].label}] {text}" if text else self.stages[name].label)
+
+        def run_stage(stage: Stage):
+            token.check()
+            t0 = time.perf_counter()
+            try:
+                stage.fn(ctx, lambda pct, text="": report(stage.name, pct, text), token)
+            finally:
+                timings[stage.name] = time.perf_counter() - t0
+            report(stage.name, 100, "完成")
+
+        pending = dict(self.stages)
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as ex:
+            while pending or running:
+                # 依賴失敗 / 取消者不再執行
+                for name, st in list(pending.items()):
+                    bad = [d for d in st.deps if status.get(d) in (FAILED, SKIPPED, CANCELLED)]
+                    if token.cancelled:
+                        status[name] = CANCELLED
+                    elif bad:
+                        status[name] = SKIPPED
+                        log(f"[流程] {st.label} 略過（依賴 {','.join(bad)} 未完成）")
+                    else:
+                        continue
+                    stage_pct[name] = 100
+                    del pending[name]
+                ready = [st for st in pending.values() if all(status.get(d) == DONE for d in st.deps)]
+                for st in ready:
+                    del pending[st.name]
+                    log(f"[流程] {st.label} 開始")
+                    running[ex.submit(run_stage, st)] = st
+                if not running:
+                    continue
+                finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for fut in finished:
+                    st = running.pop(fut)
+                    try:
+                        fut.result()
+                        status[st.name] = DONE
+                        log(f"[流程] {st.label} 完成 {timings.get(st.name, 0):.2f}s")
+                    except PipelineCancelled:
+                        status[st.name] = CANCELLED
+                        log(f"[流程] {st.label} 已取消")
+                    except Exception as e:
+                        status[st.name] = FAILED
+                        errors[st.name] = str(e)
+                        log(f"[流程] {st.label} 失敗: {e}")
+
+        cancelled = token.cancelled or any(v == CANCELLED for v in status.values())
+        return {
+            "ok": not errors and not cancelled,
+            "cancelled": cancelled,
+            "status": status,
+            "timings": {k: round(v, 3) for k, v in timings.items()},
+            "errors": errors,
+            "elapsed": round(time.perf_counter() - t_start, 3),
+        }
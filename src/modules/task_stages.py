@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+"""
+處理流程各步驟（GUI 與 CLI 共用，不依賴 Qt）
+解析 → 入庫 → 媒合報表 / 訂單上傳；圖片在解析後、Woo 格式轉換一開始即可並行。
+pandas / PIL / requests 等重模組於步驟執行時才載入。
+"""
+
+import os
+import random
+import sqlite3
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from modules.task_pipeline import Pipeline, Stage, PipelineCancelled
+from output_paths import output_root, chat_images_product_dir, woo_export_dir, match_report_dir
+
+PRODUCT_CODE_MAP = {
+    "遊戲幣": "game_currency",
+    "遊戲寶物": "game_item",
+    "二手商品": "used_goods"
+}
+ALL_PRODUCT_CODES = list(PRODUCT_CODE_MAP.values())
+PRODUCT_CN_MAP = {
+    "game_currency": "遊戲幣",
+    "game_item": "遊戲寶物",
+    "used_goods": "二手商品"
+}
+ALL_TASKS = ("report", "images", "woo_format", "woo_upload")
+
+
+def product_display_of(rec: Dict[str, Any]) -> str:
+    return PRODUCT_CN_MAP.get(rec.get("product_type", "game_currency"), "遊戲幣")
+
+
+def assign_product_types(records: List[Dict[str, Any]], single_code: Optional[str] = None):
+    """single_code 為 None 時每筆隨機指派。"""
+    for r in records:
+        r["product_type"] = single_code or random.choice(ALL_PRODUCT_CODES)
+
+
+def woo_pool_size(config) -> int:
+    # 連線池至少要容納最大併發，否則執行緒會反覆開關連線
+    size = max(int(config.get("woo_parallel_workers", 6)), int(config.get("woo_sync_workers", 4)))
+    if config.get("woo_upload_engine", "threads") == "async":
+        size = max(size, int(config.get("woo_async_max_concurrency", 32)))
+    return size
+
+
+def build_woo_client(config, logger=None, fingerprint_index=None, **overrides):
+    """依 config 建立 WooClient；overrides 覆寫個別參數（GUI 以畫面欄位覆寫）。"""
+    from modules.woo_client import WooClient
+
+    kwargs = dict(
+        base_url=config.get("woo_url", "").strip(),
+        consumer_key=config.get("woo_consumer_key", "").strip(),
+        consumer_secret=config.get("woo_consumer_secret", "").strip(),
+        timeout=int(config.get("woo_timeout", 15)),
+        test_mode=bool(config.get("woo_test_mode", True)),
+        logger=logger,
+        remote_dup_scan_limit=int(config.get("woo_remote_dup_scan_limit", 200)),
+        set_created_time=bool(config.get("woo_set_created_time", True)),
+        fingerprint_index=fingerprint_index,
+        sync_workers=int(config.get("woo_sync_workers", 4)),
+        pool_size=woo_pool_size(config),
+        http2=bool(config.get("woo_http2", False)),
+        gzip_requests=bool(config.get("woo_gzip_requests", False)),
+        collect_timings=bool(config.get("woo_http_timing", True))
+    )
+    kwargs.update(overrides)
+    return WooClient(**kwargs)
+
+
+def build_task_pipeline(files: List[str], tasks, *, config, db, db_path: str, root_dir: Path,
+                        parser=None, single_code: Optional[str] = None,
+                        client=None, outbox=None, max_workers: Optional[int] = None) -> Pipeline:
+    """
+    各步驟只寫 ctx，不碰 UI；結果鍵：records / inserted / report_paths / report_dir /
+    images_dir / image_count / image_rendered / image_reused / image_stats / woo_dir / woo_csv_count / upload_result。
+    """
+    fee_rate = config.get("platform_fee_rate", 0.07)
+    out_root = output_root(root_dir)
+
+    def stage_parse(ctx, progress, token):
+        nonlocal parser
+        if parser is None:
+            from modules.excel_parser import ExcelParser
+            parser = ExcelParser(db)
+        all_records = []
+        for i, f in enumerate(files, 1):
+            token.check()
+            try:
+                all_records.extend(parser.parse_file(f))
+            except Exception as e:
+                ctx["log"](f"{os.path.basename(f)} 解析失敗:{e}")
+            progress(i * 100 // len(files), f"{i}/{len(files)}")
+        if not all_records:
+            raise RuntimeError("解析為空")
+        assign_product_types(all_records, single_code)
+        ctx["records"] = all_records
+        ctx["log"]("商品指派完成")
+
+    def stage_insert(ctx, progress, token):
+        ins, _dup = db.insert_records(ctx["records"], dedup=True)
+        ctx["inserted"] = ins
+        if "report" not in tasks:
+            ctx["log"](f"為訂單上傳先入庫 新增:{ins}")
+
+    def stage_report(ctx, progress, token):
+        from modules.match_report import generate_match_reports
+        conn = sqlite3.connect(db_path)
+        try:
+            rpt_dir = match_report_dir(out_root)
+            ctx["report_paths"] = generate_match_reports(conn, str(rpt_dir), fee_rate=fee_rate)
+            ctx["report_dir"] = str(rpt_dir)
+        finally:
+            conn.close()
+        ctx["log"](f"媒合報表完成 (+{ctx.get('inserted', 0)})")
+
+    def stage_images(ctx, progress, token):
+        from modules.chat_image_generator import (generate_images_from_records, set_emoji_atlas_dir,
+                                                  make_render_pool, summarize_render_stats,
+                                                  refresh_render_context, render_pool_workers,
+                                                  RenderManifest, PROCESS_MIN_RECORDS)
+        atlas = config.get("emoji_atlas_dir", "cache/emoji_atlas")
+        set_emoji_atlas_dir(str(Path(root_dir) / atlas) if atlas else None)
+        if refresh_render_context():
+            ctx["log"]("模板 / 字型 / 頭像檔案已變更，重新載入產圖素材")
+        backend = config.get("chat_image_backend", "processes")
+        if backend == "processes" and len(ctx["records"]) < PROCESS_MIN_RECORDS:
+            backend = "threads"
+        workers = render_pool_workers(backend, int(config.get("chat_image_workers", 0)) or None)
+        pool = make_render_pool(backend, workers)
+        encoding = {
+            "format": config.get("chat_image_format", "png"),
+            "quality": config.get("chat_image_quality", 90),
+            "compress_level": config.get("chat_image_png_compress_level", 3),
+            "optimize": config.get("chat_image_optimize", False),
+            "quantize": config.get("chat_image_quantize_colors", 0),
+        }
+        stats = {}
+        seeded = bool(config.get("chat_image_seeded", True))
+        manifest = None
+        if config.get("chat_image_skip_unchanged", False):
+            manifest = RenderManifest(str(Path(root_dir) / config.get("chat_image_manifest_path",
+                                                                       "cache/chat_image_manifest.json")))
+        render_kw = dict(pool=pool, max_workers=workers, encoding=encoding, stats=stats, seeded=seeded,
+                         manifest=manifest, cancel=token.check)
+        grouped = {}
+        for r in ctx["records"]:
+            grouped.setdefault(r.get("product_type", "game_currency"), []).append(r)
+        last_dir = None
+        count = 0
+        try:
+            for i, (ptype, recs) in enumerate(grouped.items(), 1):
+                token.check()
+                base_dir = chat_images_product_dir(out_root, ptype)
+                ts = datetime.now().strftime("%Y%m%d_%H%M%S")
+                run_dir = os.path.join(base_dir, f"批次_{ts}")
+                os.makedirs(run_dir, exist_ok=True)
+                ins_records = [r for r in recs if r.get("direction") == "in"]
+                outs_records = [r for r in recs if r.get("direction") == "out"]
+                if ins_records:
+                    count += len(generate_images_from_records(ins_records, run_dir, "入帳", **render_kw))
+                if outs_records:
+                    count += len(generate_images_from_records(outs_records, run_dir, "出帳", **render_kw))
+                last_dir = run_dir
+                progress(i * 100 // len(grouped), f"{i}/{len(grouped)}")
+        finally:
+            pool.shutdown(wait=True)
+            if manifest is not None:
+                manifest.save()
+        ctx["images_dir"] = last_dir
+        ctx["image_count"] = count
+        ctx["image_stats"] = summarize_render_stats(stats)
+        st = ctx["image_stats"]
+        ctx["image_rendered"] = st["images"]
+        ctx["image_reused"] = st["reused"]
+        if st["reused"]:
+            ctx["log"](f"未變更的記錄 {st['reused']} 筆沿用先前產出的圖片（已放入本次資料夾），重新繪製 {st['images']} 張")
+        if st.get("images"):
+            ctx["log"](f"圖片生成完成（{backend}，{st['format']}：每張 {st['kb_per_image']} KB，"
+                       f"繪製 {st['render_ms_per_image']} ms / 編碼 {st['encode_ms_per_image']} ms）")
+        else:
+            ctx["log"]("圖片生成完成")
+
+    def stage_woo_format(ctx, progress, token):
+        from modules.bank_excel_converter import process_file as bank_convert
+        woo_dir = woo_export_dir(out_root)
+        count = 0
+        for i, f in enumerate(files, 1):
+            token.check()
+            pcode = single_code or random.choice(ALL_PRODUCT_CODES)
+            base = os.path.splitext(os.path.basename(f))[0]
+            out_csv = str(woo_dir / f"{base}_{pcode}_woo.csv")
+            try:
+                bank_convert(f, out_csv, fee_rate=fee_rate, product_type=pcode)
+                count += 1
+            except Exception as e:
+                ctx["log"](f"{base} 匯出錯誤:{e}")
+            progress(i * 100 // len(files), f"{i}/{len(files)}")
+        ctx["woo_dir"] = str(woo_dir)
+        ctx["woo_csv_count"] = count
+        ctx["log"]("轉換成可匯入網站格式完成")
+
+    def stage_upload(ctx, progress, token):
+        from modules.woo_upload_service import WooUploadService
+        service = WooUploadService(client, db, config, outbox=outbox,
+                                   product_display_of=product_display_of, log=ctx["log"])
+        res = service.run(ctx["records"], progress, cancel_event=token.event)
+        if not res.get("ok"):
+            raise RuntimeError(res.get("error"))
+        ctx["upload_result"] = res
+        if res.get("cancelled"):
+            raise PipelineCancelled()
+
+    stages = [Stage("parse", stage_parse, label="解析")]
+    if "report" in tasks or "woo_upload" in tasks:
+        stages.append(Stage("insert", stage_insert, deps=["parse"], label="入庫"))
+    if "report" in tasks:
+        stages.append(Stage("report", stage_report, deps=["insert"], label="媒合報表"))
+    if "images" in tasks:
+        stages.append(Stage("images", stage_images, deps=["parse"], label="圖片生成"))
+    if "woo_format" in tasks:
+        stages.append(Stage("woo_format", stage_woo_format, label="Woo 格式轉換"))
+    if "woo_upload" in tasks:
+        if client is None:
+            raise ValueError("woo_upload 需要 WooClient")
+        stages.append(Stage("woo_upload", stage_upload, deps=["insert"], label="訂單建立"))
+    if max_workers is None:
+        max_workers = int(config.get("pipeline_workers", 3))
+    return Pipeline(stages, max_workers=max_workers)
@@ -1,5 +1,30 @@
-import requests, hashlib, os, zipfile, tempfile, shutil
-from typing import Callable, Dict, Any, Set
+"""
+更新檢查 / 套用
+
+manifest 格式：
+{
+  "latest_version": "v1.0.6",
+  "full_package": {"url": ".../excel_auto_app_v1.0.6.zip", "sha256": "..."},
+  "files": {                                   # 選填：逐檔清單，有則優先增量更新
+    "base_url": ".../v1.0.6/files/",           # 檔案 URL = base_url + 相對路徑（entry 可自帶 url）
+    "entries": [{"path": "_internal/modules/foo.pyc", "size": 1234, "sha256": "..."}]
+  }
+}
+增量更新：先比對本機檔案（大小不同即視為變更，相同再算 sha256），只下載有變更的檔案，
+全部下載並校驗完成後才逐一 os.replace；途中失敗則還原。增量失敗時退回完整包；完整包也不先解壓，
+逐一成員直接寫到目的檔旁的暫存檔後同樣以 os.replace 套用、失敗還原。
+清單不含的本機檔案不會刪除。清單可由 `python -m modules.update_check manifest <發行資料夾>` 產生。
+下載走 modules.download_engine：斷線自動以 Range 續傳；完整包依 sha256 命名暫存，
+下次執行可從上次中斷處接續，伺服器支援時分段並行下載。
+"""
+
+import requests, hashlib, os, zipfile, tempfile, shutil, sys, json, time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+from urllib.parse import quote
+from typing import Callable, Dict, Any, List, Optional, Set, Tuple
+
+from modules.download_engine import Downloader, PARALLEL_MIN_SIZE
 
 DEFAULT_SKIP: Set[str] = {
     "config.json",
@@ -9,20 +34,87 @@ DEFAULT_SKIP: Set[str] = {
     "excel_auto_app.exe"
 }
 
+HASH_BUFFER = 1024 * 1024
+HASH_WORKERS = 4          # hashlib 對大區塊會釋放 GIL，多執行緒可並行計算
+STAGE_SUFFIX = ".__upd_new"
+BACKUP_SUFFIX = ".__upd_bak"
+DOWNLOAD_WORKERS = 4      # 完整包分段並行數（伺服器需支援 Range）；增量更新同時下載的檔案數
+
 def sha256_file(path: str) -> str:
     h = hashlib.sha256()
     with open(path, 'rb') as f:
-        for chunk in iter(lambda: f.read(8192), b''):
+        for chunk in iter(lambda: f.read(HASH_BUFFER), b''):
             h.update(chunk)
     return h.hexdigest().lower()
 
+def _safe_rel(rel: str) -> Optional[str]:
+    """正規化為 / 分隔的相對路徑；絕對路徑或含 .. 者回傳 None（不允許寫出 app_dir）。"""
+    rp = rel.replace("\\", "/")
+    if not rp or rp.startswith("/") or os.path.isabs(rel) or ":" in rp.split("/")[0] or any(p == ".." for p in rp.split("/")):
+        return None
+    return rp
+
+def build_file_manifest(root_dir: str, skip_paths: Set[str] = frozenset()) -> List[Dict[str, Any]]:
+    """掃描發行資料夾，產生 files.entries（path / size / sha256），供 manifest 使用。"""
+    entries = []
+    for r, _, fs in os.walk(root_dir):
+        for fn in fs:
+            full = os.path.join(r, fn)
+            rel = os.path.relpath(full, root_dir).replace("\\", "/")
+            if any(rel == s or rel.startswith(s) for s in skip_paths):
+                continue
+            entries.append({"path": rel, "size": os.path.getsize(full), "sha256": sha256_file(full)})
+    entries.sort(key=lambda e: e["path"])
+    return entries
+
+def apply_staged(pairs: List[Tuple[str, str]]) -> int:
+    """
+    pairs = [(暫存檔, 目的檔)]，暫存檔已在目的檔旁（同一磁碟，os.replace 為原子操作）。
+    既有目的檔先改名備份；任一步失敗即還原已替換的檔案並刪除暫存檔，再拋出例外。
+    """
+    done = []   # (目的檔, 備份檔或 None)
+    try:
+        for tmp, dst in pairs:
+            bak = None
+            if os.path.isdir(dst):
+                raise IsADirectoryError(f"目的路徑為資料夾: {dst}")
+            if os.path.exists(dst):
+                bak = dst + BACKUP_SUFFIX
+                os.replace(dst, bak)
+            try:
+                os.replace(tmp, dst)
+            except Exception:
+                if bak:
+                    os.replace(bak, dst)
+                raise
+            done.append((dst, bak))
+    except Exception:
+        for dst, bak in reversed(done):
+            try:
+                if bak:
+                    os.replace(bak, dst)
+                else:
+                    os.remove(dst)
+            except OSError:
+                pass
+        for tmp, _dst in pairs:
+            try: os.remove(tmp)
+            except OSError: pass
+        raise
+    for _dst, bak in done:
+        if bak:
+            try: os.remove(bak)
+            except OSError: pass   # Windows 上仍被占用的舊檔，下次更新時覆寫
+    return len(done)
+
 class UpdateManager:
     def __init__(self, manifest_url: str, app_version: str, app_dir: str,
-                 skip_paths: Set[str] = None):
+                 skip_paths: Set[str] = None, download_workers: int = DOWNLOAD_WORKERS):
         self.manifest_url = manifest_url
         self.app_version = app_version
         self.app_dir = app_dir
         self.skip_paths = set(skip_paths or []) | DEFAULT_SKIP
+        self.download_workers = max(1, int(download_workers or 1))
 
     def _is_skipped(self, rel_path: str) -> bool:
         rp = rel_path.replace("\\", "/")
@@ -47,74 +139,196 @@ class UpdateManager:
         下載更新包（zip），回傳本機暫存路徑；on_progress(百分比, 狀態文字)
         """
         on_progress(0, "下載更新包中...")
-        tmp_zip = os.path.join(tempfile.gettempdir(), "__update_pkg.zip")
-        with requests.get(url, stream=True, timeout=60) as r:
-            r.raise_for_status()
-            total = int(r.headers.get("content-length", 0)) or None
-            wrote = 0
-            with open(tmp_zip, "wb") as f:
-                for chunk in r.iter_content(8192):
-                    if not chunk:
-                        continue
-                    f.write(chunk)
-                    wrote += len(chunk)
-                    if total:
-                        pct = int(wrote / total * 100)
-                        on_progress(min(pct, 99), f"下載中 {pct}%")
-        have = sha256_file(tmp_zip)
-        if have != expect_sha256.lower():
-            try: os.remove(tmp_zip)
-            except: pass
-            raise RuntimeError("更新包 SHA256 校驗失敗")
-        on_progress(99, "下載完成，校驗通過")
+        sha = expect_sha256.lower()
+        # 依 sha 命名：中斷後下次執行找得到同一個 .part 續傳，不同版本也不會混用
+        tmp_zip = os.path.join(tempfile.gettempdir(), f"__update_pkg_{sha[:12]}.zip")
+
+        def progress(wrote: int, total: Optional[int]):
+            if total:
+                pct = int(wrote / total * 100)
+                on_progress(min(pct, 99), f"下載中 {pct}%")
+
+        try:
+            res = Downloader(timeout=60, parallel=self.download_workers).download(url, tmp_zip, sha, progress)
+        except Exception as e:
+            raise RuntimeError(f"更新包下載失敗: {e}") from e
+        if res["resumed_from"]:
+            on_progress(99, f"下載完成（自 {res['resumed_from'] // 1024} KB 續傳），校驗通過")
+        else:
+            on_progress(99, "下載完成，校驗通過")
         return tmp_zip
 
     def extract_and_copy(self, zip_path: str, on_progress: Callable[[int, str], None]) -> int:
         """
-        解壓並覆蓋到 app_dir，跳過 skip_paths；回傳覆蓋檔案數。
+        將更新包直接串流套用到 app_dir，跳過 skip_paths；回傳覆蓋檔案數。
+        各成員由 zip 讀出後寫到目的檔旁的暫存檔（不先整包解壓），全部寫完才以 apply_staged
+        逐一 os.replace；途中失敗則刪除暫存檔 / 還原已替換的檔案。
         """
-        on_progress(0, "解壓更新包...")
-        tmp_dir = tempfile.mkdtemp(prefix="upd_")
+        on_progress(0, "讀取更新包...")
+        staged: List[Tuple[str, str]] = []
         try:
-            with zipfile.ZipFile(zip_path, 'r') as z:
-                z.extractall(tmp_dir)
-            # 嘗試抓 ZIP 內第一層資料夾（PyInstaller 通常包一層）
-            root_entries = os.listdir(tmp_dir)
-            if len(root_entries) == 1 and os.path.isdir(os.path.join(tmp_dir, root_entries[0])):
-                src_root = os.path.join(tmp_dir, root_entries[0])
-            else:
-                src_root = tmp_dir
-
-            # 統計檔案總數用於進度
-            files = []
-            for r, _, fs in os.walk(src_root):
-                for fn in fs:
-                    rel = os.path.relpath(os.path.join(r, fn), src_root)
-                    if self._is_skipped(rel):
-                        continue
-                    files.append(rel)
-
-            total = max(len(files), 1)
-            copied = 0
-            for rel in files:
-                src = os.path.join(src_root, rel)
-                dst = os.path.join(self.app_dir, rel)
-                os.makedirs(os.path.dirname(dst), exist_ok=True)
-                shutil.copy2(src, dst)
-                copied += 1
-                pct = int(copied / total * 100)
-                on_progress(pct, f"覆蓋檔案 {copied}/{total} ({pct}%)")
-
+            self._stage_zip(zip_path, staged, on_progress)
+            on_progress(90, f"套用 {len(staged)} 個檔案...")
+            count = apply_staged(staged)
             on_progress(100, "更新完成")
-            return copied
+            return count
+        except Exception:
+            # apply_staged 失敗時已自行清理；這裡處理寫入階段留下的暫存檔
+            for tmp, _dst in staged:
+                try: os.remove(tmp)
+                except OSError: pass
+            raise
         finally:
             try: os.remove(zip_path)
-            except: pass
-            shutil.rmtree(tmp_dir, ignore_errors=True)
+            except OSError: pass
+
+    def _stage_zip(self, zip_path: str, staged: List[Tuple[str, str]],
+                   on_progress: Callable[[int, str], None]) -> None:
+        """把要套用的成員逐一寫成 <目的檔>.__upd_new，(暫存檔, 目的檔) 依序加入 staged。"""
+        with zipfile.ZipFile(zip_path, 'r') as z:
+            infos = [i for i in z.infolist() if not i.is_dir()]
+            names = []
+            for info in infos:
+                rel = _safe_rel(info.filename)
+                if rel is None:
+                    raise RuntimeError(f"更新包含不合法路徑: {info.filename}")
+                names.append(rel)
+            # ZIP 內只有一個第一層資料夾時去掉該層（PyInstaller 通常包一層）
+            tops = {n.split("/", 1)[0] for n in names}
+            strip = ""
+            if len(tops) == 1 and all("/" in n for n in names):
+                strip = tops.pop() + "/"
+
+            members = []
+            for info, rel in zip(infos, names):
+                rel = rel[len(strip):]
+                if not rel or self._is_skipped(rel):
+                    continue
+                members.append((info, rel))
+
+            total = max(len(members), 1)
+            total_bytes = max(sum(i.file_size for i, _ in members), 1)
+            wrote = 0
+            for n, (info, rel) in enumerate(members, 1):
+                dst = os.path.join(self.app_dir, *rel.split("/"))
+                tmp = dst + STAGE_SUFFIX
+                os.makedirs(os.path.dirname(dst), exist_ok=True)
+                staged.append((tmp, dst))
+                with z.open(info) as src, open(tmp, "wb") as f:
+                    shutil.copyfileobj(src, f, HASH_BUFFER)   # 讀完時 zipfile 會檢查 CRC
+                mtime = time.mktime(info.date_time + (0, 0, -1))
+                os.utime(tmp, (mtime, mtime))
+                wrote += info.file_size
+                pct = int(min(wrote / total_bytes, 1) * 90)
+                on_progress(pct, f"寫入檔案 {n}/{total} ({pct}%)")
+
+    # ===== 增量更新 =====
+    def plan_delta(self, entries: List[Dict[str, Any]],
+                   on_progress: Callable[[int, str], None] = lambda p, t: None) -> Dict[str, Any]:
+        """
+        比對本機安裝，回傳 {"changed": [entry...], "unchanged": n, "skipped": n, "bytes": 需下載位元組}。
+        大小不同者不必計算雜湊。
+        """
+        changed, to_hash, skipped = [], [], 0
+        for e in entries:
+            rel = _safe_rel(str(e.get("path", "")))
+            if rel is None or not e.get("sha256"):
+                raise RuntimeError(f"manifest 檔案項目不合法: {e.get('path')!r}")
+            if self._is_skipped(rel):
+                skipped += 1
+                continue
+            e = dict(e, path=rel, sha256=str(e["sha256"]).lower())
+            dst = os.path.join(self.app_dir, rel)
+            if not os.path.isfile(dst) or ("size" in e and os.path.getsize(dst) != int(e["size"])):
+                changed.append(e)
+            else:
+                to_hash.append((e, dst))
+        total = max(len(to_hash), 1)
+        unchanged = 0
+        with ThreadPoolExecutor(max_workers=HASH_WORKERS) as ex:
+            for n, ((e, _dst), have) in enumerate(zip(to_hash, ex.map(lambda it: sha256_file(it[1]), to_hash)), 1):
+                if have != e["sha256"]:
+                    changed.append(e)
+                else:
+                    unchanged += 1
+                if n % 50 == 0 or n == len(to_hash):
+                    on_progress(int(n / total * 10), f"比對本機檔案 {n}/{len(to_hash)}")
+        return {
+            "changed": changed,
+            "unchanged": unchanged,
+            "skipped": skipped,
+            "bytes": sum(int(e.get("size") or 0) for e in changed),
+        }
+
+    def _download_file(self, url: str, dst_tmp: str, expect_sha256: str, size: Optional[int] = None,
+                       session: Optional[requests.Session] = None) -> int:
+        """單一變更檔；manifest 標示的大小低於 PARALLEL_MIN_SIZE 時不送 HEAD 探測（本來就不分段）。"""
+        probe = not size or size >= PARALLEL_MIN_SIZE
+        try:
+            res = Downloader(session=session, timeout=60).download(url, dst_tmp, expect_sha256, probe=probe)
+        except Exception as e:
+            raise RuntimeError(f"檔案下載失敗: {url}: {e}") from e
+        return res["bytes"]
+
+    def delta_update(self, files: Dict[str, Any], on_progress: Callable[[int, str], None]) -> Dict[str, Any]:
+        """只下載並替換有變更的檔案；回傳 {"count", "unchanged", "bytes"}。"""
+        base_url = str(files.get("base_url") or "")
+        entries = files.get("entries") or []
+        on_progress(0, "比對本機檔案...")
+        plan = self.plan_delta(entries, on_progress)
+        changed = plan["changed"]
+        if not changed:
+            on_progress(100, "檔案皆為最新")
+            return {"count": 0, "unchanged": plan["unchanged"], "bytes": 0}
+        total_bytes = max(plan["bytes"], 1)
+        jobs = []
+        for e in changed:
+            url = e.get("url") or (base_url + quote(e["path"]))
+            if not url.lower().startswith(("http://", "https://")):
+                raise RuntimeError(f"檔案 {e['path']} 缺少下載網址")
+            dst = os.path.join(self.app_dir, e["path"])
+            jobs.append((url, dst + STAGE_SUFFIX, dst, e))
+        staged = []
+        got = 0
+        workers = min(self.download_workers, len(jobs))
+        # 多個小檔同時下載，共用一個 session 重用連線
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=workers)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as ex:
+                futs = {ex.submit(self._download_file, url, tmp, e["sha256"], int(e.get("size") or 0), session):
+                        (tmp, dst) for url, tmp, dst, e in jobs}
+                try:
+                    for i, fut in enumerate(as_completed(futs), 1):
+                        got += fut.result()
+                        staged.append(futs[fut])
+                        pct = 10 + int(min(got / total_bytes, 1) * 80)
+                        on_progress(pct, f"下載變更檔案 {i}/{len(jobs)}")
+                except BaseException:
+                    # 其餘尚未開始的不再下載；進行中的等它結束後一併清掉暫存
+                    for f in futs:
+                        f.cancel()
+                    raise
+                finally:
+                    session.close()
+        except Exception:
+            # 含下載到一半的暫存檔（及下載引擎的 .part / 進度檔）
+            for e in changed:
+                tmp = os.path.join(self.app_dir, e["path"]) + STAGE_SUFFIX
+                for p in (tmp, tmp + ".part", tmp + ".part.json"):
+                    try: os.remove(p)
+                    except OSError: pass
+            raise
+        on_progress(90, f"套用 {len(staged)} 個檔案...")
+        count = apply_staged(staged)
+        on_progress(100, "更新完成")
+        return {"count": count, "unchanged": plan["unchanged"], "bytes": got}
 
     def run_update(self, on_progress: Callable[[int, str], None]) -> Dict[str, Any]:
         """
-        主流程：抓 manifest → 判斷版本 → 下載 → 覆蓋
+        主流程：抓 manifest → 判斷版本 → 增量（有 files 清單時）或完整包下載 → 覆蓋
         """
         try:
             on_progress(0, "檢查更新...")
@@ -125,15 +339,45 @@ class UpdateManager:
         if not self.need_update(mf):
             return {"ok": True, "updated": False, "message": "已是最新版本"}
 
+        files = mf.get("files") or {}
+        delta_error = None
+        if files.get("entries"):
+            try:
+                res = self.delta_update(files, on_progress)
+                return {"ok": True, "updated": True, "mode": "delta", "latest_version": mf.get("latest_version"), **res}
+            except Exception as e:
+                # 增量失敗（已還原）→ 改用完整包
+                delta_error = str(e)
+                on_progress(0, f"增量更新失敗，改下載完整包: {e}")
+
         pkg = mf.get("full_package") or {}
         url = pkg.get("url")
         sha = (pkg.get("sha256") or "").lower()
         if not url or not sha:
-            return {"ok": False, "error": "manifest 缺少 full_package.url 或 sha256"}
+            return {"ok": False, "error": delta_error or "manifest 缺少 full_package.url 或 sha256"}
 
         try:
             zip_path = self.download_full_package(url, sha, on_progress)
             count = self.extract_and_copy(zip_path, on_progress)
-            return {"ok": True, "updated": True, "count": count, "latest_version": mf.get("latest_version")}
+            return {"ok": True, "updated": True, "mode": "full", "count": count,
+                    "latest_version": mf.get("latest_version")}
         except Exception as e:
-            return {"ok": False, "error": str(e)}
\ No newline at end of file
+            return {"ok": False, "error": str(e)}
+
+
+def main(argv=None) -> int:
+    """python -m modules.update_check manifest <發行資料夾> [--base-url URL]：輸出 files 清單 JSON。"""
+    import argparse
+    ap = argparse.ArgumentParser(prog="python -m modules.update_check")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    m = sub.add_parser("manifest", help="產生逐檔清單（供增量更新）")
+    m.add_argument("root")
+    m.add_argument("--base-url", default="")
+    args = ap.parse_args(argv)
+    files = {"base_url": args.base_url, "entries": build_file_manifest(args.root, DEFAULT_SKIP)}
+    print(json.dumps({"files": files}, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
\ No newline at end of file
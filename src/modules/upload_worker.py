@@ -0,0 +1,47 @@
+import time
+from PyQt6 import QtCore
+from typing import Dict, Any, Callable
+
+# 進度訊號最短間隔（秒）；避免每完成一筆就觸發一次 UI 重繪
+PROGRESS_MIN_INTERVAL = 0.1
+
+
+class UploadWorker(QtCore.QThread):
+    progressChanged = QtCore.pyqtSignal(int, str)   # (percent, text)
+    logMessage = QtCore.pyqtSignal(str)
+    finishedWithResult = QtCore.pyqtSignal(dict)    # result dict
+
+    def __init__(self, run_fn: Callable[[Callable[[int, str], None], Callable[[str], None]], Dict[str, Any]]):
+        super().__init__()
+        self._run_fn = run_fn
+        self._last_emit = 0.0
+        self._pending = None
+
+    def _emit_progress(self, pct: int, text: str):
+        now = time.monotonic()
+        if pct < 100 and now - self._last_emit < PROGRESS_MIN_INTERVAL:
+            self._pending = (pct, text)
+            return
+        self._last_emit = now
+        self._pending = None
+        try:
+            self.progressChanged.emit(pct, text)
+        except:
+            pass
+
+    def _emit_log(self, msg: str):
+        try:
+            self.logMessage.emit(msg)
+        except:
+            pass
+
+    def run(self):
+        res = {}
+        try:
+            res = self._run_fn(self._emit_progress, self._emit_log)
+        except Exception as e:
+            res = {"ok": False, "error": f"上傳執行緒錯誤: {e}"}
+        if self._pending:
+            # 節流期間最後一次進度補送
+            self.progressChanged.emit(*self._pending)
+        self.finishedWithResult.emit(res)
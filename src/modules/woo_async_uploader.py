@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""
+Woo 非同步上傳引擎（asyncio）
+- 併發數由 AIMD 控制：成功且延遲正常 → 緩增；429 / 5xx / 延遲暴增 → 減半
+- 429 / 503 帶 Retry-After 時全域暫停到指定時間，而非固定 BACKOFF_SECONDS
+- 有 aiohttp 時走原生非同步 HTTP；沒有則以 WooClient.session 跑在執行緒上
+- payload / 指紋 / 結果格式沿用 WooClient，與 create_order_full 相同
+"""
+
+import time
+import json
+import asyncio
+import email.utils
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+try:
+    import aiohttp
+    _AIOHTTP_AVAILABLE = True
+except ImportError:
+    aiohttp = None
+    _AIOHTTP_AVAILABLE = False
+
+from modules.woo_client import WooClient, MAX_RETRIES, RETRY_STATUS_CODES, SERVER_ERROR_PREFIX
+
+DEFAULT_MIN_CONCURRENCY = 1
+DEFAULT_MAX_CONCURRENCY = 32
+DECREASE_FACTOR = 0.5          # 429 / 5xx 時乘上
+LATENCY_DECREASE_FACTOR = 0.8  # 延遲暴增時乘上
+LATENCY_TOLERANCE = 3.0        # 超過基準延遲幾倍視為壅塞
+DECREASE_COOLDOWN = 1.0        # 秒；同一波失敗只減一次
+DEFAULT_RETRY_AFTER = 2.0      # 無 Retry-After 時的暫停秒數
+MAX_RETRY_AFTER = 60.0
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Retry-After 可為秒數或 HTTP 日期；回傳需等待秒數。"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        dt = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, dt.timestamp() - time.time())
+
+
+class AimdLimiter:
+    """動態上限的 semaphore；上限依回應結果 AIMD 調整。"""
+
+    def __init__(self, initial: int, min_limit: int = DEFAULT_MIN_CONCURRENCY,
+                 max_limit: int = DEFAULT_MAX_CONCURRENCY):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(max(initial, self.min_limit), self.max_limit))
+        self.in_flight = 0
+        self.pause_until = 0.0
+        self.base_latency: Optional[float] = None
+        self._last_decrease = 0.0
+        self._cond = asyncio.Condition()
+        self.stats = {"increase": 0, "decrease": 0, "throttled": 0, "peak_limit": int(self.limit)}
+
+    async def acquire(self):
+        async with self._cond:
+            while True:
+                wait = self.pause_until - time.monotonic()
+                if wait > 0:
+                    try:
+                        await asyncio.wait_for(self._cond.wait(), timeout=wait)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                if self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return
+                await self._cond.wait()
+
+    async def release(self):
+        async with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def on_success(self, latency: float):
+        if self.base_latency is None or latency < self.base_latency:
+            self.base_latency = latency
+        else:
+            # 基準延遲緩慢回升，避免一次偶發的極快回應永久壓低基準
+            self.base_latency = self.base_latency * 0.95 + latency * 0.05
+        if latency > self.base_latency * LATENCY_TOLERANCE:
+            self._decrease(LATENCY_DECREASE_FACTOR)
+            return
+        if self.limit < self.max_limit:
+            # 每完成約 limit 筆成功請求 +1（每個 RTT 加一）
+            self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            self.stats["increase"] += 1
+            self.stats["peak_limit"] = max(self.stats["peak_limit"], int(self.limit))
+
+    def on_overload(self, retry_after: Optional[float] = None):
+        self.stats["throttled"] += 1
+        self._decrease(DECREASE_FACTOR)
+        if retry_after:
+            until = time.monotonic() + min(retry_after, MAX_RETRY_AFTER)
+            self.pause_until = max(self.pause_until, until)
+
+    def _decrease(self, factor: float):
+        now = time.monotonic()
+        if now - self._last_decrease < DECREASE_COOLDOWN:
+            return
+        self._last_decrease = now
+        self.limit = max(float(self.min_limit), self.limit * factor)
+        self.stats["decrease"] += 1
+
+
+class AsyncWooUploader:
+    def __init__(self, client: WooClient, initial_concurrency: int = 6,
+                 max_concurrency: int = DEFAULT_MAX_CONCURRENCY):
+        self.client = client
+        self.initial_concurrency = max(1, initial_concurrency)
+        self.max_concurrency = max(self.initial_concurrency, max_concurrency)
+        self.limiter: Optional[AimdLimiter] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def upload(self, records: List[Dict[str, Any]], fee_rate: float, fee_product_id: int,
+               product_display_of: Callable[[Dict[str, Any]], str],
+               on_result: Optional[Callable[[Dict[str, Any], Dict[str, Any]], None]] = None
+               ) -> List[Dict[str, Any]]:
+        """
+        同步入口：跑完整個事件迴圈後回傳與 records 同順序的結果。
+        on_result(record, result) 在事件迴圈所在執行緒、每完成一筆時呼叫。
+        """
+        return asyncio.run(self._upload(records, fee_rate, fee_product_id,
+                                        product_display_of, on_result))
+
+    async def _upload(self, records, fee_rate, fee_product_id, product_display_of, on_result):
+        self.limiter = AimdLimiter(self.initial_concurrency, max_limit=self.max_concurrency)
+        session = None
+        self._executor = None
+        if not _AIOHTTP_AVAILABLE and not self.client.test_mode:
+            # 預設 executor 執行緒數過少，會把 AIMD 上限卡死
+            self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency)
+        if _AIOHTTP_AVAILABLE and not self.client.test_mode:
+            session = aiohttp.ClientSession(
+                auth=aiohttp.BasicAuth(self.client.ck, self.client.cs),
+                timeout=aiohttp.ClientTimeout(total=self.client.timeout),
+                connector=aiohttp.TCPConnector(limit=self.max_concurrency)
+            )
+        try:
+            async def one(rec):
+                res = await self._create_one(session, rec, fee_rate, fee_product_id,
+                                             product_display_of(rec))
+                if on_result:
+                    on_result(rec, res)
+                return res
+            results = await asyncio.gather(*(one(r) for r in records))
+        finally:
+            if session is not None:
+                await session.close()
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+        st = self.limiter.stats
+        self.client._log("info", f"[Woo async] 完成 {len(records)} 筆 limit={self.limiter.limit:.1f} "
+                                 f"peak={st['peak_limit']} 降速={st['decrease']} 429/5xx={st['throttled']}")
+        return list(results)
+
+    async def _create_one(self, session, rec, fee_rate, fee_product_id, product_display):
+        client = self.client
+        if client.test_mode:
+            return client.create_order_full(rec, fee_rate, fee_product_id, product_display)
+        payload, fp = client.build_order_payload(rec, fee_rate, fee_product_id, product_display)
+        url = client._orders_endpoint()
+        attempts = 0
+        last_err: Any = None; last_status = 0
+        while attempts < MAX_RETRIES:
+            attempts += 1
+            await self.limiter.acquire()
+            try:
+                t0 = time.monotonic()
+                status, data, headers = await self._post(session, url, payload)
+                latency = time.monotonic() - t0
+            finally:
+                await self.limiter.release()
+            if status in (200, 201):
+                self.limiter.on_success(latency)
+                order_id = data.get("id") if isinstance(data, dict) else None
+                return {"ok": True, "order_id": order_id, "payload": payload,
+                        "fingerprint": fp, "attempts": attempts}
+            last_err = data; last_status = status
+            if status in RETRY_STATUS_CODES or status >= SERVER_ERROR_PREFIX or status == 0:
+                retry_after = parse_retry_after(headers.get("Retry-After"))
+                if retry_after is None:
+                    retry_after = DEFAULT_RETRY_AFTER
+                self.limiter.on_overload(retry_after)
+                if status in RETRY_STATUS_CODES:
+                    continue
+                # 逾時 / 5xx：伺服器可能已建立，不重送；標為結果不明，留待遠端指紋對帳
+                break
+            if status == 404 and url != client._fallback_orders_endpoint():
+                url = client._fallback_orders_endpoint()
+                continue
+            break
+        client._log("error", f"[Woo async] create fail status={last_status} err={last_err}")
+        res = {"ok": False, "error": str(last_err), "payload": payload,
+               "fingerprint": fp, "attempts": attempts}
+        if last_status == 0 or last_status >= SERVER_ERROR_PREFIX:
+            res["uncertain"] = True
+        return res
+
+    async def _post(self, session, url: str, payload: Dict[str, Any]) -> Tuple[int, Any, Any]:
+        if session is not None:
+            try:
+                async with session.post(url, json=payload) as r:
+                    text = await r.text()
+                    return r.status, _json_or_raw(text), r.headers
+            except Exception as e:
+                return 0, {"error": repr(e)}, {}
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._post_blocking, url, payload)
+
+    def _post_blocking(self, url: str, payload: Dict[str, Any]):
+        c = self.client
+        try:
+            r = c._post_json(url, payload)
+        except Exception as e:
+            return 0, {"error": repr(e)}, {}
+        return r.status_code, _json_or_raw(r.text), r.headers
+
+
+def _json_or_raw(text: str):
+    try:
+        return json.loads(text)
+    except Exception:
+        return {"raw": text}
@@ -1,26 +1,22 @@
 import requests, time, hashlib, json, datetime, re, random
-from typing import Dict, Any, Set
+from typing import Dict, Any, Set, List, Callable, Optional
+
+from modules.amount_normalizer import parse_amount
+from modules.woo_transport import build_session, encode_json_body, TransportTimings, DEFAULT_POOL_SIZE
+from modules.datetime_normalizer import to_local_iso
 
 RETRY_STATUS_CODES = {429}
 SERVER_ERROR_PREFIX = 500
 MAX_RETRIES = 3
 BACKOFF_SECONDS = [1,2,4]
+BATCH_MAX_ITEMS = 100  # WooCommerce /batch 單次上限
+SYNC_PAGE_SIZE = 100
+SYNC_FIELDS = "id,meta_data,date_modified_gmt"
 EMAIL_DOMAINS = ["gmail.com","yahoo.com","outlook.com","hotmail.com"]
 
 def normalize_amount(val) -> int:
-    if val is None: return 0
-    s = str(val).strip()
-    if not s: return 0
-    neg = False
-    if s.startswith("(") and s.endswith(")"):
-        neg = True; s = s[1:-1]
-    s = (s.replace(",", "").replace("，","").replace("$","")
-           .replace("NT$","").replace("元","").replace(" ",""))
-    m = re.search(r'-?\d+(?:\.\d+)?', s)
-    if not m: return 0
-    v = float(m.group(0))
-    if neg: v = -v
-    return int(v)
+    v = parse_amount(val)
+    return int(v) if v is not None else 0
 
 def generate_realistic_email(record:Dict[str,Any])->str:
     base_src = (record.get("order_no") or record.get("customer_name") or "").lower()
@@ -46,18 +42,25 @@ def generate_realistic_email(record:Dict[str,Any])->str:
 class WooClient:
     def __init__(self, base_url:str, consumer_key:str, consumer_secret:str,
                  timeout:int=15, test_mode:bool=True, logger=None,
-                 remote_dup_scan_limit:int=200, set_created_time:bool=True):
+                 remote_dup_scan_limit:int=200, set_created_time:bool=True,
+                 fingerprint_index=None, sync_workers:int=4,
+                 pool_size:int=DEFAULT_POOL_SIZE, http2:bool=False,
+                 gzip_requests:bool=False, collect_timings:bool=True):
         self.base_url=base_url.rstrip("/")
         self.ck=consumer_key.strip()
         self.cs=consumer_secret.strip()
         self.timeout=timeout
         self.test_mode=test_mode
         self.logger=logger
-        self.session=requests.Session()
+        self.timings=TransportTimings() if collect_timings else None
+        self.session=build_session(pool_size=pool_size, http2=http2, timings=self.timings, logger=logger)
+        self.gzip_requests=gzip_requests
         self.remote_dup_scan_limit=remote_dup_scan_limit
         self.set_created_time=set_created_time
         self.remote_fingerprints:Set[str]=set()
         self.remote_loaded=False
+        self.fingerprint_index=fingerprint_index
+        self.sync_workers=max(1,sync_workers)  # 指紋同步已改為循序走訪（見 sync_fingerprint_index），保留參數相容
 
     def _log(self, level:str, msg:str):
         if self.logger:
@@ -69,6 +72,12 @@ class WooClient:
     def _fallback_orders_endpoint(self)->str:
         return f"{self.base_url}/?rest_route=/wc/v3/orders"
 
+    def _batch_endpoint(self)->str:
+        return f"{self.base_url}/wp-json/wc/v3/orders/batch"
+
+    def _fallback_batch_endpoint(self)->str:
+        return f"{self.base_url}/?rest_route=/wc/v3/orders/batch"
+
     def test_connection(self)->Dict[str,Any]:
         url=self._orders_endpoint()+"?per_page=1"
         try:
@@ -91,28 +100,29 @@ class WooClient:
         return f"{fee_rate*100:.2f}%"
 
     def _parse_iso(self, dt_str:str)->str:
-        if not dt_str: return ""
-        dt_str=dt_str.strip()
-        if not dt_str: return ""
-        fmts=[
-            "%Y-%m-%d %H:%M:%S","%Y/%m/%d %H:%M:%S",
-            "%Y-%m-%d %H:%M","%Y/%m/%d %H:%M",
-            "%Y-%m-%d","%Y/%m/%d"
-        ]
-        for f in fmts:
-            try:
-                dt=datetime.datetime.strptime(dt_str,f)
-                from datetime import timezone, timedelta
-                dt=dt.replace(tzinfo=timezone(timedelta(hours=8)))
-                return dt.isoformat()
-            except:
-                continue
-        return dt_str  # 原樣保留（MU-Plugin重試解析）
+        return to_local_iso(dt_str)  # 無法解析時原樣保留（MU-Plugin重試解析）
 
     def preload_remote_fingerprints(self):
         if self.remote_loaded: return
         self.remote_loaded=True
+        if self.fingerprint_index is not None:
+            try:
+                self.sync_fingerprint_index()
+            except Exception as e:
+                self._log("warn",f"[Woo sync] 索引同步失敗，使用本機既有索引: {e}")
+            self.remote_fingerprints|=self.fingerprint_index.fingerprints(self.base_url)
+            self._log("info",f"[Woo preload] 索引指紋載入 {len(self.remote_fingerprints)}")
+            return
         limit=min(max(self.remote_dup_scan_limit,1),400)
+        self.remote_fingerprints|=set(self._scan_recent_orders(limit))
+        self._log("info",f"[Woo preload] 遠端指紋載入 {len(self.remote_fingerprints)}")
+
+    def _scan_recent_orders(self, limit:int, strict:bool=False)->Dict[str,int]:
+        """
+        掃最新 limit 筆遠端訂單，回傳 {tx_fingerprint: order_id}；
+        連線 / HTTP 失敗時回傳已取得的部分，strict=True 則拋 RuntimeError。
+        """
+        found:Dict[str,int]={}
         page=1; collected=0
         while collected<limit:
             per=min(100, limit-collected)
@@ -120,20 +130,87 @@ class WooClient:
             try:
                 r=self.session.get(url, auth=(self.ck,self.cs), timeout=self.timeout)
             except Exception as e:
+                if strict: raise RuntimeError(f"連線失敗: {e}") from e
                 self._log("warn",f"[Woo preload] 連線失敗: {e}"); break
             if r.status_code!=200:
+                if strict: raise RuntimeError(f"HTTP {r.status_code} {r.text[:200]}")
                 self._log("warn",f"[Woo preload] HTTP {r.status_code} {r.text[:200]}"); break
             try: orders=r.json()
-            except: break
+            except Exception as e:
+                if strict: raise RuntimeError(f"回應非 JSON: {e}") from e
+                break
             if not orders: break
             for o in orders:
-                meta=o.get("meta_data",[])
-                for m in meta:
-                    if m.get("key")=="tx_fingerprint":
-                        fp=m.get("value")
-                        if fp: self.remote_fingerprints.add(fp)
+                fp=self._extract_fingerprint(o)
+                if fp: found[fp]=o.get("id")
             collected+=len(orders); page+=1
-        self._log("info",f"[Woo preload] 遠端指紋載入 {len(self.remote_fingerprints)}")
+        return found
+
+    def _extract_fingerprint(self, order:Dict[str,Any])->Optional[str]:
+        for m in order.get("meta_data") or []:
+            if m.get("key")=="tx_fingerprint":
+                return m.get("value") or None
+        return None
+
+    def _fetch_sync_page(self, modified_after:Optional[str], exclude:Optional[List[int]]=None):
+        params={"per_page":SYNC_PAGE_SIZE,"page":1,"orderby":"modified","order":"asc",
+                "_fields":SYNC_FIELDS,"dates_are_gmt":"true"}
+        if modified_after: params["modified_after"]=modified_after
+        if exclude: params["exclude"]=",".join(map(str,sorted(exclude)))
+        r=self.session.get(self._orders_endpoint(), params=params,
+                           auth=(self.ck,self.cs), timeout=self.timeout)
+        if r.status_code!=200:
+            raise RuntimeError(f"HTTP {r.status_code} {r.text[:200]}")
+        return r.json() or []
+
+    @staticmethod
+    def _sync_cursor(watermark:Optional[str])->Optional[str]:
+        """watermark 往回 1 秒作為 modified_after（同秒修改的訂單不漏抓；upsert 可重複）。"""
+        if not watermark: return None
+        try:
+            dt=datetime.datetime.fromisoformat(watermark)-datetime.timedelta(seconds=1)
+            return dt.strftime("%Y-%m-%dT%H:%M:%S")
+        except ValueError:
+            return watermark
+
+    def sync_fingerprint_index(self)->int:
+        """
+        增量同步遠端指紋到本機索引：依 date_modified 由舊到新循序走訪，每次都從游標後的第 1 頁取，
+        僅取 id/meta_data 欄位。同步途中被修改的訂單只會移到結果尾端，不會讓其他訂單因換頁位移而漏抓
+        （依總頁數並行抓頁做不到這點）；超過一頁的訂單同一秒修改時，以 exclude 排除已取得的 id 續取。每頁完成即把同步點前移到該頁最後的 date_modified——
+        比它早的訂單都已抓過；同秒者由下次的 1 秒重疊涵蓋。回傳本次寫入筆數。
+        """
+        idx=self.fingerprint_index
+        store=self.base_url
+        watermark=idx.last_modified(store)
+        cursor=self._sync_cursor(watermark)
+        seen:Set[int]=set()   # 目前游標下已取得的 id
+        written=0; pages=0; stuck=False
+        while True:
+            orders=self._fetch_sync_page(cursor, sorted(seen) if stuck else None)
+            pages+=1
+            rows=[]; newest=None
+            for o in orders:
+                oid=o.get("id")
+                if not oid: continue
+                mod=o.get("date_modified_gmt")
+                rows.append((int(oid), self._extract_fingerprint(o), mod))
+                seen.add(int(oid))
+                if mod and (newest is None or mod>newest): newest=mod
+            written+=idx.upsert(store, rows)
+            if newest and (watermark is None or newest>watermark):
+                watermark=newest
+                idx.mark_synced(store, watermark)
+            if len(orders)<SYNC_PAGE_SIZE:
+                break
+            next_cursor=self._sync_cursor(watermark)
+            # 整頁都落在同一個 1 秒重疊區內、游標推不動：同一游標下排除已取得的 id 再取（不用頁碼位移）
+            stuck=next_cursor==cursor
+            if not stuck:
+                cursor=next_cursor; seen=set()
+        idx.mark_synced(store, watermark)
+        self._log("info",f"[Woo sync] 增量同步 請求頁數={pages} 寫入={written} 同步點={watermark or '無'}")
+        return written
 
     def build_order_payload(self, record:Dict[str,Any], fee_rate:float,
                             fee_product_id:int, product_display:str):
@@ -194,9 +271,20 @@ class WooClient:
         }
         return payload, fp
 
+    def transport_summary(self)->str:
+        return self.timings.format_summary() if self.timings else "計時未啟用"
+
+    def _post_json(self, url:str, payload:Dict[str,Any]):
+        if not self.gzip_requests:
+            return self.session.post(url, auth=(self.ck,self.cs), json=payload, timeout=self.timeout)
+        body,headers=encode_json_body(payload, True)
+        body_kw={"data":body} if isinstance(self.session,requests.Session) else {"content":body}
+        return self.session.post(url, auth=(self.ck,self.cs), headers=headers,
+                                 timeout=self.timeout, **body_kw)
+
     def _do_post(self, url:str, payload:Dict[str,Any]):
         try:
-            r=self.session.post(url, auth=(self.ck,self.cs), json=payload, timeout=self.timeout)
+            r=self._post_json(url, payload)
         except Exception as e:
             return False, {"error":repr(e)}, 0, "exception"
         ct=r.headers.get("Content-Type","")
@@ -217,20 +305,26 @@ class WooClient:
             else: reason="client_error"
         return ok,(data if data is not None else {"raw":text}), r.status_code, reason
 
-    def _post_with_retry(self, payload:Dict[str,Any]):
+    def _post_with_retry(self, payload:Dict[str,Any], url:str=None, fallback_url:str=None,
+                         retry_unsafe:bool=True):
+        """
+        retry_unsafe=False：逾時 / 連線錯誤（status 0）與 5xx 不重送——伺服器可能已建立訂單，
+        由呼叫端先對帳；只重試 429（請求未被處理）與 404 改走 fallback 端點。
+        """
         attempts=0; last_err=None; last_status=0
-        url=self._orders_endpoint()
+        url=url or self._orders_endpoint()
+        fallback_url=fallback_url or self._fallback_orders_endpoint()
         while attempts<MAX_RETRIES:
             attempts+=1
             ok,data,status,reason=self._do_post(url,payload)
             if ok: return True,data,status,attempts
-            if reason in ("rate_limit","server_error") or status==0:
+            if reason=="rate_limit" or (retry_unsafe and (reason=="server_error" or status==0)):
                 last_err=data; last_status=status
                 if attempts<MAX_RETRIES:
                     time.sleep(BACKOFF_SECONDS[attempts-1]); continue
-            if reason=="not_found":
+            if reason=="not_found" and url!=fallback_url:
                 last_err=data; last_status=status
-                url=self._fallback_orders_endpoint()
+                url=fallback_url
                 continue
             last_err=data; last_status=status; break
         return False,last_err,last_status,attempts
@@ -238,13 +332,158 @@ class WooClient:
     def create_order_full(self, record:Dict[str,Any], fee_rate:float,
                           fee_product_id:int, product_display:str)->Dict[str,Any]:
         payload, fp=self.build_order_payload(record, fee_rate, fee_product_id, product_display)
+        return self.post_order_payload(payload, fp)
+
+    def post_order_payload(self, payload:Dict[str,Any], fp:str)->Dict[str,Any]:
+        """送出已組好的 payload（outbox 重送時沿用原 payload）。"""
         if self.test_mode:
             fake_id=int(time.time())%100000
             self._log("info",f"[Woo TEST] fake_id={fake_id} fp={fp}")
             return {"ok":True,"order_id":fake_id,"payload":payload,"fingerprint":fp,"attempts":1,"test_mode":True}
-        ok,data,status,attempts=self._post_with_retry(payload)
+        # 逾時 / 5xx 不重送（伺服器可能已建立），標為結果不明，由 outbox 下次執行對帳
+        ok,data,status,attempts=self._post_with_retry(payload, retry_unsafe=False)
         if not ok:
             self._log("error",f"[Woo] create fail status={status} err={data}")
-            return {"ok":False,"error":str(data),"payload":payload,"fingerprint":fp,"attempts":attempts}
+            res={"ok":False,"error":str(data),"payload":payload,"fingerprint":fp,"attempts":attempts}
+            if status==0 or status>=SERVER_ERROR_PREFIX:
+                res["uncertain"]=True
+            return res
         order_id=data.get("id")
-        return {"ok":True,"order_id":order_id,"payload":payload,"fingerprint":fp,"attempts":attempts}
\ No newline at end of file
+        return {"ok":True,"order_id":order_id,"payload":payload,"fingerprint":fp,"attempts":attempts}
+
+    def create_orders_batch(self, records:List[Dict[str,Any]], fee_rate:float,
+                            fee_product_id:int, product_display_of:Callable[[Dict[str,Any]],str],
+                            batch_size:int=BATCH_MAX_ITEMS)->List[Dict[str,Any]]:
+        """
+        以 /orders/batch 建立多筆訂單；回傳結果與 records 同順序（格式同 create_order_full）。
+        回應明確標示失敗的項目改走單筆建立；逾時 / 5xx / 回應缺漏者先比對遠端指紋，確認不存在才單筆送出。
+        """
+        built=[self.build_order_payload(rec, fee_rate, fee_product_id, product_display_of(rec))
+               for rec in records]
+        return self.post_payloads_batch(built, batch_size=batch_size)
+
+    def post_payloads_batch(self, built:List[tuple], batch_size:int=BATCH_MAX_ITEMS)->List[Dict[str,Any]]:
+        """built: [(payload, fingerprint)]；回傳結果與 built 同順序。"""
+        size=min(max(int(batch_size),1),BATCH_MAX_ITEMS)
+        results:List[Dict[str,Any]]=[]
+        for start in range(0,len(built),size):
+            results.extend(self._post_batch_chunk(built[start:start+size]))
+        return results
+
+    def _post_batch_chunk(self, built:List[tuple]):
+        if self.test_mode:
+            base_id=int(time.time())%100000
+            self._log("info",f"[Woo TEST] batch size={len(built)} fake_id_base={base_id}")
+            return [{"ok":True,"order_id":base_id+i,"payload":payload,"fingerprint":fp,"attempts":1,"test_mode":True}
+                    for i,(payload,fp) in enumerate(built)]
+
+        ok,data,status,attempts=self._post_with_retry(
+            {"create":[payload for payload,_ in built]},
+            url=self._batch_endpoint(), fallback_url=self._fallback_batch_endpoint(),
+            retry_unsafe=False
+        )
+        created=data.get("create") if ok and isinstance(data,dict) else None
+        # 有 create 清單、逾時 / 5xx、或 200 但格式不明：伺服器可能已建立部分或全部訂單，缺漏項目須先對帳；
+        # 只有整批被明確拒絕（4xx）時才確定一筆都沒建立
+        uncertain_batch=isinstance(created,list) or ok or status==0 or status>=SERVER_ERROR_PREFIX
+        if not isinstance(created,list):
+            if uncertain_batch:
+                self._log("warn",f"[Woo batch] 結果不明 status={status} size={len(built)}，先比對遠端指紋")
+            else:
+                self._log("warn",f"[Woo batch] 整批被拒 status={status} size={len(built)}，改單筆建立")
+            created=[]
+
+        # 只以 tx_fingerprint 對應回本地紀錄，不依位置猜（伺服器可能重排或漏項）；
+        # 沒帶指紋的項目（多為錯誤項）對應不到，其記錄視為結果不明，先向遠端對帳
+        by_fp={}; anonymous_errors=0
+        for item in created:
+            if not isinstance(item,dict): continue
+            fp=self._extract_fingerprint(item)
+            if fp: by_fp[fp]=item
+            elif item.get("error"):
+                anonymous_errors+=1
+                self._log("warn",f"[Woo batch] 錯誤項目未帶指紋 err={item.get('error')}")
+
+        results:List[Optional[Dict[str,Any]]]=[None]*len(built)
+        retry_idx=[]; unknown_idx=[]
+        for i,(payload,fp) in enumerate(built):
+            item=by_fp.get(fp)
+            if item and item.get("id") and not item.get("error"):
+                results[i]={"ok":True,"order_id":item.get("id"),"payload":payload,
+                            "fingerprint":fp,"attempts":attempts}
+            elif item and item.get("error"):
+                # 明確回報失敗的項目未建立，可單筆重送
+                self._log("warn",f"[Woo batch] fp={fp[:12]} err={item.get('error')}，單筆重試")
+                retry_idx.append(i)
+            elif uncertain_batch:
+                unknown_idx.append(i)
+            else:
+                retry_idx.append(i)
+
+        if unknown_idx:
+            remote=self.lookup_remote_orders([built[i][1] for i in unknown_idx])
+            for i in unknown_idx:
+                payload,fp=built[i]
+                if remote is None:
+                    # 無法確認是否已建立：不重送，交由下次執行（outbox / 遠端指紋比對）處理
+                    results[i]={"ok":False,"error":f"batch 結果不明（status={status}），無法確認遠端是否已建立，未重送",
+                                "payload":payload,"fingerprint":fp,"attempts":attempts,"uncertain":True}
+                elif fp in remote:
+                    results[i]={"ok":True,"order_id":remote[fp],"payload":payload,
+                                "fingerprint":fp,"attempts":attempts}
+                else:
+                    retry_idx.append(i)
+
+        for i in retry_idx:
+            payload,fp=built[i]
+            res=self.post_order_payload(payload, fp)
+            res["attempts"]=res.get("attempts",1)+attempts
+            results[i]=res
+        self._log("info",f"[Woo batch] size={len(built)} 結果不明={len(unknown_idx)} 單筆重送={len(retry_idx)}"
+                         +(f" 無指紋錯誤項={anonymous_errors}" if anonymous_errors else ""))
+        return results
+
+    def lookup_remote_orders(self, fps:List[str],
+                             created_after:Optional[datetime.datetime]=None)->Optional[Dict[str,int]]:
+        """
+        向遠端確認指紋是否已有訂單，回傳 {fingerprint: order_id}；無法確認時回傳 None（不可當成「不存在」）。
+        有指紋索引時增量同步後查索引；否則 created_after（UTC）指定時掃描其後建立的全部訂單，
+        未指定則掃最新訂單（至少涵蓋本批筆數，適用剛送出的請求）。
+        """
+        try:
+            if self.fingerprint_index is not None:
+                self.sync_fingerprint_index()
+                found=self.fingerprint_index.order_ids(self.base_url, fps)
+            else:
+                if created_after is not None:
+                    scanned=self._scan_orders_created_after(created_after)
+                else:
+                    limit=min(max(self.remote_dup_scan_limit,len(fps)*2,1),400)
+                    scanned=self._scan_recent_orders(limit, strict=True)
+                found={fp:scanned[fp] for fp in fps if fp in scanned}
+        except Exception as e:
+            self._log("warn",f"[Woo] 遠端指紋查詢失敗，無法對帳: {e}")
+            return None
+        self.remote_fingerprints|=set(found)
+        return found
+
+    def _scan_orders_created_after(self, after:datetime.datetime)->Dict[str,int]:
+        """依 id 由小到大掃 after（UTC）之後建立的全部訂單，回傳 {tx_fingerprint: order_id}；失敗拋 RuntimeError。"""
+        found:Dict[str,int]={}
+        page=1
+        while True:
+            params={"per_page":SYNC_PAGE_SIZE,"page":page,"orderby":"id","order":"asc",
+                    "after":after.strftime("%Y-%m-%dT%H:%M:%S"),"dates_are_gmt":"true","_fields":SYNC_FIELDS}
+            try:
+                r=self.session.get(self._orders_endpoint(), params=params, auth=(self.ck,self.cs), timeout=self.timeout)
+            except Exception as e:
+                raise RuntimeError(f"連線失敗: {e}") from e
+            if r.status_code!=200:
+                raise RuntimeError(f"HTTP {r.status_code} {r.text[:200]}")
+            orders=r.json() or []
+            for o in orders:
+                fp=self._extract_fingerprint(o)
+                if fp: found[fp]=o.get("id")
+            if len(orders)<SYNC_PAGE_SIZE:
+                return found
+            page+=1
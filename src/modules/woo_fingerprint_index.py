@@ -0,0 +1,109 @@
+import sqlite3, os, threading, datetime
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+
+class FingerprintIndex:
+    """
+    遠端訂單 tx_fingerprint 的本機索引（SQLite）。
+    以 store(base_url) 區分不同站台；sync 狀態記錄最後一次看到的 date_modified_gmt，
+    供下次以 modified_after 只抓差異。
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        if db_path != ":memory:":
+            os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._ensure()
+
+    def _ensure(self):
+        c = self.conn.cursor()
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS woo_remote_fingerprints (
+                store TEXT NOT NULL,
+                order_id INTEGER NOT NULL,
+                fingerprint TEXT,
+                modified_gmt TEXT,
+                PRIMARY KEY (store, order_id)
+            )
+        """)
+        c.execute("CREATE INDEX IF NOT EXISTS idx_woo_remote_fp ON woo_remote_fingerprints(store, fingerprint)")
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS woo_fingerprint_sync (
+                store TEXT PRIMARY KEY,
+                last_modified_gmt TEXT,
+                synced_at TEXT
+            )
+        """)
+        self.conn.commit()
+
+    def last_modified(self, store: str) -> Optional[str]:
+        row = self.conn.execute(
+            "SELECT last_modified_gmt FROM woo_fingerprint_sync WHERE store=?", (store,)
+        ).fetchone()
+        return row[0] if row and row[0] else None
+
+    def upsert(self, store: str, rows: Iterable[Tuple[int, Optional[str], Optional[str]]]) -> int:
+        """rows: (order_id, fingerprint, modified_gmt)；回傳寫入筆數。"""
+        rows = [(store, oid, fp, mod) for oid, fp, mod in rows]
+        if not rows:
+            return 0
+        with self._lock:
+            self.conn.executemany("""
+                INSERT INTO woo_remote_fingerprints (store, order_id, fingerprint, modified_gmt)
+                VALUES (?,?,?,?)
+                ON CONFLICT(store, order_id) DO UPDATE SET
+                    fingerprint=excluded.fingerprint,
+                    modified_gmt=excluded.modified_gmt
+            """, rows)
+            self.conn.commit()
+        return len(rows)
+
+    def mark_synced(self, store: str, last_modified_gmt: Optional[str]):
+        ts = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with self._lock:
+            self.conn.execute("""
+                INSERT INTO woo_fingerprint_sync (store, last_modified_gmt, synced_at)
+                VALUES (?,?,?)
+                ON CONFLICT(store) DO UPDATE SET
+                    last_modified_gmt=COALESCE(excluded.last_modified_gmt, last_modified_gmt),
+                    synced_at=excluded.synced_at
+            """, (store, last_modified_gmt, ts))
+            self.conn.commit()
+
+    def fingerprints(self, store: str) -> Set[str]:
+        cur = self.conn.execute(
+            "SELECT fingerprint FROM woo_remote_fingerprints WHERE store=? AND fingerprint IS NOT NULL AND fingerprint<>''",
+            (store,)
+        )
+        return {r[0] for r in cur}
+
+    def order_ids(self, store: str, fingerprints: Iterable[str]) -> Dict[str, int]:
+        """回傳 {fingerprint: order_id}，只含索引中找得到者。"""
+        fps = [fp for fp in set(fingerprints) if fp]
+        out: Dict[str, int] = {}
+        for i in range(0, len(fps), 500):
+            chunk = fps[i:i + 500]
+            cur = self.conn.execute(
+                f"SELECT fingerprint, order_id FROM woo_remote_fingerprints WHERE store=? AND fingerprint IN ({','.join('?' * len(chunk))})",
+                (store, *chunk)
+            )
+            for fp, oid in cur:
+                out[fp] = oid
+        return out
+
+    def count(self, store: str) -> int:
+        return self.conn.execute(
+            "SELECT COUNT(*) FROM woo_remote_fingerprints WHERE store=?", (store,)
+        ).fetchone()[0]
+
+    def reset(self, store: str):
+        with self._lock:
+            self.conn.execute("DELETE FROM woo_remote_fingerprints WHERE store=?", (store,))
+            self.conn.execute("DELETE FROM woo_fingerprint_sync WHERE store=?", (store,))
+            self.conn.commit()
+
+    def close(self):
+        try: self.conn.close()
+        except: pass
@@ -0,0 +1,261 @@
+import sqlite3, os, json, time, threading, datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+
+# outbox 狀態
+PENDING = "pending"
+IN_FLIGHT = "in_flight"
+DONE = "done"
+FAILED = "failed"
+
+DEFAULT_MAX_ATTEMPTS = 5
+BACKOFF_BASE_SECONDS = 5
+BACKOFF_MAX_SECONDS = 300
+# 下一筆到期超過此秒數就結束本輪，留待下次執行續傳
+IDLE_WAIT_SECONDS = 60
+
+
+def _now_str():
+    return datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+class WooOutbox:
+    """
+    Woo 建單的持久化 outbox（SQLite）。
+    每筆以 (store, fingerprint) 唯一；保存送出用的 payload，重送時沿用原 payload。
+    POST 前先標記 in_flight 並 commit，當機後可辨識哪些「可能已送出」需與遠端指紋對帳。
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        if db_path != ":memory:":
+            os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self._ensure()
+
+    def _ensure(self):
+        c = self.conn.cursor()
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS woo_outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                store TEXT NOT NULL,
+                fingerprint TEXT NOT NULL,
+                record_id INTEGER,
+                payload_json TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_retry_at REAL NOT NULL DEFAULT 0,
+                last_error TEXT,
+                order_id TEXT,
+                created_at TEXT,
+                updated_at TEXT,
+                UNIQUE (store, fingerprint)
+            )
+        """)
+        c.execute("CREATE INDEX IF NOT EXISTS idx_woo_outbox_due ON woo_outbox(store, status, next_retry_at)")
+        self.conn.commit()
+
+    # ---------- 佇列 ----------
+    def enqueue_many(self, store: str, items: Iterable[tuple]) -> int:
+        """
+        items: (fingerprint, record_id, payload)
+        已存在者：pending / failed → 更新 record_id 並重設為 pending（failed 的嘗試次數歸零）；
+        in_flight / done 不動，確保不重複送出。回傳新加入筆數。
+        """
+        ts = _now_str()
+        added = 0
+        with self._lock:
+            c = self.conn.cursor()
+            for fp, record_id, payload in items:
+                c.execute("""
+                    INSERT INTO woo_outbox (store, fingerprint, record_id, payload_json, status,
+                                            attempts, next_retry_at, created_at, updated_at)
+                    VALUES (?,?,?,?,?,0,0,?,?)
+                    ON CONFLICT(store, fingerprint) DO NOTHING
+                """, (store, fp, record_id, json.dumps(payload, ensure_ascii=False), PENDING, ts, ts))
+                if c.rowcount:
+                    added += 1
+                    continue
+                c.execute("""
+                    UPDATE woo_outbox SET record_id=?, updated_at=?,
+                        attempts=CASE WHEN status=? THEN 0 ELSE attempts END,
+                        next_retry_at=CASE WHEN status=? THEN 0 ELSE next_retry_at END,
+                        status=?
+                    WHERE store=? AND fingerprint=? AND status IN (?,?)
+                """, (record_id, ts, FAILED, FAILED, PENDING, store, fp, PENDING, FAILED))
+            self.conn.commit()
+        return added
+
+    def in_flight(self, store: str) -> List[Dict[str, Any]]:
+        """停在 in_flight 的項目（fingerprint / updated_at），供對帳前查詢遠端。"""
+        rows = self.conn.execute(
+            "SELECT fingerprint, updated_at FROM woo_outbox WHERE store=? AND status=?", (store, IN_FLIGHT)
+        ).fetchall()
+        return [dict(r) for r in rows]
+
+    def recover_in_flight(self, store: str, remote_fingerprints: Set[str]) -> Dict[str, int]:
+        """
+        上次中斷 / 結果不明而停在 in_flight 的項目：遠端已有指紋 → done；否則退回 pending 重送。
+        remote_fingerprints 必須來自一次成功的遠端查詢（WooClient.lookup_remote_orders）；
+        查詢失敗時不要呼叫，項目維持 in_flight 待下次再對帳——「查不到」不等於「未建立」。
+        """
+        ts = _now_str()
+        done = back = 0
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT id, fingerprint FROM woo_outbox WHERE store=? AND status=?", (store, IN_FLIGHT)
+            ).fetchall()
+            for r in rows:
+                if r["fingerprint"] in remote_fingerprints:
+                    self.conn.execute("UPDATE woo_outbox SET status=?, last_error=NULL, updated_at=? WHERE id=?",
+                                      (DONE, ts, r["id"]))
+                    done += 1
+                else:
+                    self.conn.execute("UPDATE woo_outbox SET status=?, next_retry_at=0, updated_at=? WHERE id=?",
+                                      (PENDING, ts, r["id"]))
+                    back += 1
+            self.conn.commit()
+        return {"done": done, "requeued": back}
+
+    def claim_due(self, store: str, limit: int) -> List[Dict[str, Any]]:
+        """取出到期的 pending 項目並標記為 in_flight（同一交易內完成）。"""
+        now = time.time()
+        with self._lock:
+            rows = self.conn.execute("""
+                SELECT * FROM woo_outbox
+                WHERE store=? AND status=? AND next_retry_at<=?
+                ORDER BY id LIMIT ?
+            """, (store, PENDING, now, limit)).fetchall()
+            if not rows:
+                return []
+            ids = [r["id"] for r in rows]
+            self.conn.executemany(
+                "UPDATE woo_outbox SET status=?, attempts=attempts+1, updated_at=? WHERE id=?",
+                [(IN_FLIGHT, _now_str(), i) for i in ids]
+            )
+            self.conn.commit()
+        items = []
+        for r in rows:
+            d = dict(r)
+            d["attempts"] += 1
+            d["payload"] = json.loads(d.pop("payload_json"))
+            items.append(d)
+        return items
+
+    def complete(self, item: Dict[str, Any], result: Dict[str, Any],
+                 max_attempts: int = DEFAULT_MAX_ATTEMPTS) -> str:
+        """依結果更新狀態；回傳新狀態（done / pending / failed，結果不明者 in_flight）。"""
+        ts = _now_str()
+        if result.get("ok"):
+            status = DONE
+            next_at = 0
+        elif result.get("uncertain"):
+            # 送出後結果不明且無法與遠端對帳：維持 in_flight，下次執行由 recover_in_flight 對帳後再決定
+            status = IN_FLIGHT
+            next_at = 0
+        elif item["attempts"] >= max_attempts:
+            status = FAILED
+            next_at = 0
+        else:
+            status = PENDING
+            next_at = time.time() + min(BACKOFF_BASE_SECONDS * 2 ** (item["attempts"] - 1), BACKOFF_MAX_SECONDS)
+        with self._lock:
+            self.conn.execute("""
+                UPDATE woo_outbox SET status=?, next_retry_at=?, last_error=?, order_id=?, updated_at=?
+                WHERE id=?
+            """, (status, next_at, None if result.get("ok") else str(result.get("error"))[:1000],
+                  str(result.get("order_id")) if result.get("ok") else None, ts, item["id"]))
+            self.conn.commit()
+        item["status"] = status
+        return status
+
+    # ---------- 查詢 ----------
+    def next_due_in(self, store: str) -> Optional[float]:
+        row = self.conn.execute(
+            "SELECT MIN(next_retry_at) FROM woo_outbox WHERE store=? AND status=?", (store, PENDING)
+        ).fetchone()
+        if not row or row[0] is None:
+            return None
+        return max(0.0, row[0] - time.time())
+
+    def done_orders(self, store: str, fingerprints: Iterable[str]) -> Dict[str, Optional[str]]:
+        """已於先前執行送出成功者：{fingerprint: order_id}。"""
+        fps = list(fingerprints)
+        out: Dict[str, Optional[str]] = {}
+        for i in range(0, len(fps), 500):
+            part = fps[i:i + 500]
+            q = f"SELECT fingerprint, order_id FROM woo_outbox WHERE store=? AND status=? AND fingerprint IN ({','.join('?' * len(part))})"
+            for r in self.conn.execute(q, (store, DONE, *part)):
+                out[r[0]] = r[1]
+        return out
+
+    def counts(self, store: str) -> Dict[str, int]:
+        out = {PENDING: 0, IN_FLIGHT: 0, DONE: 0, FAILED: 0}
+        for r in self.conn.execute(
+                "SELECT status, COUNT(*) FROM woo_outbox WHERE store=? GROUP BY status", (store,)):
+            out[r[0]] = r[1]
+        return out
+
+    def close(self):
+        try: self.conn.close()
+        except: pass
+
+
+class OutboxDispatcher:
+    """
+    背景派送：workers 條執行緒各自 claim 到期項目 → send → complete。
+    send(items) 回傳與 items 同順序的結果（格式同 WooClient.create_order_full）。
+    on_result(item, result) 於 worker 執行緒呼叫；item["status"] 為更新後狀態。
+    沒有到期項目、且下一筆到期超過 IDLE_WAIT_SECONDS 時結束。
+    """
+
+    def __init__(self, outbox: WooOutbox, store: str,
+                 send: Callable[[List[Dict[str, Any]]], List[Dict[str, Any]]],
+                 workers: int = 4, claim_size: int = 1,
+                 max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+                 on_result: Optional[Callable[[Dict[str, Any], Dict[str, Any]], None]] = None):
+        self.outbox = outbox
+        self.store = store
+        self.send = send
+        self.workers = max(1, workers)
+        self.claim_size = max(1, claim_size)
+        self.max_attempts = max_attempts
+        self.on_result = on_result
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def start(self):
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker, name=f"woo-outbox-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self):
+        self._stop.set()
+
+    def is_alive(self) -> bool:
+        return any(t.is_alive() for t in self._threads)
+
+    def join(self, timeout: Optional[float] = None):
+        for t in self._threads:
+            t.join(timeout)
+
+    def _worker(self):
+        while not self._stop.is_set():
+            items = self.outbox.claim_due(self.store, self.claim_size)
+            if not items:
+                wait = self.outbox.next_due_in(self.store)
+                if wait is None or wait > IDLE_WAIT_SECONDS:
+                    return
+                self._stop.wait(min(max(wait, 0.2), 1.0))
+                continue
+            try:
+                results = self.send(items)
+            except Exception as e:
+                results = [{"ok": False, "error": repr(e), "fingerprint": it["fingerprint"],
+                            "payload": it["payload"], "attempts": 1} for it in items]
+            for item, res in zip(items, results):
+                self.outbox.complete(item, res, self.max_attempts)
+                if self.on_result:
+                    self.on_result(item, res)
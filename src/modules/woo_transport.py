@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+WooClient 傳輸層
+- 連線池大小對齊併發數（pool_block=True：執行緒等待可重用連線，不另開用完即丟的連線）
+- keep-alive 重用；GET 於連線錯誤 / 502 / 503 / 504 由 urllib3 Retry 自動重試（POST 不重試，避免重複建單）
+- 回應一律接受 gzip；請求 body 超過門檻時可選 gzip（需站台支援 Content-Encoding: gzip）
+- 可選 HTTP/2（需安裝 httpx[http2]；未安裝則退回 requests）
+- 每次請求的 DNS / connect / TLS / TTFB / total 計時，供診斷
+"""
+
+import gzip
+import json
+import time
+import socket
+import threading
+from collections import deque
+from typing import Any, Dict, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import NewConnectionError, ConnectTimeoutError
+from urllib3.util.connection import allowed_gai_family
+
+try:
+    import httpx
+    import h2  # noqa: F401  (httpx 的 http2=True 需要)
+    _HTTP2_AVAILABLE = True
+except ImportError:
+    httpx = None
+    _HTTP2_AVAILABLE = False
+
+DEFAULT_POOL_SIZE = 10
+GZIP_MIN_BYTES = 4096
+TIMING_HISTORY = 2000
+
+_tls = threading.local()
+
+
+# ---------------- 計時 ----------------
+def _conn_timing() -> Dict[str, float]:
+    t = getattr(_tls, "timing", None)
+    if t is None:
+        t = _tls.timing = {}
+    return t
+
+
+class _TimedConnMixin:
+    def _new_conn(self):
+        """
+        自行解析一次 DNS 並計時，再依序連到解析出的位址（與 urllib3 create_connection 相同的逐一嘗試）；
+        以 IP 連線時 urllib3 不會再查一次 DNS，計時不額外增加查詢。
+        """
+        t = _conn_timing()
+        host = self._dns_host
+        t0 = time.perf_counter()
+        try:
+            infos = socket.getaddrinfo(host.strip("[]"), self.port, allowed_gai_family(), socket.SOCK_STREAM)
+        except OSError:
+            infos = []
+        t1 = time.perf_counter()
+        t["dns"] = t1 - t0
+        if not infos:
+            # 解析失敗：交給 urllib3 照常拋 NameResolutionError
+            return super()._new_conn()
+        last_err = None
+        for *_ignored, sockaddr in infos:
+            self._dns_host = sockaddr[0]
+            try:
+                sock = super()._new_conn()
+                break
+            except (NewConnectionError, ConnectTimeoutError) as e:
+                last_err = e
+            finally:
+                self._dns_host = host
+        else:
+            raise last_err
+        t["connect"] = time.perf_counter() - t1
+        return sock
+
+
+class _TimedHTTPConnection(_TimedConnMixin, HTTPConnection):
+    pass
+
+
+class _TimedHTTPSConnection(_TimedConnMixin, HTTPSConnection):
+    def connect(self):
+        t0 = time.perf_counter()
+        super().connect()
+        t = _conn_timing()
+        t["tls"] = max(0.0, time.perf_counter() - t0 - t.get("dns", 0.0) - t.get("connect", 0.0))
+
+
+class _TimedHTTPPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class TransportTimings:
+    """收集最近 TIMING_HISTORY 筆請求的各階段耗時（秒）。"""
+
+    PHASES = ("dns", "connect", "tls", "ttfb", "total")
+
+    def __init__(self, history: int = TIMING_HISTORY):
+        self._lock = threading.Lock()
+        self._samples = deque(maxlen=history)
+
+    def record(self, sample: Dict[str, Any]):
+        with self._lock:
+            self._samples.append(sample)
+
+    def samples(self):
+        with self._lock:
+            return list(self._samples)
+
+    def summary(self) -> Dict[str, Any]:
+        data = self.samples()
+        out: Dict[str, Any] = {"requests": len(data)}
+        if not data:
+            return out
+        out["reused_ratio"] = round(sum(1 for s in data if s.get("reused")) / len(data), 3)
+        for ph in self.PHASES:
+            vals = sorted(s[ph] for s in data if s.get(ph) is not None)
+            if not vals:
+                continue
+            out[f"{ph}_avg_ms"] = round(sum(vals) / len(vals) * 1000, 1)
+            out[f"{ph}_p95_ms"] = round(vals[min(len(vals) - 1, int(len(vals) * 0.95))] * 1000, 1)
+        return out
+
+    def format_summary(self) -> str:
+        s = self.summary()
+        if not s.get("requests"):
+            return "無請求"
+        parts = [f"請求={s['requests']}", f"重用={s.get('reused_ratio', 0):.0%}"]
+        for ph in self.PHASES:
+            if f"{ph}_avg_ms" in s:
+                parts.append(f"{ph}={s[f'{ph}_avg_ms']}/{s[f'{ph}_p95_ms']}ms")
+        return " ".join(parts)
+
+
+# ---------------- Adapter / Session ----------------
+class TimedHTTPAdapter(HTTPAdapter):
+    def __init__(self, *args, timed: bool = True, **kwargs):
+        self._timed = timed
+        super().__init__(*args, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        if self._timed:
+            self.poolmanager.pool_classes_by_scheme = {"http": _TimedHTTPPool, "https": _TimedHTTPSPool}
+
+
+def _get_retry() -> Retry:
+    return Retry(
+        total=2, connect=2, read=0, status=2,
+        backoff_factor=0.5,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset({"GET", "HEAD"}),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+
+
+def build_session(pool_size: int = DEFAULT_POOL_SIZE, http2: bool = False,
+                  timings: Optional[TransportTimings] = None, logger=None):
+    """
+    建立 HTTP session。http2=True 且 httpx/h2 可用時回傳 httpx.Client（介面與 requests.Session 相容的子集），
+    否則回傳已調整連線池的 requests.Session。
+    """
+    pool_size = max(1, int(pool_size))
+    if http2:
+        if _HTTP2_AVAILABLE:
+            client = httpx.Client(
+                http2=True,
+                limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+                headers={"Accept-Encoding": "gzip, deflate"},
+            )
+            if timings is not None:
+                # response hook 在收到標頭、讀 body 前觸發 → 即 TTFB
+                def _on_request(req):
+                    req.extensions["woo_t0"] = time.perf_counter()
+
+                def _on_response(resp):
+                    t0 = resp.request.extensions.get("woo_t0")
+                    ttfb = time.perf_counter() - t0 if t0 else None
+                    timings.record({"ttfb": ttfb, "status": resp.status_code,
+                                    "http_version": resp.http_version})
+                client.event_hooks["request"].append(_on_request)
+                client.event_hooks["response"].append(_on_response)
+            return client
+        if logger:
+            logger.warn("[WooTransport] 未安裝 httpx[http2]，改用 HTTP/1.1")
+
+    s = requests.Session()
+    adapter = TimedHTTPAdapter(pool_connections=4, pool_maxsize=pool_size, pool_block=True,
+                               max_retries=_get_retry(), timed=timings is not None)
+    s.mount("https://", adapter)
+    s.mount("http://", adapter)
+    s.headers.update({"Accept-Encoding": "gzip, deflate", "Connection": "keep-alive"})
+    if timings is not None:
+        _orig_send = s.send
+
+        def _send(request, **kwargs):
+            _tls.timing = {}
+            t0 = time.perf_counter()
+            resp = _orig_send(request, **kwargs)
+            t = _conn_timing()
+            timings.record({
+                "dns": t.get("dns"),
+                "connect": t.get("connect"),
+                "tls": t.get("tls"),
+                "ttfb": resp.elapsed.total_seconds(),
+                "total": time.perf_counter() - t0,
+                "reused": "connect" not in t,
+                "status": resp.status_code,
+            })
+            return resp
+        s.send = _send
+    return s
+
+
+def encode_json_body(payload: Any, gzip_enabled: bool,
+                     min_bytes: int = GZIP_MIN_BYTES) -> Tuple[bytes, Dict[str, str]]:
+    """JSON 編碼；啟用且超過門檻時 gzip 壓縮並附上 Content-Encoding。"""
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    headers = {"Content-Type": "application/json; charset=utf-8"}
+    if gzip_enabled and len(body) >= min_bytes:
+        body = gzip.compress(body, compresslevel=5)
+        headers["Content-Encoding"] = "gzip"
+    return body, headers
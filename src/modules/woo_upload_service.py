@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+"""
+Woo 訂單上傳服務（不依賴 Qt）
+- 原 MainWindow._task_upload_orders 的流程：遠端去重 → 上傳（threads / batch / async / outbox）→ 回寫 DB
+- 進度與日誌以 callback 回報；由背景流程（PipelineWorker）呼叫，或由 CLI 直接呼叫
+"""
+
+import queue
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, List, Optional
+
+from modules.woo_client import WooClient, BATCH_MAX_ITEMS
+from modules.woo_async_uploader import AsyncWooUploader
+from modules.woo_outbox import OutboxDispatcher, DONE, FAILED, IN_FLIGHT
+
+
+class WooUploadService:
+    def __init__(self, client: WooClient, db, config, outbox=None,
+                 product_display_of: Optional[Callable[[Dict[str, Any]], str]] = None,
+                 log: Optional[Callable[[str], None]] = None):
+        self.client = client
+        self.db = db
+        self.config = config
+        # 測試模式不落 outbox，避免假訂單被記為已送出
+        self.outbox = None if client.test_mode else outbox
+        self.product_display_of = product_display_of or (lambda rec: "遊戲幣")
+        self._log_fn = log
+
+    def log(self, msg: str):
+        if self._log_fn:
+            self._log_fn(msg)
+
+    def _recover_outbox(self, outbox):
+        """
+        停在 in_flight（可能已送出）的項目先向遠端嚴格對帳：查詢成功才把查無者退回 pending；
+        查詢失敗則全部維持 in_flight，本次不重送（避免重複建單）。
+        """
+        client = self.client
+        items = outbox.in_flight(client.base_url)
+        if not items:
+            return
+        oldest = min(it["updated_at"] for it in items)
+        try:
+            # updated_at 為本機時間；往前留 1 小時餘裕後轉 UTC
+            since = (datetime.datetime.strptime(oldest, "%Y-%m-%d %H:%M:%S") - datetime.timedelta(hours=1)
+                     ).astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        except ValueError:
+            since = None
+        found = client.lookup_remote_orders([it["fingerprint"] for it in items], created_after=since)
+        if found is None:
+            self.log(f"[建立訂單] outbox 有 {len(items)} 筆結果不明，遠端查詢失敗，本次不重送（下次再對帳）")
+            return
+        rc = outbox.recover_in_flight(client.base_url, set(found))
+        self.log(f"[建立訂單] outbox 對帳：遠端已存在 {rc['done']} 筆，重新排入 {rc['requeued']} 筆")
+
+    def run(self, all_records: List[Dict[str, Any]],
+            on_progress: Optional[Callable[[int, str], None]] = None,
+            cancel_event: Optional[threading.Event] = None) -> Dict[str, Any]:
+        """
+        回傳 {"ok", "success", "fail", "skip_remote", "failures", "summary", "transport", "cancelled"}；
+        設定缺失時 {"ok": False, "error": ...}；全部遠端已存在時 "nothing_to_do": True。
+        cancel_event 設定後不再送出新訂單；已送出者仍等待結果並回寫 DB（async 引擎不支援中途取消）。
+        """
+        client = self.client
+        cfg = self.config
+        if not client.base_url or not client.ck or not client.cs:
+            return {"ok": False, "error": "URL 或 Key/Secret 未填"}
+
+        client.preload_remote_fingerprints()
+        outbox = self.outbox
+        if outbox is not None:
+            self._recover_outbox(outbox)
+        fee_rate = cfg.get("platform_fee_rate", 0.07)
+        fee_product_id = int(cfg.get("woo_fee_product_id", 30977))
+
+        to_upload = []
+        skip_remote = 0
+        for rec in all_records:
+            fp = client._fingerprint(rec)
+            if fp in client.remote_fingerprints:
+                skip_remote += 1
+                self.db.update_woo_result(
+                    rec.get("id"),
+                    status="test" if client.test_mode else "success",
+                    order_id=None,
+                    error="remote_dup",
+                    payload={},
+                    fingerprint=fp,
+                    attempts=0
+                )
+                continue
+            to_upload.append(rec)
+
+        self.log(f"[建立訂單] 待上傳:{len(to_upload)} 遠端跳過:{skip_remote}")
+        if not to_upload and not (outbox and outbox.counts(client.base_url)["pending"]):
+            return {"ok": True, "nothing_to_do": True, "success": 0, "fail": 0,
+                    "skip_remote": skip_remote, "failures": [],
+                    "summary": "全部遠端已存在，無需建立。", "transport": client.transport_summary()}
+
+        workers = max(1, int(cfg.get("woo_parallel_workers", 6)))
+        engine = cfg.get("woo_upload_engine", "threads")
+        use_batch = bool(cfg.get("woo_use_batch_endpoint", False))
+        batch_size = min(max(1, int(cfg.get("woo_batch_size", BATCH_MAX_ITEMS))), BATCH_MAX_ITEMS)
+        if engine == "async" and not use_batch:
+            self.log(
+                f"[建立訂單] 開始非同步上傳 起始併發={workers} "
+                f"上限={cfg.get('woo_async_max_concurrency', 32)} test_mode={client.test_mode}"
+            )
+        else:
+            self.log(
+                f"[建立訂單] 開始並行 workers={workers} test_mode={client.test_mode}"
+                + (f" batch={batch_size}" if use_batch else "")
+            )
+
+        success = fail = 0
+        failures = []
+        total = len(to_upload)
+        completed = 0
+        cancelled = False
+        product_display_of = self.product_display_of
+
+        def handle_result(rec, result):
+            nonlocal success, fail, completed
+            fp = result.get("fingerprint")
+            if result["ok"]:
+                status = "test" if client.test_mode else "success"
+                order_id = result.get("order_id")
+                self.db.update_woo_result(
+                    rec.get("id"), status=status,
+                    order_id=str(order_id) if order_id is not None else None,
+                    error=None, payload=result.get("payload"),
+                    fingerprint=fp, attempts=result.get("attempts", 1)
+                )
+                success += 1
+                client.remote_fingerprints.add(fp)
+            else:
+                self.db.update_woo_result(
+                    rec.get("id"), status="error",
+                    order_id=None, error=result.get("error"),
+                    payload=result.get("payload"),
+                    fingerprint=fp, attempts=result.get("attempts", 1)
+                )
+                fail += 1
+                failures.append(f"ID:{rec.get('id')} err:{result.get('error')}")
+            completed += 1
+
+        def refresh_progress():
+            if on_progress:
+                pct = int(completed / total * 100) if total else 100
+                on_progress(pct, f"[訂單建立] {completed}/{total} 成:{success} 失:{fail} 跳遠:{skip_remote}")
+
+        if engine == "async" and not use_batch:
+            def on_async_result(rec, result):
+                handle_result(rec, result)
+                refresh_progress()
+
+            uploader = AsyncWooUploader(
+                client,
+                initial_concurrency=workers,
+                max_concurrency=int(cfg.get("woo_async_max_concurrency", 32))
+            )
+            uploader.upload(to_upload, fee_rate, fee_product_id, product_display_of,
+                            on_result=on_async_result)
+        elif outbox is not None:
+            store = client.base_url
+            rec_by_fp = {}
+            entries = []
+            for rec in to_upload:
+                payload, fp = client.build_order_payload(rec, fee_rate, fee_product_id, product_display_of(rec))
+                rec_by_fp[fp] = rec
+                entries.append((fp, rec.get("id"), payload))
+            added = outbox.enqueue_many(store, entries)
+            # 先前執行已送出成功（但尚未出現在遠端指紋中）者直接記為成功，不重送
+            for fp, order_id in outbox.done_orders(store, rec_by_fp).items():
+                rec = rec_by_fp.pop(fp)
+                handle_result(rec, {"ok": True, "order_id": order_id, "payload": {},
+                                    "fingerprint": fp, "attempts": 0})
+            counts = outbox.counts(store)
+            total = completed + counts["pending"]
+            self.log(
+                f"[建立訂單] outbox 新增:{added} 待送:{counts['pending']} "
+                f"前次失敗:{counts['failed']} 前次已完成:{completed}"
+            )
+            max_attempts = int(cfg.get("woo_outbox_max_attempts", 5))
+            results_q = queue.Queue()
+
+            if use_batch:
+                def send_items(items):
+                    return client.post_payloads_batch([(it["payload"], it["fingerprint"]) for it in items],
+                                                      batch_size=batch_size)
+            else:
+                def send_items(items):
+                    return [client.post_order_payload(it["payload"], it["fingerprint"]) for it in items]
+
+            dispatcher = OutboxDispatcher(
+                outbox, store, send_items,
+                workers=workers,
+                claim_size=batch_size if use_batch else 1,
+                max_attempts=max_attempts,
+                on_result=lambda item, result: results_q.put((item, result))
+            )
+            dispatcher.start()
+            resumed = 0
+            while dispatcher.is_alive() or not results_q.empty():
+                if not cancelled and cancel_event is not None and cancel_event.is_set():
+                    # 未 claim 的項目維持 pending，下次執行續傳
+                    cancelled = True
+                    dispatcher.stop()
+                try:
+                    item, result = results_q.get(timeout=0.2)
+                except queue.Empty:
+                    continue
+                if item["status"] == IN_FLIGHT:
+                    self.log(f"[建立訂單] fp={item['fingerprint'][:12]} 結果不明，下次執行先與遠端對帳")
+                    continue
+                if item["status"] not in (DONE, FAILED):
+                    # 之後仍會重送；僅記錄，不計入完成
+                    self.log(f"[建立訂單] fp={item['fingerprint'][:12]} 第{item['attempts']}次失敗，稍後重試")
+                    continue
+                rec = rec_by_fp.get(item["fingerprint"])
+                if rec is None:
+                    # 前次執行留下的項目；本次沒有對應的本機紀錄，不回寫 DB
+                    resumed += 1
+                    completed += 1
+                    if result.get("ok"):
+                        success += 1
+                        client.remote_fingerprints.add(item["fingerprint"])
+                    else:
+                        fail += 1
+                        failures.append(f"fp:{item['fingerprint'][:12]} err:{result.get('error')}")
+                else:
+                    result["attempts"] = item["attempts"]
+                    handle_result(rec, result)
+                refresh_progress()
+            left = outbox.counts(store)
+            if resumed or left["pending"] or left["in_flight"]:
+                self.log(f"[建立訂單] outbox 續傳前次:{resumed} 留待下次:{left['pending']} 待對帳:{left['in_flight']}")
+        else:
+            def task_fn(rec):
+                return [client.create_order_full(
+                    rec,
+                    fee_rate=fee_rate,
+                    fee_product_id=fee_product_id,
+                    product_display=product_display_of(rec)
+                )]
+
+            def batch_task_fn(chunk):
+                return client.create_orders_batch(
+                    chunk,
+                    fee_rate=fee_rate,
+                    fee_product_id=fee_product_id,
+                    product_display_of=product_display_of,
+                    batch_size=batch_size
+                )
+
+            if use_batch:
+                units = [to_upload[i:i + batch_size] for i in range(0, len(to_upload), batch_size)]
+                run_fn = batch_task_fn
+            else:
+                units = [[rec] for rec in to_upload]
+                run_fn = lambda unit: task_fn(unit[0])
+
+            with ThreadPoolExecutor(max_workers=workers) as ex:
+                future_map = {ex.submit(run_fn, unit): unit for unit in units}
+                for fut in as_completed(future_map):
+                    if fut.cancelled():
+                        continue
+                    for rec, result in zip(future_map[fut], fut.result()):
+                        handle_result(rec, result)
+                    refresh_progress()
+                    if not cancelled and cancel_event is not None and cancel_event.is_set():
+                        # 尚未開始的取消；執行中的照常等待結果
+                        cancelled = True
+                        for f in future_map:
+                            f.cancel()
+
+        summary = f"[訂單建立] {'已取消' if cancelled else '完成'} 成功:{success} 失敗:{fail} 跳遠:{skip_remote}"
+        self.log(summary)
+        transport = client.transport_summary()
+        self.log(f"[連線] {transport}")
+        return {"ok": True, "success": success, "fail": fail, "skip_remote": skip_remote,
+                "failures": failures, "summary": summary, "transport": transport, "cancelled": cancelled}
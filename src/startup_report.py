@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+啟動效能報告
+
+    cd src
+    python -m startup_report               # 3 次取中位數，列出最耗時的 import
+    python -m startup_report --runs 5 --top 30 --json
+
+以 `python -X importtime main.py` 啟動 GUI（EXCEL_AUTO_STARTUP_PROBE=1：視窗顯示、第一輪事件迴圈後即結束），
+統計：
+- first_window_ms：main.py 開始執行到視窗出現（目標值 startup_target_ms，超過則結束碼 1）
+- import_ms：main.py 頂層 import 耗時
+- 啟動時即被載入的重模組（pandas / PIL / pilmoji / openpyxl / requests ...），這些應延遲到用到的步驟才載入
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+from pathlib import Path
+
+from modules.resources import get_config_path
+
+SRC_DIR = Path(__file__).resolve().parent
+DEFAULT_TARGET_MS = 1500
+HEAVY_MODULES = ("pandas", "numpy", "PIL", "pilmoji", "openpyxl", "xlrd", "requests", "urllib3",
+                 "httpx", "aiohttp", "product_dialogues", "modules.chat_image_generator",
+                 "modules.excel_parser", "modules.bank_excel_converter", "modules.match_report")
+
+_IMPORTTIME_RE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)\s*$")
+
+
+def parse_importtime(stderr: str):
+    """回傳 [(module, self_us, cumulative_us, depth)]（依 stderr 順序）。"""
+    rows = []
+    for line in stderr.splitlines():
+        m = _IMPORTTIME_RE.match(line)
+        if not m:
+            continue
+        depth = (len(m.group(3)) - 1) // 2
+        rows.append((m.group(4), int(m.group(1)), int(m.group(2)), depth))
+    return rows
+
+
+def run_once(offscreen: bool):
+    env = dict(os.environ)
+    env["EXCEL_AUTO_STARTUP_PROBE"] = "1"
+    if offscreen:
+        env["QT_QPA_PLATFORM"] = "offscreen"
+    t0 = time.perf_counter()
+    p = subprocess.run([sys.executable, "-X", "importtime", "main.py"], cwd=str(SRC_DIR),
+                       env=env, capture_output=True, text=True, encoding="utf-8", errors="replace")
+    wall_ms = (time.perf_counter() - t0) * 1000
+    probe = None
+    for line in p.stdout.splitlines():
+        if '"startup_probe"' in line:
+            try:
+                probe = json.loads(line)
+            except ValueError:
+                pass
+    if probe is None:
+        tail = "\n".join(l for l in p.stderr.splitlines() if not l.startswith("import time:"))[-2000:]
+        raise RuntimeError(f"main.py 未回報啟動量測 (exit={p.returncode})\n{tail}")
+    probe["wall_ms"] = round(wall_ms, 1)
+    probe["imports"] = parse_importtime(p.stderr)
+    return probe
+
+
+def summarize(runs, top: int, target_ms: float):
+    def med(key):
+        return round(statistics.median(r[key] for r in runs), 1)
+
+    # 以最後一次為準列出 import 明細（前幾次可能包含 .pyc 編譯）
+    imports = runs[-1]["imports"]
+    top_level = sorted((r for r in imports if r[3] == 0), key=lambda r: r[2], reverse=True)
+    loaded = {r[0] for r in imports}
+    heavy = sorted(m for m in HEAVY_MODULES if m in loaded)
+    first_window = med("first_window_ms")
+    return {
+        "runs": len(runs),
+        "first_window_ms": first_window,
+        "import_ms": med("import_ms"),
+        "wall_ms": med("wall_ms"),
+        "target_ms": target_ms,
+        "within_target": first_window <= target_ms,
+        "modules_loaded": runs[-1].get("modules"),
+        "heavy_imports_at_startup": heavy,
+        "top_imports": [{"module": m, "self_ms": round(s / 1000, 1), "cumulative_ms": round(c / 1000, 1)}
+                        for m, s, c, _d in top_level[:top]],
+    }
+
+
+def format_report(rep) -> str:
+    lines = [
+        f"啟動量測（{rep['runs']} 次中位數）",
+        f"  視窗出現: {rep['first_window_ms']} ms（目標 {rep['target_ms']} ms，"
+        f"{'達標' if rep['within_target'] else '未達標'}）",
+        f"  頂層 import: {rep['import_ms']} ms   行程總時間: {rep['wall_ms']} ms   模組數: {rep['modules_loaded']}",
+        f"  啟動即載入的重模組: {', '.join(rep['heavy_imports_at_startup']) or '無'}",
+        "",
+        f"{'cumulative ms':>14} {'self ms':>9}  module",
+    ]
+    for r in rep["top_imports"]:
+        lines.append(f"{r['cumulative_ms']:>14.1f} {r['self_ms']:>9.1f}  {r['module']}")
+    return "\n".join(lines)
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m startup_report", description="GUI 啟動耗時與 import 報告")
+    ap.add_argument("--runs", type=int, default=3)
+    ap.add_argument("--top", type=int, default=25, help="列出前 N 個頂層 import")
+    ap.add_argument("--target-ms", type=float, help="視窗出現目標（預設 config startup_target_ms）")
+    ap.add_argument("--offscreen", action="store_true", help="以 QT_QPA_PLATFORM=offscreen 執行（無顯示器時自動啟用）")
+    ap.add_argument("--json", action="store_true", help="輸出 JSON")
+    args = ap.parse_args(argv)
+
+    target = args.target_ms
+    if target is None:
+        try:
+            with open(get_config_path(), "r", encoding="utf-8") as f:
+                target = float(json.load(f).get("startup_target_ms", DEFAULT_TARGET_MS))
+        except Exception:
+            target = DEFAULT_TARGET_MS
+    offscreen = args.offscreen or (sys.platform.startswith("linux") and not os.environ.get("DISPLAY")
+                                   and not os.environ.get("WAYLAND_DISPLAY"))
+    try:
+        runs = [run_once(offscreen) for _ in range(max(1, args.runs))]
+    except RuntimeError as e:
+        print(str(e), file=sys.stderr)
+        return 2
+    rep = summarize(runs, args.top, target)
+    print(json.dumps(rep, ensure_ascii=False) if args.json else format_report(rep))
+    return 0 if rep["within_target"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
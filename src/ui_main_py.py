@@ -201,8 +201,8 @@ class Ui_MainWindow(object):
         rowBatch = QtWidgets.QHBoxLayout()
         rowBatch.addWidget(QtWidgets.QLabel("單次最大上傳筆數："))
         self.spinWooBatch = QtWidgets.QSpinBox()
-        self.spinWooBatch.setRange(1, 2000)
-        self.spinWooBatch.setValue(200)
+        self.spinWooBatch.setRange(1, 100)
+        self.spinWooBatch.setValue(100)
         rowBatch.addWidget(self.spinWooBatch)
         gws.addLayout(rowBatch)
 
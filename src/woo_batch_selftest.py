@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""
+Woo /orders/batch 建單自我檢查（本機 WooCommerce 模擬伺服器，不連外網）
+
+    cd src
+    python -m woo_batch_selftest                # 每情境 6 筆，有 / 無指紋索引各跑一次
+    python -m woo_batch_selftest --size 40
+
+逐一驗證 WooClient.create_orders_batch：
+- 整批成功
+- 逐項錯誤（錯誤項帶 / 不帶指紋）→ 只補送未建立者
+- 逾時 / 5xx（伺服器已建立部分訂單）→ 不重送整批，先對帳再補送查無者
+- 回應缺項（伺服器已建立但回應漏掉）→ 對帳後不重複建立
+- 對帳失敗（批次 5xx 且查詢也失敗）→ 標為結果不明，不補送
+每個情境結束時檢查遠端每個指紋恰好一筆訂單。全部通過結束碼 0，否則 1。
+"""
+
+import sys
+import json
+import time
+import argparse
+import threading
+from datetime import datetime, timedelta
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import modules.woo_client as wc
+from modules.woo_client import WooClient
+from modules.woo_fingerprint_index import FingerprintIndex
+
+ORDERS_PATH = "/wp-json/wc/v3/orders"
+
+
+class StubWoo:
+    """
+    最小的 WooCommerce 訂單 API：POST orders / orders/batch、GET orders（分頁、modified_after、after、exclude）。
+    mode 決定 batch 的行為：ok / item_errors / timeout / 5xx / missing / lookup_fail。
+    """
+
+    def __init__(self, mode: str = "ok", delay: float = 0.0):
+        self.mode = mode
+        self.delay = delay
+        self.orders = {}          # id -> order
+        self.next_id = 1000
+        self.batch_posts = 0
+        self.single_posts = 0
+        self.lock = threading.Lock()
+        self.clock = datetime(2026, 1, 1)
+        srv = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, data, extra=None):
+                body = json.dumps(data).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for k, v in (extra or {}).items():
+                    self.send_header(k, v)
+                self.end_headers()
+                try:
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+            def do_POST(self):
+                path = urlparse(self.path).path
+                data = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+                if path == ORDERS_PATH + "/batch":
+                    status, out = srv.handle_batch(data.get("create") or [])
+                    if status is None:
+                        return   # 逾時：已處理但不回應
+                    self._send(status, out)
+                elif path == ORDERS_PATH:
+                    with srv.lock:
+                        srv.single_posts += 1
+                        self._send(201, srv.create(data))
+                else:
+                    self._send(404, {"code": "rest_no_route"})
+
+            def do_GET(self):
+                u = urlparse(self.path)
+                if u.path != ORDERS_PATH:
+                    return self._send(404, {"code": "rest_no_route"})
+                if srv.mode == "lookup_fail":
+                    return self._send(500, {"code": "internal_server_error"})
+                q = {k: v[-1] for k, v in parse_qs(u.query).items()}
+                self._send(200, srv.list_orders(q))
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.base_url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    @staticmethod
+    def fingerprint_of(payload):
+        for m in payload.get("meta_data") or []:
+            if m.get("key") == "tx_fingerprint":
+                return m.get("value")
+        return None
+
+    def create(self, payload):
+        self.next_id += 1
+        self.clock += timedelta(seconds=1)
+        order = {"id": self.next_id, "meta_data": payload.get("meta_data") or [],
+                 "date_created_gmt": self.clock.strftime("%Y-%m-%dT%H:%M:%S"),
+                 "date_modified_gmt": self.clock.strftime("%Y-%m-%dT%H:%M:%S")}
+        self.orders[order["id"]] = order
+        return order
+
+    def handle_batch(self, items):
+        """回傳 (status, body)；status None 表示已處理但讓用戶端逾時。"""
+        with self.lock:
+            self.batch_posts += 1
+            mode = self.mode
+            if mode == "item_errors":
+                out = []
+                for i, p in enumerate(items):
+                    if i % 3 == 1:      # 錯誤項帶指紋
+                        out.append({"id": 0, "meta_data": p.get("meta_data"),
+                                    "error": {"code": "woocommerce_rest_invalid", "message": "bad item"}})
+                    elif i % 3 == 2:    # 錯誤項不帶指紋（WooCommerce 實際的格式）
+                        out.append({"id": 0, "error": {"code": "woocommerce_rest_invalid", "message": "bad item"}})
+                    else:
+                        out.append(self.create(p))
+                return 200, {"create": out}
+            if mode in ("timeout", "5xx", "lookup_fail"):
+                for p in items[: len(items) // 2]:
+                    self.create(p)
+                if mode == "timeout":
+                    time.sleep(self.delay)
+                    return None, None
+                return 502, {"code": "bad_gateway"}
+            created = [self.create(p) for p in items]
+            if mode == "missing":
+                # 全部建立，但回應漏掉後半、其餘倒序
+                created = list(reversed(created[: len(created) // 2]))
+            return 200, {"create": created}
+
+    def list_orders(self, q):
+        with self.lock:
+            rows = list(self.orders.values())
+        if q.get("modified_after"):
+            rows = [o for o in rows if o["date_modified_gmt"] > q["modified_after"]]
+        if q.get("after"):
+            rows = [o for o in rows if o["date_created_gmt"] > q["after"]]
+        exclude = {int(x) for x in (q.get("exclude") or "").split(",") if x}
+        rows = [o for o in rows if o["id"] not in exclude]
+        key = {"modified": "date_modified_gmt", "date": "date_created_gmt"}.get(q.get("orderby"), "id")
+        rows.sort(key=lambda o: (o[key], o["id"]), reverse=q.get("order") == "desc")
+        per, page = int(q.get("per_page", 10)), int(q.get("page", 1))
+        return rows[(page - 1) * per: page * per]
+
+    def fingerprint_counts(self):
+        counts = {}
+        for o in self.orders.values():
+            fp = self.fingerprint_of(o)
+            counts[fp] = counts.get(fp, 0) + 1
+        return counts
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def _records(n: int, tag: str):
+    return [{"id": i, "direction": "in" if i % 2 else "out", "order_no": f"{tag}{i:04d}",
+             "apply_time": "2026-01-01 10:00:00", "amount": str(100 + i), "customer_name": f"客戶{i}",
+             "product_type": "game_currency"} for i in range(n)]
+
+
+def run_case(mode: str, size: int, use_index: bool):
+    timeout = 1.0
+    srv = StubWoo(mode, delay=timeout * 2)
+    try:
+        idx = FingerprintIndex(":memory:") if use_index else None
+        client = WooClient(srv.base_url, "ck", "cs", timeout=timeout, test_mode=False,
+                           fingerprint_index=idx, collect_timings=False)
+        recs = _records(size, mode)
+        res = client.create_orders_batch(recs, 0.07, 1, lambda r: "遊戲幣")
+        fps = [r["fingerprint"] for r in res]
+        counts = srv.fingerprint_counts()
+        dup = [fp for fp in fps if counts.get(fp, 0) > 1]
+        assert not dup, f"重複建立 {len(dup)} 筆"
+        assert srv.batch_posts == 1, f"批次送出 {srv.batch_posts} 次（不應重送整批）"
+        ok = sum(1 for r in res if r["ok"])
+        for r in res:
+            if r["ok"]:
+                assert counts.get(r["fingerprint"]) == 1, "回報成功但遠端沒有該訂單"
+                order = srv.orders.get(r["order_id"])
+                assert order and srv.fingerprint_of(order) == r["fingerprint"], "order_id 對應到錯誤的記錄"
+        if mode == "lookup_fail":
+            assert srv.single_posts == 0, f"對帳失敗卻補送 {srv.single_posts} 筆"
+            unsure = [r for r in res if not r["ok"]]
+            assert unsure and all(r.get("uncertain") for r in unsure), "未建立者應標為結果不明"
+        else:
+            assert ok == size, f"成功 {ok}/{size}"
+            assert all(counts.get(fp) == 1 for fp in fps), "有記錄未在遠端建立"
+        return f"成功 {ok}/{size}，單筆補送 {srv.single_posts}，遠端 {len(srv.orders)} 筆"
+    finally:
+        srv.close()
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m woo_batch_selftest", description="Woo 批次建單自我檢查（本機模擬伺服器）")
+    ap.add_argument("--size", type=int, default=6, help="每個情境的訂單數（1~100）")
+    args = ap.parse_args(argv)
+    size = min(max(args.size, 2), wc.BATCH_MAX_ITEMS)
+    wc.BACKOFF_SECONDS = [0.05, 0.05, 0.05]
+
+    cases = [("ok", "整批成功"), ("item_errors", "逐項錯誤"), ("timeout", "逾時（已部分建立）"),
+             ("5xx", "5xx（已部分建立）"), ("missing", "回應缺項 / 亂序"), ("lookup_fail", "對帳失敗")]
+    results = []
+    for use_index in (False, True):
+        for mode, name in cases:
+            label = f"{name}{' [索引]' if use_index else ''}"
+            t0 = time.perf_counter()
+            try:
+                detail = run_case(mode, size, use_index)
+                results.append((label, True, detail, time.perf_counter() - t0))
+            except Exception as e:
+                results.append((label, False, repr(e), time.perf_counter() - t0))
+
+    for name, ok, detail, secs in results:
+        print(f"{'OK ' if ok else 'NG '} {name:<22} {secs:6.2f}s  {detail}")
+    return 0 if all(ok for _n, ok, _d, _s in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())